@@ -0,0 +1,451 @@
+"""
+Cassette
+
+Records the api calls of a real handler run, request and response, so the
+run can be replayed later with no aws account and no network.
+
+A cassette is gzipped json. Each interaction keeps the service, operation,
+a key of its params, the parsed response and how long the call took. Big
+request params (template bodies, s3 objects being put) only keep their
+size, the key is enough to match them.
+
+Replay answers each call with the recorded response for the same params,
+in the order they were recorded, so polling a stack plays back its status
+changes. A lookup by ids only gets back the resources it named. Calls with params never recorded (a body with a timestamp in it)
+get the next recorded response for the operation. Synthetic latency can be
+set per operation, or the recorded latency used, to put the network back
+into the numbers.
+
+A cassette can be scaled up. Every resource listed in a response is
+cloned with fresh ids, consistently across calls, so a recorded account of
+100 resources replays as one of 1000. Calls made for the clones are
+matched to the calls made for the originals.
+"""
+
+import base64
+import copy
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Pattern, Set, Tuple
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+CASSETTE_VERSION = 1
+
+# Request params longer than this only keep their size
+MAX_PARAM_LENGTH = 1024
+
+# Where the cassette keeps its state between the events of one call
+CONTEXT_PARAMS_KEY = 'cassetteApiParams'
+CONTEXT_STARTED_AT_KEY = 'cassetteStartedAt'
+
+# Clones get the id of the original with this suffix e.g. i-0588d57988d34fa26-clone0001
+CLONE_SUFFIX = '-clone{:04d}'
+CLONE_SUFFIX_PATTERN = re.compile(r'-clone\d{4}')
+# Shorter ids would be renamed inside unrelated strings
+MIN_ID_LENGTH = 4
+
+# Resources listed by each operation as (response list key, param that looks up one by name)
+SCALED_LISTS = {
+    ('ec2', 'DescribeInstances'): ('Reservations', None),
+    ('resourcegroupstaggingapi', 'GetResources'): ('ResourceTagMappingList', None),
+    ('rds', 'DescribeDBInstances'): ('DBInstances', 'DBInstanceIdentifier'),
+    ('elasticbeanstalk', 'DescribeEnvironments'): ('Environments', None),
+    ('apigateway', 'GetRestApis'): ('items', None),
+    ('ecs', 'ListClusters'): ('clusterArns', None),
+    ('ecs', 'DescribeClusters'): ('clusters', None),
+    ('autoscaling', 'DescribeAutoScalingGroups'): ('AutoScalingGroups', None),
+    ('sqs', 'ListQueues'): ('QueueUrls', None),
+    ('stepfunctions', 'ListStateMachines'): ('stateMachines', None),
+    ('cloudformation', 'DescribeStacks'): ('Stacks', 'StackName'),
+    ('cloudformation', 'ListStacks'): ('StackSummaries', None)
+}
+
+# Fields of a listed resource that identify it, renamed on its clones
+ID_KEYS = {
+    'InstanceId', 'ReservationId', 'NetworkInterfaceId', 'ResourceARN', 'DBInstanceIdentifier', 'DBInstanceArn',
+    'DbiResourceId', 'EnvironmentName', 'EnvironmentId', 'EnvironmentArn', 'id', 'name', 'clusterArn',
+    'clusterName', 'AutoScalingGroupName', 'AutoScalingGroupARN', 'StackName', 'StackId', 'stateMachineArn'
+}
+
+
+class CassetteMissError(Exception):
+    def __init__(self, service_name: str, operation_name: str):
+        self.service_name = service_name
+        self.operation_name = operation_name
+
+    def __str__(self):
+        return f'no recorded response for {self.service_name}.{self.operation_name}'
+
+
+class Cassette():
+    def __init__(self, interactions: Optional[List[Dict[str, Any]]] = None, meta: Optional[Dict[str, Any]] = None):
+        # Recorded calls, in the order they were made
+        self.interactions: List[Dict[str, Any]] = interactions or []
+        # Handler, event and account the calls were recorded for
+        self.meta: Dict[str, Any] = meta or {}
+
+    @staticmethod
+    def load(path: str) -> 'Cassette':
+        with gzip.open(path, 'rt', encoding='utf-8') as cassette_file:
+            content = json.load(cassette_file, object_hook=_decode_value)
+
+        if content.get('version') != CASSETTE_VERSION:
+            raise ValueError(f"cassette {path} is version {content.get('version')}, expected {CASSETTE_VERSION}")
+
+        return Cassette(interactions=content['interactions'], meta=content.get('meta', {}))
+
+    def save(self, path: str):
+        content = {
+            'version': CASSETTE_VERSION,
+            'meta': self.meta,
+            'interactions': self.interactions
+        }
+
+        with gzip.open(path, 'wt', encoding='utf-8') as cassette_file:
+            json.dump(content, cassette_file, separators=(',', ':'), default=_encode_value)
+
+    def scale(self, factor: int) -> 'Cassette':
+        """Copy of the cassette with every listed resource cloned factor - 1 times under fresh ids"""
+
+        interactions = []
+
+        for interaction in self.interactions:
+            interaction = copy.deepcopy(interaction)
+            list_key, lookup_param = SCALED_LISTS.get((interaction['service'], interaction['operation']),
+                                                      (None, None))
+            items = interaction['response'].get(list_key) if list_key else None
+
+            # A lookup by name answers for that one resource, its clones are matched back to it
+            if items and not (lookup_param and interaction['params'].get(lookup_param)):
+                interaction['response'][list_key] = [
+                    clone for item in items for clone in _clone_item(item, factor)
+                ]
+
+            interactions.append(interaction)
+
+        return Cassette(interactions=interactions, meta={**self.meta, 'scale': self.meta.get('scale', 1) * factor})
+
+
+class CassetteRecorder():
+    def __init__(self, meta: Optional[Dict[str, Any]] = None):
+        self.cassette = Cassette(meta=meta)
+        self.lock = threading.Lock()
+
+    def attach(self, session: boto3.session.Session):
+        """Record the calls of every client made from the session after this"""
+
+        session.events.register('before-parameter-build', self._on_call_start, unique_id='cassette-record-start')
+        session.events.register('after-call', self._on_call_end, unique_id='cassette-record-end')
+
+    @staticmethod
+    def _on_call_start(params: Dict[str, Any], context: Dict[str, Any], **kwargs):
+        context[CONTEXT_PARAMS_KEY] = params
+        context[CONTEXT_STARTED_AT_KEY] = time.perf_counter()
+
+    def _on_call_end(self, http_response, parsed: Dict[str, Any], model, context: Dict[str, Any], **kwargs):
+        started_at = context.get(CONTEXT_STARTED_AT_KEY)
+        params = context.get(CONTEXT_PARAMS_KEY, {})
+
+        response = {}
+
+        for key, value in parsed.items():
+            if key == 'ResponseMetadata':
+                continue
+
+            if isinstance(value, StreamingBody):
+                # Read once for the cassette, the caller gets a fresh stream over the same bytes
+                body = value.read()
+                parsed[key] = StreamingBody(io.BytesIO(body), len(body))
+                response[key] = _RecordedStream(body)
+            else:
+                # The caller is free to change what it got back
+                response[key] = copy.deepcopy(value)
+
+        interaction = {
+            'service': model.service_model.service_name,
+            'operation': model.name,
+            'key': get_params_key(params),
+            'params': {key: _elide(value) for key, value in params.items()},
+            'status': http_response.status_code,
+            'ms': round((time.perf_counter() - started_at) * 1000, 1) if started_at else None,
+            'response': response
+        }
+
+        with self.lock:
+            self.cassette.interactions.append(interaction)
+
+
+class CassettePlayer():
+    def __init__(self, cassette: Cassette, latency: Optional[Dict[str, float]] = None,
+                 recorded_latency: bool = False):
+        self.cassette = cassette
+        # Milliseconds to sleep per service.Operation, '*' for every other operation
+        self.latency = latency or {}
+        # Sleep for as long as the recorded call took, unless latency is set for it
+        self.recorded_latency = recorded_latency
+
+        self.lock = threading.Lock()
+        self.rewind()
+
+    def make_session(self, region_name: Optional[str] = None) -> boto3.session.Session:
+        """Session with fake credentials, add the player with attach before making clients"""
+
+        return boto3.session.Session(aws_access_key_id='cassette', aws_secret_access_key='cassette',
+                                     region_name=region_name or self.cassette.meta.get('region'))
+
+    def attach(self, session: boto3.session.Session):
+        """Answer the calls of every client made from the session after this"""
+
+        session.events.register('before-parameter-build', self._remember_params, unique_id='cassette-play-params')
+        session.events.register('before-call', self._respond, unique_id='cassette-play-respond')
+
+    def rewind(self):
+        """Play the cassette from the start again"""
+
+        with self.lock:
+            # Interactions still to play, by exact params and by operation
+            self.by_key: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+            self.by_operation: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+
+            for interaction in self.cassette.interactions:
+                operation = (interaction['service'], interaction['operation'])
+                self.by_key.setdefault((*operation, interaction['key']), []).append(interaction)
+                self.by_operation.setdefault(operation, []).append(interaction)
+
+    @staticmethod
+    def _remember_params(params: Dict[str, Any], context: Dict[str, Any], **kwargs):
+        # before-call only sees the serialized request, keep the params it was made from
+        context[CONTEXT_PARAMS_KEY] = params
+
+    def _respond(self, model, context: Dict[str, Any], **kwargs) -> Tuple[AWSResponse, Dict[str, Any]]:
+        """Answer with the recorded response, returning a response stops botocore sending the request"""
+
+        service_name = model.service_model.service_name
+        operation_name = model.name
+
+        params = context.get(CONTEXT_PARAMS_KEY, {})
+        interaction = self._next_interaction(service_name, operation_name, params)
+
+        delay_ms = self.latency.get(f'{service_name}.{operation_name}', self.latency.get('*'))
+
+        if delay_ms is None and self.recorded_latency:
+            delay_ms = interaction.get('ms')
+
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+        parsed = {
+            key: StreamingBody(io.BytesIO(value.body), len(value.body)) if isinstance(value, _RecordedStream) else value
+            for key, value in copy.deepcopy(interaction['response']).items()
+        }
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': interaction['status'], 'RetryAttempts': 0}
+
+        list_key, _ = SCALED_LISTS.get((service_name, operation_name), (None, None))
+
+        if parsed.get(list_key):
+            parsed[list_key] = _get_requested_items(parsed[list_key], params)
+
+        # botocore raises the recorded error for a status over 300, same as it would have
+        return AWSResponse('https://cassette.invalid', interaction['status'], {}, None), parsed
+
+    def _next_interaction(self, service_name: str, operation_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Next recorded call with the same params, else the next call of the operation, the last one repeats"""
+
+        with self.lock:
+            queue = self.by_key.get((service_name, operation_name, get_params_key(params)))
+
+            if not queue:
+                queue = self.by_operation.get((service_name, operation_name))
+
+            if not queue:
+                raise CassetteMissError(service_name, operation_name)
+
+            return queue.pop(0) if len(queue) > 1 else queue[0]
+
+
+class _RecordedStream():
+    """Body of a streamed response, kept as bytes"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+
+def get_params_key(params: Dict[str, Any]) -> str:
+    """Key of the request params, the same for a clone as for its original"""
+
+    canonical = json.dumps(_strip_clone_ids(params), sort_keys=True, separators=(',', ':'), default=_encode_value)
+
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def _strip_clone_ids(value: Any) -> Any:
+    """Ids of clones back to the ids of their originals, a list asking for both asks once"""
+
+    if isinstance(value, str):
+        return CLONE_SUFFIX_PATTERN.sub('', value)
+
+    if isinstance(value, dict):
+        return {key: _strip_clone_ids(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        stripped: List[Any] = []
+
+        for item in value:
+            item = _strip_clone_ids(item)
+            if item not in stripped:
+                stripped.append(item)
+
+        return stripped
+
+    return value
+
+
+def _get_requested_items(items: List[Any], params: Dict[str, Any]) -> List[Any]:
+    """
+    Items the request asked for by id, every item if it didnt name any.
+    Batches of lookups for clones share one recording, each batch only gets
+    its own resources back.
+    """
+
+    requested = _get_strings(params)
+    matched = [item for item in items if _get_ids(item) & requested]
+
+    return matched or items
+
+
+def _get_strings(value: Any) -> Set[str]:
+    if isinstance(value, str):
+        return {value}
+
+    if isinstance(value, dict):
+        return set().union(*(_get_strings(item) for item in value.values()))
+
+    if isinstance(value, (list, tuple)):
+        return set().union(*(_get_strings(item) for item in value))
+
+    return set()
+
+
+def _clone_item(item: Any, factor: int) -> List[Any]:
+    """The item followed by its clones, the ids in every string of a clone get the clone suffix"""
+
+    pattern = _get_id_pattern(_get_ids(item))
+
+    if not pattern:
+        return [item]
+
+    return [item] + [
+        _rename(item, pattern, CLONE_SUFFIX.format(index)) for index in range(1, factor)
+    ]
+
+
+def _get_ids(item: Any) -> Set[str]:
+    if isinstance(item, str):
+        # Lists of arns e.g. ListClusters
+        return _get_ids({'ResourceARN': item})
+
+    if not isinstance(item, dict):
+        return set()
+
+    ids = {
+        value for key, value in item.items()
+        if key in ID_KEYS and isinstance(value, str) and len(value) >= MIN_ID_LENGTH
+    }
+
+    # The name at the end of an arn is the resource name, tags e.g. Name carry it too
+    ids.update(value.split(':')[-1].split('/')[-1] for value in list(ids) if value.startswith('arn:'))
+
+    # Reservations list their instances
+    for value in item.values():
+        if isinstance(value, list):
+            for nested in value:
+                if isinstance(nested, dict):
+                    ids.update(_get_ids(nested))
+
+    return ids
+
+
+def _get_id_pattern(ids: Set[str]) -> Optional[Pattern]:
+    """
+    Match the ids that dont contain another id, an arn built from a name is
+    renamed through its name so it stays the arn of the renamed resource
+    """
+
+    leaves = [
+        value for value in ids
+        if len(value) >= MIN_ID_LENGTH and not any(other != value and other in value for other in ids)
+    ]
+
+    if not leaves:
+        return None
+
+    return re.compile('|'.join(re.escape(leaf) for leaf in sorted(leaves, key=len, reverse=True)))
+
+
+def _rename(value: Any, pattern: Pattern, suffix: str) -> Any:
+    if isinstance(value, str):
+        return pattern.sub(lambda match: match.group(0) + suffix, value)
+
+    if isinstance(value, dict):
+        return {key: _rename(item, pattern, suffix) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [_rename(item, pattern, suffix) for item in value]
+
+    return value
+
+
+def _elide(value: Any) -> Any:
+    """Big params keep only their size"""
+
+    if isinstance(value, (str, bytes)) and len(value) > MAX_PARAM_LENGTH:
+        return {'$elided': len(value)}
+
+    if isinstance(value, io.IOBase):
+        return {'$elided': 'stream'}
+
+    return value
+
+
+def _encode_value(value: Any) -> Any:
+    """json has no datetimes or bytes, tag them so they load back as what they were"""
+
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+
+    if isinstance(value, _RecordedStream):
+        return {'$stream': base64.b64encode(value.body).decode('ascii')}
+
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+
+    if isinstance(value, io.IOBase):
+        return {'$elided': 'stream'}
+
+    raise TypeError(f'cannot record {type(value).__name__}')
+
+
+def _decode_value(value: Dict[str, Any]) -> Any:
+    if len(value) != 1:
+        return value
+
+    if '$datetime' in value:
+        parsed = datetime.fromisoformat(value['$datetime'])
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    if '$stream' in value:
+        return _RecordedStream(base64.b64decode(value['$stream']))
+
+    if '$bytes' in value:
+        return base64.b64decode(value['$bytes'])
+
+    return value
@@ -0,0 +1,224 @@
+"""
+SyntheticFleet
+
+Generates a spoke account worth of resources for the benchmarks, shaped
+the way botocore hands them back for every supported service.
+
+Tags follow the mix seen in real accounts: most resources opt in, owners
+are skewed so a few teams own most of the fleet, and a share of the
+resources list their own metrics per level, override alarm props for the
+whole resource or for a single metric, and carry a handful of tags that
+have nothing to do with cloudwedge.
+
+The fleet is generated from a seed, the same arguments always give the
+same fleet so results can be compared between commits.
+"""
+
+import random
+from typing import Any, Dict, List
+
+from cloudwedge.models import AWSService
+from cloudwedge.services import ServiceRegistry
+
+# Share of resources tagged cloudwedge:active=true
+OPT_IN_RATIO = 0.85
+# Share of the opted in resources carrying each kind of cloudwedge tag
+LEVEL_TAG_RATIO = 0.6
+METRICS_TAG_RATIO = 0.3
+LEVEL_METRICS_TAG_RATIO = 0.15
+ALARM_PROP_TAG_RATIO = 0.2
+METRIC_PROP_TAG_RATIO = 0.25
+
+# Tags most resources carry that cloudwedge ignores
+EXTRA_TAG_KEYS = ['Environment', 'CostCenter', 'Application', 'aws:cloudformation:stack-name',
+                  'aws:cloudformation:logical-id', 'Team', 'ManagedBy', 'Version']
+
+# Autoscaling group metrics collection
+ASG_ENABLED_METRICS = [{'Metric': 'GroupInServiceInstances', 'Granularity': '1Minute'}]
+
+
+class SyntheticFleet():
+    def __init__(self, resources_per_service: int = 100, owners: int = 10, seed: int = 1,
+                 account_id: str = '123456789012', region: str = 'us-west-2'):
+
+        self.resources_per_service = resources_per_service
+        self.owner_names = [f'team{index:03d}' for index in range(max(1, owners))]
+        self.account_id = account_id
+        self.region = region
+
+        self.random = random.Random(seed)
+        # Zipf like weights, the first owners get most of the fleet
+        self.owner_weights = [1 / (rank + 1) for rank in range(len(self.owner_names))]
+
+        # Generated resources with their arn and tags, keyed by service name
+        self.raw: Dict[str, List[Dict[str, Any]]] = {}
+
+        self._generate()
+
+    def get_counts(self) -> Dict[str, Any]:
+        """Summary of the generated fleet"""
+
+        return {
+            'resourcesPerService': self.resources_per_service,
+            'owners': len(self.owner_names),
+            'services': {service_name: len(resources) for service_name, resources in self.raw.items()},
+            'optedIn': sum(
+                1 for resources in self.raw.values() for resource in resources if resource['_active'])
+        }
+
+    def _generate(self):
+        for service in ServiceRegistry.supported:
+            self.raw[service.name] = [
+                self._make_resource(service, index) for index in range(self.resources_per_service)
+            ]
+
+    def _make_resource(self, service: AWSService, index: int) -> Dict[str, Any]:
+        """One resource for the service, with the fields its describe call returns"""
+
+        name = f'{service.name}-{index:06d}'
+        tags = self._make_tags(service, name)
+        active = any(tag['Key'] == AWSService.TAG_ACTIVE and tag['Value'] == 'true' for tag in tags)
+        arn_prefix = f'arn:aws:{{}}:{self.region}:{self.account_id}'
+
+        resource: Dict[str, Any] = {'_index': index, '_name': name, '_active': active, '_tags': tags}
+
+        if service.name == 'ec2':
+            resource['arn'] = f"{arn_prefix.format('ec2')}:instance/i-{index:017x}"
+        elif service.name == 'rds':
+            resource['arn'] = f"{arn_prefix.format('rds')}:db:{name}"
+        elif service.name == 'elasticbeanstalk':
+            resource['arn'] = f"{arn_prefix.format('elasticbeanstalk')}:environment/app-{index % 50:03d}/{name}"
+        elif service.name == 'apigateway':
+            resource['arn'] = f"arn:aws:apigateway:{self.region}::/restapis/{index:010x}"
+        elif service.name == 'statemachine':
+            resource['arn'] = f"{arn_prefix.format('states')}:stateMachine:{name}"
+        elif service.name == 'sqs':
+            resource['arn'] = f"{arn_prefix.format('sqs')}:{name}"
+        elif service.name == 'ecs':
+            resource['arn'] = f"{arn_prefix.format('ecs')}:cluster/{name}"
+        elif service.name == 'autoscalinggroup':
+            resource['arn'] = (f"{arn_prefix.format('autoscaling')}:autoScalingGroup:"
+                               f"{self.random.getrandbits(128):032x}:autoScalingGroupName/{name}")
+
+        return resource
+
+    def _make_tags(self, service: AWSService, name: str) -> List[Dict[str, str]]:
+        """Tags for one resource, drawn from the mix"""
+
+        tags: List[Dict[str, str]] = [{'Key': 'Name', 'Value': name}]
+
+        for key in self.random.sample(EXTRA_TAG_KEYS, self.random.randint(1, len(EXTRA_TAG_KEYS))):
+            tags.append({'Key': key, 'Value': f'{key.lower()}-{self.random.randint(0, 20)}'})
+
+        if self.random.random() >= OPT_IN_RATIO:
+            # Not opted in, or opted out explicitly
+            if self.random.random() < 0.5:
+                tags.append({'Key': AWSService.TAG_ACTIVE, 'Value': 'false'})
+            return tags
+
+        tags.append({'Key': AWSService.TAG_ACTIVE, 'Value': 'true'})
+        tags.append({'Key': AWSService.TAG_OWNER,
+                     'Value': self.random.choices(self.owner_names, weights=self.owner_weights)[0]})
+
+        if self.random.random() < LEVEL_TAG_RATIO:
+            tags.append({'Key': AWSService.TAG_LEVEL,
+                         'Value': self.random.choice(AWSService.SUPPORTED_ALERT_LEVELS)})
+
+        metrics = list(service.supported_metrics.keys())
+
+        if self.random.random() < METRICS_TAG_RATIO:
+            tags.append({'Key': AWSService.TAG_METRICS, 'Value': self._join_metrics(metrics)})
+
+        if self.random.random() < LEVEL_METRICS_TAG_RATIO:
+            for tag_key in [AWSService.TAG_METRICS_CRITICAL, AWSService.TAG_METRICS_HIGH,
+                            AWSService.TAG_METRICS_MEDIUM, AWSService.TAG_METRICS_LOW]:
+                if self.random.random() < 0.5:
+                    tags.append({'Key': tag_key, 'Value': self._join_metrics(metrics)})
+
+        if self.random.random() < ALARM_PROP_TAG_RATIO:
+            tags.append({'Key': f'{AWSService.TAG_ALARM_PROP_PREFIX}Threshold',
+                         'Value': str(self.random.randint(1, 95))})
+            if self.random.random() < 0.5:
+                tags.append({'Key': f'{AWSService.TAG_ALARM_PROP_PREFIX}EvaluationPeriods',
+                             'Value': str(self.random.randint(1, 10))})
+
+        if self.random.random() < METRIC_PROP_TAG_RATIO:
+            for metric in self.random.sample(metrics, self.random.randint(1, min(3, len(metrics)))):
+                tags.append({'Key': f'{AWSService.TAG_ALARM_METRIC_PREFIX}{metric}:prop:Threshold',
+                             'Value': str(self.random.randint(1, 95))})
+                if self.random.random() < 0.3:
+                    tags.append({'Key': f'{AWSService.TAG_ALARM_METRIC_PREFIX}{metric}:prop:Period',
+                                 'Value': self.random.choice(['60', '300', '900'])})
+
+        return tags
+
+    def _join_metrics(self, metrics: List[str]) -> str:
+        """Metrics tag value e.g. 'CPUUtilization | NetworkIn'"""
+
+        return ' | '.join(self.random.sample(metrics, self.random.randint(1, min(4, len(metrics)))))
+
+    def describe(self, service_name: str) -> List[Dict[str, Any]]:
+        """Resources for the service in the shape its describe call returns them"""
+
+        return [self._describe(service_name, resource) for resource in self.raw[service_name]]
+
+    def _describe(self, service_name: str, resource: Dict[str, Any]) -> Dict[str, Any]:
+        index = resource['_index']
+        name = resource['_name']
+        tags = resource['_tags']
+
+        if service_name == 'ec2':
+            return {
+                'InstanceId': resource['arn'].split('/')[-1],
+                'InstanceType': 't3.medium',
+                'State': {'Code': 16, 'Name': 'running'},
+                'Monitoring': {'State': 'enabled' if index % 4 == 0 else 'disabled'},
+                'Tags': tags
+            }
+
+        if service_name == 'rds':
+            return {
+                'DBInstanceIdentifier': name,
+                'DBInstanceArn': resource['arn'],
+                'DBInstanceClass': 'db.t3.medium',
+                'Engine': 'postgres' if index % 2 else 'mysql'
+            }
+
+        if service_name == 'elasticbeanstalk':
+            return {
+                'EnvironmentName': name,
+                'EnvironmentArn': resource['arn'],
+                'ApplicationName': resource['arn'].split('/')[1],
+                'Status': 'Ready',
+                'Health': 'Green'
+            }
+
+        if service_name == 'apigateway':
+            return {
+                'id': resource['arn'].split('/')[-1],
+                'name': name,
+                'tags': {tag['Key']: tag['Value'] for tag in tags}
+            }
+
+        if service_name == 'ecs':
+            return {
+                'clusterArn': resource['arn'],
+                'clusterName': name,
+                'status': 'ACTIVE',
+                'tags': [{'key': tag['Key'], 'value': tag['Value']} for tag in tags]
+            }
+
+        if service_name == 'autoscalinggroup':
+            return {
+                'AutoScalingGroupName': name,
+                'AutoScalingGroupARN': resource['arn'],
+                'MinSize': 1,
+                'MaxSize': 4,
+                'DesiredCapacity': 2,
+                'Tags': [{**tag, 'ResourceId': name, 'ResourceType': 'auto-scaling-group',
+                          'PropagateAtLaunch': True} for tag in tags],
+                'EnabledMetrics': ASG_ENABLED_METRICS if index % 3 == 0 else []
+            }
+
+        # Services only seen through the tagging api
+        return {'ResourceARN': resource['arn'], 'Tags': tags}
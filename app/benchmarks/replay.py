@@ -0,0 +1,209 @@
+"""
+Replay
+
+Records a handler run against a real spoke account into a cassette, then
+replays it offline as many times as needed, timed and optionally profiled.
+Only the spoke sessions are recorded, which is every call GetResources,
+TriageStacks and CheckStatus make.
+
+    # Record, with hub credentials and the handler environment set
+    python app/benchmarks/replay.py record get_resources --event app/src/get_resources/input.json \\
+        --output get_resources.cassette.json.gz
+
+    # Replay as a 10x account, with 80ms per call and 300ms for DescribeInstances
+    python app/benchmarks/replay.py replay get_resources.cassette.json.gz --scale 10 \\
+        --latency '*=80' --latency ec2.DescribeInstances=300 --repeat 5 --profile get_resources.prof
+
+    # Keep a scaled copy
+    python app/benchmarks/replay.py scale get_resources.cassette.json.gz --factor 100 --output x100.cassette.json.gz
+"""
+
+import argparse
+import cProfile
+import importlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# Handlers with every api call on a spoke session
+HANDLERS = ['get_resources', 'triage_stacks', 'check_status']
+
+# Handler config for replays, a recording uses the real environment
+REPLAY_ENVIRONMENT = {
+    'REGION': 'us-west-2',
+    'ENVIRONMENT': 'replay',
+    'PRIVATE_ASSETS_BUCKET': 'cloudwedge-replay-private',
+    'PUBLIC_ASSETS_BUCKET': 'cloudwedge-replay-public',
+    'ALARM_ACTION_TARGET_TOPIC_ARN': 'arn:aws:sns:us-west-2:123456789012:cloudwedge-replay',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'METRICS_MODE': 'off'
+}
+
+
+def load_handler(handler: str):
+    """Import the handlers index, it imports its siblings by bare name the same way the lambda packages them"""
+
+    if handler not in HANDLERS:
+        raise ValueError(f'handler {handler} is not one of {HANDLERS}')
+
+    sys.path[:0] = [SRC_DIR, os.path.join(SRC_DIR, handler)]
+
+    return importlib.import_module('index')
+
+
+def get_target_account_id(event: Dict[str, Any]) -> str:
+    # GetResources is triggered by the event itself, the others by the builder
+    return str(event.get('targetAccountId') or event['account'])
+
+
+def record(args):
+    with open(args.event) as event_file:
+        event = json.load(event_file)
+
+    index = load_handler(args.handler)
+
+    # Imported after the handler, so the handler environment is the one in use
+    from cloudwedge.utils.sts import REGION, add_spoke_session_hook
+
+    from cassette import CassetteRecorder
+
+    recorder = CassetteRecorder(meta={
+        'handler': args.handler,
+        'event': event,
+        'account': get_target_account_id(event),
+        'region': REGION,
+        'recordedAt': datetime.now(timezone.utc).isoformat()
+    })
+    add_spoke_session_hook(recorder.attach)
+
+    index.run_app(event)
+
+    recorder.cassette.save(args.output)
+
+    print(f'Recorded {len(recorder.cassette.interactions)} calls to {args.output}')
+
+
+def replay(args):
+    for key, value in REPLAY_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+
+    from cassette import Cassette, CassettePlayer
+
+    cassette = Cassette.load(args.cassette)
+
+    if args.scale > 1:
+        cassette = cassette.scale(args.scale)
+
+    index = load_handler(cassette.meta['handler'])
+
+    from cloudwedge.utils.sts import SPOKE_SESSION_POOL, add_spoke_session_hook
+
+    if not args.verbose:
+        # Handlers log every resource and stack, that would be most of the runtime
+        for logger in list(logging.Logger.manager.loggerDict.values()):
+            if isinstance(logger, logging.Logger):
+                logger.setLevel(logging.WARNING)
+
+    player = CassettePlayer(cassette, latency=parse_latency(args.latency), recorded_latency=args.recorded_latency)
+
+    # Every spoke session plays the cassette, the discovery workers sessions included
+    add_spoke_session_hook(player.attach)
+    SPOKE_SESSION_POOL.add_session(cassette.meta['account'], player.make_session(), cassette.meta.get('region'))
+
+    profiler = cProfile.Profile() if args.profile else None
+    durations: List[float] = []
+    output = None
+
+    for _ in range(max(1, args.repeat)):
+        player.rewind()
+
+        if profiler:
+            profiler.enable()
+
+        started_at = time.perf_counter()
+        output = index.run_app(cassette.meta['event'])
+        durations.append(time.perf_counter() - started_at)
+
+        if profiler:
+            profiler.disable()
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+
+    print(json.dumps({
+        'handler': cassette.meta['handler'],
+        'scale': cassette.meta.get('scale', 1),
+        'recordedCalls': len(cassette.interactions),
+        'seconds': {
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'max': max(durations)
+        },
+        'repeat': len(durations),
+        'apiCalls': (output or {}).get('apiCalls') if isinstance(output, dict) else None
+    }, indent=2, default=str))
+
+
+def scale(args):
+    from cassette import Cassette
+
+    cassette = Cassette.load(args.cassette).scale(args.factor)
+    cassette.save(args.output)
+
+    print(f"Scaled {args.cassette} to {cassette.meta['scale']}x as {args.output}")
+
+
+def parse_latency(values: Optional[List[str]]) -> Dict[str, float]:
+    """'ec2.DescribeInstances=300' to {'ec2.DescribeInstances': 300.0}, '*' is every other operation"""
+
+    latency = {}
+
+    for value in values or []:
+        operation, _, milliseconds = value.partition('=')
+        latency[operation.strip()] = float(milliseconds)
+
+    return latency
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Record and replay the api calls of a handler run')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help='Run the handler against aws, recording its api calls')
+    record_parser.add_argument('handler', choices=HANDLERS)
+    record_parser.add_argument('--event', required=True, help='Event json to run the handler with')
+    record_parser.add_argument('--output', required=True, help='Cassette to write')
+    record_parser.set_defaults(run=record)
+
+    replay_parser = commands.add_parser('replay', help='Run the handler offline against a cassette')
+    replay_parser.add_argument('cassette')
+    replay_parser.add_argument('--scale', type=int, default=1, help='Clone every listed resource this many times')
+    replay_parser.add_argument('--latency', action='append',
+                               help="Milliseconds per call as service.Operation=ms, '*=ms' for the rest")
+    replay_parser.add_argument('--recorded-latency', action='store_true',
+                               help='Take as long as the recorded call did, unless --latency is set for it')
+    replay_parser.add_argument('--repeat', type=int, default=3)
+    replay_parser.add_argument('--profile', help='Write cProfile stats of the runs to this file')
+    replay_parser.add_argument('--verbose', action='store_true', help='Keep the handler info logs')
+    replay_parser.set_defaults(run=replay)
+
+    scale_parser = commands.add_parser('scale', help='Write a scaled copy of a cassette')
+    scale_parser.add_argument('cassette')
+    scale_parser.add_argument('--factor', type=int, required=True)
+    scale_parser.add_argument('--output', required=True)
+    scale_parser.set_defaults(run=scale)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+"""
+Benchmarks
+
+Times the builder pipeline against a synthetic fleet, offline. Discovery
+runs against botocore answered by the StubSession, everything after it
+runs the real code on what discovery returned.
+
+Each target is timed over --repeat runs, then run once more under
+tracemalloc for its peak memory, that run also counts the api calls the
+target made. Results, with the fleet and template sizes, are written as
+json so two commits can be compared, --baseline prints the change against
+an earlier result and exits 1 when a target makes more api calls than it
+did, timings are too noisy to fail on but the call counts are exact.
+
+    python app/benchmarks/run.py --resources-per-service 500 --owners 20 --output bench.json
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# Handlers read their config at import, nothing here talks to aws
+for key, value in {
+    'REGION': 'us-west-2',
+    'ENVIRONMENT': 'benchmark',
+    'PRIVATE_ASSETS_BUCKET': 'cloudwedge-benchmark-private',
+    'PUBLIC_ASSETS_BUCKET': 'cloudwedge-benchmark-public',
+    'ALARM_ACTION_TARGET_TOPIC_ARN': 'arn:aws:sns:us-west-2:123456789012:cloudwedge-benchmark',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'METRICS_MODE': 'off'
+}.items():
+    os.environ.setdefault(key, value)
+
+# Handler modules import their siblings by bare name, the same way the lambda packages them
+sys.path[:0] = [SRC_DIR, os.path.join(SRC_DIR, 'create_stacks'), os.path.join(SRC_DIR, 'get_resources')]
+
+import boto3  # noqa: E402
+import botocore  # noqa: E402
+
+from alarm_resolution_cache import ALARM_RESOLUTION_CACHE  # noqa: E402
+from alarms_factory import AlarmsFactory  # noqa: E402
+from cloudwedge.services import ServiceRegistry  # noqa: E402
+from cloudwedge.utils.api_calls import API_CALL_RECORDER  # noqa: E402
+from cloudwedge.utils.tags import TagProfile, TagsApi  # noqa: E402
+from dashboard_factory import DashboardFactory  # noqa: E402
+from discovery_engine import DiscoveryEngine  # noqa: E402
+from resource_alarm_factory import ResourceAlarmFactory  # noqa: E402
+
+from fleet import SyntheticFleet  # noqa: E402
+from stub_session import StubSession  # noqa: E402
+
+
+def _load_handler_app(handler: str):
+    '''Every handler has an app.py, load this one under its own name'''
+
+    spec = importlib.util.spec_from_file_location(f'{handler}_app', os.path.join(SRC_DIR, handler, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+GetResources = _load_handler_app('get_resources').GetResources
+
+
+class Benchmark():
+    def __init__(self, fleet: SyntheticFleet, repeat: int = 5):
+        self.fleet = fleet
+        self.repeat = max(1, repeat)
+
+        self.stub = StubSession(fleet)
+        self.session = self.stub.make_session()
+
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+        # Filled in by discovery, used by every target after it
+        self.resources: Dict[str, List[Dict]] = {}
+        self.resources_by_owner: Dict[str, Dict[str, List[Dict]]] = {}
+
+    def run(self) -> Dict[str, Any]:
+        """Run every target, in pipeline order"""
+
+        self._run_discovery()
+        self._run_tags()
+        self._run_organize_by_owner()
+        self._run_resource_alarm_factory()
+        self._run_dashboard_widgets()
+        templates = self._run_stack_factories()
+
+        return {
+            'fleet': {
+                **self.fleet.get_counts(),
+                'discovered': {service_name: len(resources) for service_name, resources in self.resources.items()},
+                'ownersDiscovered': len(self.resources_by_owner)
+            },
+            'results': self.results,
+            'templates': templates
+        }
+
+    def measure(self, name: str, target: Callable[[], Any], setup: Optional[Callable[[], None]] = None,
+                items: Optional[int] = None) -> Any:
+        """Time the target over the repeats, then once more for its peak memory and api calls"""
+
+        durations = []
+        result = None
+
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+
+            started_at = time.perf_counter()
+            result = target()
+            durations.append(time.perf_counter() - started_at)
+
+        if setup:
+            setup()
+
+        # Separate run, tracemalloc slows everything down too much to time under it
+        API_CALL_RECORDER.reset()
+        tracemalloc.start()
+        target()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        api_calls = API_CALL_RECORDER.get_totals()
+
+        self.results[name] = {
+            'seconds': {
+                'min': min(durations),
+                'median': statistics.median(durations),
+                'mean': statistics.mean(durations),
+                'max': max(durations)
+            },
+            'repeat': self.repeat,
+            'peakMemoryBytes': peak_memory,
+            'items': items,
+            'apiCalls': {
+                'calls': api_calls['calls'],
+                'operations': {name: stats['calls'] for name, stats in api_calls['operations'].items()}
+            }
+        }
+
+        return result
+
+    def _run_discovery(self):
+        # Serial, the parallel engine clones sessions and the clones wouldnt be stubbed
+        def discover():
+            return DiscoveryEngine(session=self.session, services=ServiceRegistry.supported, serial=True).run()
+
+        self.resources = self.measure('discovery_engine.run', discover)
+
+        self.results['discovery_engine.run']['items'] = sum(len(resources) for resources in self.resources.values())
+
+    def _run_tags(self):
+        resource_types = [
+            resource_type for service in ServiceRegistry.supported for resource_type in service.tagging_resource_types
+        ]
+
+        tagged_resources = self.measure('tags_api.get_tagged_resources',
+                                        lambda: TagsApi.get_tagged_resources(self.session, resource_types))
+        self.results['tags_api.get_tagged_resources']['items'] = sum(
+            len(resources) for resources in tagged_resources.values())
+
+        all_tags = [resource['tags'] for resources in self.resources.values() for resource in resources]
+
+        self.measure('tags_api.tag_profile', lambda: [TagProfile(tags) for tags in all_tags], items=len(all_tags))
+
+    def _run_organize_by_owner(self):
+        get_resources = GetResources(self.fleet.account_id)
+
+        self.resources_by_owner = self.measure(
+            'get_resources.organize_by_owner', lambda: get_resources._organize_by_owner(self.resources),
+            items=sum(len(resources) for resources in self.resources.values()))
+
+    def _run_resource_alarm_factory(self):
+        resources = [
+            (resource, ServiceRegistry.get_service(service_name))
+            for service_name, service_resources in self.resources.items()
+            for resource in service_resources
+        ]
+
+        def build():
+            return sum(len(ResourceAlarmFactory(resource=resource, service=service).build() or {})
+                       for resource, service in resources)
+
+        # Cold, every resource resolved from scratch
+        alarm_count = self.measure('resource_alarm_factory.build', build, setup=ALARM_RESOLUTION_CACHE.clear,
+                                   items=len(resources))
+        self.results['resource_alarm_factory.build']['alarms'] = alarm_count
+
+        # Warm, the way a container that already built the account sees it
+        self.measure('resource_alarm_factory.build_warm', build, items=len(resources))
+        self.results['resource_alarm_factory.build_warm']['cache'] = ALARM_RESOLUTION_CACHE.get_stats()
+
+    def _run_dashboard_widgets(self):
+        for service_name, resources in self.resources.items():
+            service = ServiceRegistry.get_service(service_name)
+
+            widgets = self.measure(f'build_dashboard_widgets.{service_name}',
+                                   lambda: service.build_dashboard_widgets(resources), items=len(resources))
+            self.results[f'build_dashboard_widgets.{service_name}']['widgets'] = len(widgets)
+
+    def _run_stack_factories(self) -> Dict[str, Any]:
+        def build(factory_class) -> Callable[[], List]:
+            return lambda: [
+                self._build_factory(factory_class, owner, owner_resources)
+                for owner, owner_resources in self.resources_by_owner.items()
+            ]
+
+        alarm_factories = self.measure('alarms_factory.build', build(AlarmsFactory), setup=ALARM_RESOLUTION_CACHE.clear,
+                                       items=len(self.resources_by_owner))
+        dashboard_factories = self.measure('dashboard_factory.build', build(DashboardFactory),
+                                           items=len(self.resources_by_owner))
+
+        return {
+            'alarms': self._get_template_sizes(alarm_factories),
+            'dashboards': self._get_template_sizes(dashboard_factories)
+        }
+
+    def _build_factory(self, factory_class, owner: str, owner_resources: Dict[str, List[Dict]]):
+        factory = factory_class(self.session, owner, owner_resources)
+        factory.build()
+        return factory
+
+    @staticmethod
+    def _get_template_sizes(factories: List) -> Dict[str, Any]:
+        """Sizes of the templates the factories built, as they are uploaded"""
+
+        sizes = [len(json.dumps(stack['template']).encode('utf-8')) for factory in factories for stack in factory.stacks]
+        resource_counts = [len(stack['template'].get('Resources', {})) for factory in factories for stack in factory.stacks]
+
+        return {
+            'stacks': len(sizes),
+            'totalBytes': sum(sizes),
+            'maxBytes': max(sizes, default=0),
+            'medianBytes': statistics.median(sizes) if sizes else 0,
+            'resources': sum(resource_counts),
+            'maxResources': max(resource_counts, default=0)
+        }
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_comparison(output: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Median and api calls of each target against the baseline, returns the targets making more calls"""
+
+    print(f"{'target':<45} {'baseline':>12} {'current':>12} {'change':>9} {'calls':>15}")
+
+    regressions = []
+
+    for name, result in output['results'].items():
+        previous_result = baseline.get('results', {}).get(name, {})
+
+        current = result['seconds']['median']
+        previous = previous_result.get('seconds', {}).get('median')
+
+        current_calls = result['apiCalls']['calls']
+        # Baselines from before api calls were counted have nothing to compare
+        previous_calls = previous_result.get('apiCalls', {}).get('calls') if previous_result else None
+
+        calls = f'{current_calls}' if previous_calls is None else f'{previous_calls} > {current_calls}'
+
+        if previous_calls is not None and current_calls > previous_calls:
+            regressions.append(name)
+            calls = f'{calls} !'
+
+        if not previous:
+            print(f'{name:<45} {"-":>12} {current:>12.6f} {"new":>9} {calls:>15}')
+            continue
+
+        print(f'{name:<45} {previous:>12.6f} {current:>12.6f} {(current - previous) / previous:>+9.1%} {calls:>15}')
+
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark discovery, template build and dashboard generation')
+    parser.add_argument('--resources-per-service', type=int, default=100)
+    parser.add_argument('--owners', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the results to this json file, else stdout')
+    parser.add_argument('--baseline', help='Earlier results json to compare against')
+    parser.add_argument('--verbose', action='store_true', help='Keep the handler info logs')
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        # Factories log every owner, that would be most of the runtime
+        for logger in list(logging.Logger.manager.loggerDict.values()):
+            if isinstance(logger, logging.Logger):
+                logger.setLevel(logging.WARNING)
+
+    fleet = SyntheticFleet(resources_per_service=args.resources_per_service, owners=args.owners, seed=args.seed)
+
+    output = {
+        'meta': {
+            'commit': get_git_commit(),
+            'startedAt': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'boto3': boto3.__version__,
+            'botocore': botocore.__version__,
+            'args': {
+                'resourcesPerService': args.resources_per_service,
+                'owners': args.owners,
+                'seed': args.seed,
+                'repeat': args.repeat
+            }
+        },
+        **Benchmark(fleet, repeat=args.repeat).run()
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2, default=str)
+    else:
+        print(json.dumps(output, indent=2, default=str))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = print_comparison(output, json.load(baseline_file))
+
+        if regressions:
+            print(f'More api calls than the baseline: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+StubSession
+
+A boto3 session whose api calls are answered from a SyntheticFleet instead
+of aws. The calls still go through botocore, parameter validation,
+serialization, paginators and the event hooks all run, only the http
+request is swapped out by a before-call handler. That keeps the client
+side cost of discovery in the numbers.
+
+Responses are paged the way each api pages them, with its own token names
+and default page sizes, so the number of calls a sweep makes is realistic.
+An operation the stub doesnt know fails loudly instead of reaching aws.
+"""
+
+import io
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from cloudwedge.models import AWSService
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+from cloudwedge.utils.arnparse import arn_resource_type, arnparse
+
+from fleet import SyntheticFleet
+
+# Default page size of each paged operation
+PAGE_SIZES = {
+    'DescribeInstances': 1000,
+    'GetResources': 100,
+    'DescribeDBInstances': 100,
+    'DescribeEnvironments': 100,
+    'GetRestApis': 25,
+    'ListClusters': 100,
+    'DescribeAutoScalingGroups': 50,
+    'ListQueues': 1000,
+    'ListStateMachines': 100
+}
+
+# Where the stub keeps the api params for the before-call handler
+CONTEXT_PARAMS_KEY = 'benchmarkApiParams'
+
+
+class StubOperationError(Exception):
+    def __init__(self, service_name: str, operation_name: str):
+        self.service_name = service_name
+        self.operation_name = operation_name
+
+    def __str__(self):
+        return f'no stubbed response for {self.service_name}.{self.operation_name}'
+
+
+class StubSession():
+    def __init__(self, fleet: SyntheticFleet):
+        self.fleet = fleet
+
+        # Objects put to s3, keyed by (bucket, key)
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        self.lock = threading.Lock()
+
+        self.responders: Dict[Tuple[str, str], Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+            ('ec2', 'DescribeInstances'): self._describe_instances,
+            ('resourcegroupstaggingapi', 'GetResources'): self._get_tagged_resources,
+            ('rds', 'DescribeDBInstances'): self._describe_db_instances,
+            ('elasticbeanstalk', 'DescribeEnvironments'): self._describe_environments,
+            ('apigateway', 'GetRestApis'): self._get_rest_apis,
+            ('ecs', 'ListClusters'): self._list_clusters,
+            ('ecs', 'DescribeClusters'): self._describe_clusters,
+            ('autoscaling', 'DescribeAutoScalingGroups'): self._describe_auto_scaling_groups,
+            ('sqs', 'ListQueues'): self._list_queues,
+            ('stepfunctions', 'ListStateMachines'): self._list_state_machines,
+            ('s3', 'PutObject'): self._put_object,
+            ('s3', 'GetObject'): self._get_object,
+            ('s3', 'DeleteObject'): self._delete_object
+        }
+
+        # Describe shaped resources, built once so the stub doesnt show up in the numbers
+        self.described = {service_name: fleet.describe(service_name) for service_name in fleet.raw}
+        self.tag_mappings = [
+            {'ResourceARN': resource['arn'], 'Tags': resource['_tags'],
+             '_type': arn_resource_type(arnparse(resource['arn'])), '_active': resource['_active']}
+            for resources in fleet.raw.values()
+            for resource in resources
+        ]
+
+    def make_session(self) -> boto3.session.Session:
+        """Session with fake credentials, every client made from it is answered by the stub"""
+
+        session = boto3.session.Session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+                                        region_name=self.fleet.region)
+
+        session.events.register('before-parameter-build', self._remember_params)
+        session.events.register('before-call', self._respond)
+
+        # Counted the same way the spoke sessions are
+        API_CALL_RECORDER.attach(session)
+
+        return session
+
+    @staticmethod
+    def _remember_params(params: Dict[str, Any], context: Dict[str, Any], **kwargs):
+        # before-call only sees the serialized request, keep the params it was made from
+        context[CONTEXT_PARAMS_KEY] = params
+
+    def _respond(self, model, context: Dict[str, Any], **kwargs) -> Tuple[AWSResponse, Dict[str, Any]]:
+        """Answer the call from the fleet, returning a response stops botocore sending the request"""
+
+        service_name = model.service_model.service_name
+        operation_name = model.name
+
+        responder = self.responders.get((service_name, operation_name))
+
+        if not responder:
+            raise StubOperationError(service_name, operation_name)
+
+        parsed = responder(context.get(CONTEXT_PARAMS_KEY, {}))
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': 200, 'RetryAttempts': 0})
+
+        return AWSResponse('https://benchmark.invalid', 200, {}, None), parsed
+
+    @staticmethod
+    def _get_page(items: List[Any], params: Dict[str, Any], request_token: str, response_token: str,
+                  items_key: str, page_size: int) -> Dict[str, Any]:
+        """Slice out the page the token points at, the token is the offset of the page"""
+
+        start = int(params.get(request_token) or 0)
+        end = start + page_size
+
+        page = {items_key: items[start:end]}
+
+        if end < len(items):
+            page[response_token] = str(end)
+
+        return page
+
+    @staticmethod
+    def _get_filter_values(filters: List[Dict[str, Any]], name: str) -> Optional[List[str]]:
+        return next((item['Values'] for item in filters if item['Name'] == name), None)
+
+    def _describe_instances(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        filters = params.get('Filters', [])
+        active_values = self._get_filter_values(filters, f'tag:{AWSService.TAG_ACTIVE}')
+        instance_ids = self._get_filter_values(filters, 'instance-id')
+        state_names = self._get_filter_values(filters, 'instance-state-name')
+
+        reservations = []
+
+        for instance in self.described['ec2']:
+            tags = {tag['Key']: tag['Value'] for tag in instance['Tags']}
+
+            if active_values is not None and tags.get(AWSService.TAG_ACTIVE) not in active_values:
+                continue
+            if instance_ids is not None and instance['InstanceId'] not in instance_ids:
+                continue
+            if state_names is not None and instance['State']['Name'] not in state_names:
+                continue
+
+            reservations.append({'ReservationId': f"r-{instance['InstanceId'][2:]}", 'Instances': [instance]})
+
+        return self._get_page(reservations, params, 'NextToken', 'NextToken', 'Reservations',
+                              params.get('MaxResults') or PAGE_SIZES['DescribeInstances'])
+
+    def _get_tagged_resources(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        resource_types = params.get('ResourceTypeFilters')
+        arns = params.get('ResourceARNList')
+        # The only tag filter cloudwedge sends is the active tag
+        filter_active = bool(params.get('TagFilters'))
+
+        mappings = [
+            {'ResourceARN': mapping['ResourceARN'], 'Tags': mapping['Tags']}
+            for mapping in self.tag_mappings
+            if (resource_types is None or mapping['_type'] in resource_types)
+            and (arns is None or mapping['ResourceARN'] in arns)
+            and (not filter_active or mapping['_active'])
+        ]
+
+        return self._get_page(mappings, params, 'PaginationToken', 'PaginationToken', 'ResourceTagMappingList',
+                              params.get('ResourcesPerPage') or PAGE_SIZES['GetResources'])
+
+    def _describe_db_instances(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        ids = self._get_filter_values(params.get('Filters', []), 'db-instance-id')
+
+        db_instances = [
+            db_instance for db_instance in self.described['rds']
+            # Filter takes identifiers or arns
+            if ids is None or db_instance['DBInstanceIdentifier'] in ids or db_instance['DBInstanceArn'] in ids
+        ]
+
+        return self._get_page(db_instances, params, 'Marker', 'Marker', 'DBInstances',
+                              params.get('MaxRecords') or PAGE_SIZES['DescribeDBInstances'])
+
+    def _describe_environments(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        names = params.get('EnvironmentNames')
+
+        environments = [
+            environment for environment in self.described['elasticbeanstalk']
+            if names is None or environment['EnvironmentName'] in names
+        ]
+
+        return self._get_page(environments, params, 'NextToken', 'NextToken', 'Environments',
+                              params.get('MaxRecords') or PAGE_SIZES['DescribeEnvironments'])
+
+    def _get_rest_apis(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._get_page(self.described['apigateway'], params, 'position', 'position', 'items',
+                              params.get('limit') or PAGE_SIZES['GetRestApis'])
+
+    def _list_clusters(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        arns = [cluster['clusterArn'] for cluster in self.described['ecs']]
+
+        return self._get_page(arns, params, 'nextToken', 'nextToken', 'clusterArns',
+                              params.get('maxResults') or PAGE_SIZES['ListClusters'])
+
+    def _describe_clusters(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        wanted = set(params.get('clusters', []))
+
+        return {
+            'clusters': [
+                cluster for cluster in self.described['ecs']
+                if cluster['clusterArn'] in wanted or cluster['clusterName'] in wanted
+            ],
+            'failures': []
+        }
+
+    def _describe_auto_scaling_groups(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        names = params.get('AutoScalingGroupNames')
+
+        groups = [
+            group for group in self.described['autoscalinggroup']
+            if not names or group['AutoScalingGroupName'] in names
+        ]
+
+        return self._get_page(groups, params, 'NextToken', 'NextToken', 'AutoScalingGroups',
+                              params.get('MaxRecords') or PAGE_SIZES['DescribeAutoScalingGroups'])
+
+    def _list_queues(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        # e.g. arn:aws:sqs:us-west-2:ACCOUNTID:my-queue > https://sqs.us-west-2.amazonaws.com/ACCOUNTID/my-queue
+        arns = [resource['ResourceARN'].split(':') for resource in self.described['sqs']]
+        urls = [f'https://sqs.{arn[3]}.amazonaws.com/{arn[4]}/{arn[5]}' for arn in arns]
+
+        return self._get_page(urls, params, 'NextToken', 'NextToken', 'QueueUrls',
+                              params.get('MaxResults') or PAGE_SIZES['ListQueues'])
+
+    def _list_state_machines(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        state_machines = [
+            {'stateMachineArn': resource['ResourceARN'], 'name': resource['ResourceARN'].split(':')[-1],
+             'type': 'STANDARD'}
+            for resource in self.described['statemachine']
+        ]
+
+        return self._get_page(state_machines, params, 'nextToken', 'nextToken', 'stateMachines',
+                              params.get('maxResults') or PAGE_SIZES['ListStateMachines'])
+
+    def _put_object(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        body = params.get('Body') or b''
+
+        with self.lock:
+            self.objects[(params['Bucket'], params['Key'])] = body.encode('utf-8') if isinstance(body, str) else body
+
+        return {'ETag': '"benchmark"'}
+
+    def _get_object(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            body = self.objects.get((params['Bucket'], params['Key']))
+
+        if body is None:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}},
+                              'GetObject')
+
+        return {'Body': StreamingBody(io.BytesIO(body), len(body)), 'ContentLength': len(body)}
+
+    def _delete_object(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.objects.pop((params['Bucket'], params['Key']), None)
+
+        return {}
@@ -6,6 +6,10 @@ only returns arn and tags.
 
 For instance, ec2 alarms are different if its detailed monitoring is on/off
 
+Update: this now lives on as a hybrid. DiscoveryEngine makes one tagging api query
+(TagsApi.get_tagged_resources) for the services with tagging_resource_types, and each
+of those services only describes the opted in resources for the details it needs.
+
 
 """
 
@@ -0,0 +1,298 @@
+"""
+BuilderLock
+
+Keeps builder runs for a target account single flight. Two runs for the
+same account both discover, both upload templates, and the second usually
+loses to an in progress stack or redeploys what the first already replaced.
+
+The first run takes a lease on the account before GetResources. A run that
+arrives while the lease is held doesnt start a sweep, it marks the account
+dirty (with the arns it would have rebuilt) and ends. When the holder
+finishes and finds the account dirty, it keeps the lease and runs exactly
+one follow-up pass with everything that piled up in the meantime.
+
+A run that fails gives the lease up but leaves the dirty flag, so the next
+run for the account picks up the changes it didnt get to. A run that dies
+without giving the lease up (aborted, timed out) loses it once the lease
+expires.
+"""
+
+import time
+from os import environ
+from typing import Dict, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from cloudwedge.utils.logger import get_logger
+
+LOGGER = get_logger('BuilderLock')
+
+BUILDER_LOCK_TABLE = environ.get('BUILDER_LOCK_TABLE')
+
+# Seconds a run holds the account for, long enough for a run that waits on every stack
+BUILDER_LOCK_LEASE_SECONDS = int(environ.get('BUILDER_LOCK_LEASE_SECONDS', '7200'))
+
+# Events that name the resources they changed, the follow-up can rebuild just those
+INCREMENTAL_DETAIL_TYPE = 'Tag Change on Resource'
+
+# Attempts at taking or marking the lease, while it changes hands underneath
+MAX_LOCK_ATTEMPTS = 5
+
+CLIENT_DYNAMODB = boto3.client('dynamodb')
+
+
+class BuilderLockContentionError(Exception):
+    def __init__(self, target_account_id: str):
+        self.target_account_id = target_account_id
+
+    def __str__(self):
+        return f'builder lock for {self.target_account_id} kept changing hands, gave up after {MAX_LOCK_ATTEMPTS} attempts'
+
+
+class BuilderLock():
+    def __init__(self, target_account_id: str, execution_id: str, table: str = BUILDER_LOCK_TABLE):
+        self.target_account_id = target_account_id
+        # The builder execution holding (or asking for) the lease
+        self.execution_id = execution_id
+        self.table = table
+
+    def acquire(self, event: Dict) -> Dict:
+        """
+        Take the lease for the account, or mark it dirty if another run holds it
+
+            Returns:
+                The event (with changes left behind by a failed run merged in), and
+                {
+                    "builderLock": {
+                        "acquired": True
+                    }
+                }
+        """
+
+        for _ in range(MAX_LOCK_ATTEMPTS):
+            now = int(time.time())
+
+            try:
+                response = CLIENT_DYNAMODB.update_item(
+                    TableName=self.table,
+                    Key=self._get_key(),
+                    UpdateExpression='SET holder = :holder, leaseExpiresAt = :expires '
+                                     'REMOVE dirty, pendingResources, pendingFull',
+                    # Free, expired, or a redelivery of this run
+                    ConditionExpression='attribute_not_exists(holder) OR leaseExpiresAt < :now OR holder = :holder',
+                    ExpressionAttributeValues={
+                        ':holder': {'S': self.execution_id},
+                        ':expires': {'N': str(now + BUILDER_LOCK_LEASE_SECONDS)},
+                        ':now': {'N': str(now)}
+                    },
+                    ReturnValues='ALL_OLD')
+
+                LOGGER.info(f'Acquired builder lock for {self.target_account_id}')
+
+                # A failed or expired run may have left changes behind
+                pending = response.get('Attributes', {})
+
+                return {
+                    **self._merge_pending(event, pending),
+                    'builderLock': {'acquired': True}
+                }
+
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise err
+
+            if self._mark_dirty(event, now):
+                LOGGER.info(f'Builder lock for {self.target_account_id} is held, marked dirty for a follow-up pass')
+
+                return {
+                    **event,
+                    'builderLock': {'acquired': False}
+                }
+
+            # Holder let go between the two calls, try to take it again
+
+        raise BuilderLockContentionError(self.target_account_id)
+
+    def release(self) -> Dict:
+        """
+        Give the lease up, or keep it for one follow-up pass if the account was marked dirty
+
+            Returns:
+                {
+                    "followUp": True,
+                    "event": {follow-up event}
+                }
+        """
+
+        for _ in range(MAX_LOCK_ATTEMPTS):
+            now = int(time.time())
+
+            try:
+                # Dirty, take the pending changes and keep the lease for the follow-up
+                response = CLIENT_DYNAMODB.update_item(
+                    TableName=self.table,
+                    Key=self._get_key(),
+                    UpdateExpression='SET leaseExpiresAt = :expires REMOVE dirty, pendingResources, pendingFull',
+                    ConditionExpression='holder = :holder AND attribute_exists(dirty)',
+                    ExpressionAttributeValues={
+                        ':holder': {'S': self.execution_id},
+                        ':expires': {'N': str(now + BUILDER_LOCK_LEASE_SECONDS)}
+                    },
+                    ReturnValues='ALL_OLD')
+
+                event = self._get_follow_up_event(response['Attributes'])
+
+                LOGGER.info(f'Builder lock for {self.target_account_id} was marked dirty, running a follow-up pass')
+
+                return {
+                    'followUp': True,
+                    'event': event
+                }
+
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise err
+
+            try:
+                # Not dirty, let go
+                CLIENT_DYNAMODB.delete_item(
+                    TableName=self.table,
+                    Key=self._get_key(),
+                    ConditionExpression='holder = :holder AND attribute_not_exists(dirty)',
+                    ExpressionAttributeValues={
+                        ':holder': {'S': self.execution_id}
+                    })
+
+                LOGGER.info(f'Released builder lock for {self.target_account_id}')
+
+                return {'followUp': False}
+
+            except ClientError as err:
+                if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise err
+
+            if self._get_holder() != self.execution_id:
+                # Lease expired and another run took it, that run owns the dirty flag now
+                LOGGER.warning(f'Builder lock for {self.target_account_id} is no longer held by this run')
+
+                return {'followUp': False}
+
+            # Marked dirty between the two calls, take the follow-up
+
+        raise BuilderLockContentionError(self.target_account_id)
+
+    def abandon(self):
+        """Give the lease up after a failed run, changes marked dirty are left for the next run"""
+
+        try:
+            CLIENT_DYNAMODB.update_item(
+                TableName=self.table,
+                Key=self._get_key(),
+                UpdateExpression='REMOVE holder, leaseExpiresAt',
+                ConditionExpression='holder = :holder',
+                ExpressionAttributeValues={
+                    ':holder': {'S': self.execution_id}
+                })
+
+            LOGGER.info(f'Abandoned builder lock for {self.target_account_id}')
+
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+
+            LOGGER.warning(f'Builder lock for {self.target_account_id} is no longer held by this run')
+
+    def _mark_dirty(self, event: Dict, now: int) -> bool:
+        """Mark the held lease dirty with the changes on the event, False if nobody holds it"""
+
+        arns = self._get_incremental_arns(event)
+
+        if arns:
+            update_expression = 'SET dirty = :dirty ADD pendingResources :arns'
+            values = {':arns': {'SS': arns}}
+        else:
+            update_expression = 'SET dirty = :dirty, pendingFull = :dirty'
+            values = {}
+
+        try:
+            CLIENT_DYNAMODB.update_item(
+                TableName=self.table,
+                Key=self._get_key(),
+                UpdateExpression=update_expression,
+                ConditionExpression='attribute_exists(holder) AND leaseExpiresAt >= :now',
+                ExpressionAttributeValues={
+                    ':dirty': {'BOOL': True},
+                    ':now': {'N': str(now)},
+                    **values
+                })
+
+            return True
+
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+
+            return False
+
+    def _get_holder(self) -> Optional[str]:
+        """Execution holding the lease for the account"""
+
+        response = CLIENT_DYNAMODB.get_item(TableName=self.table, Key=self._get_key(), ConsistentRead=True)
+
+        return response.get('Item', {}).get('holder', {}).get('S')
+
+    def _get_key(self) -> Dict:
+        return {'accountId': {'S': self.target_account_id}}
+
+    def _get_follow_up_event(self, pending: Dict) -> Dict:
+        """Builder event for the changes marked dirty on the lease"""
+
+        if pending.get('pendingFull') or not pending.get('pendingResources'):
+            # Something couldnt be narrowed down, sweep it all
+            return {
+                'account': self.target_account_id,
+                'mode': 'full',
+                'followUp': True
+            }
+
+        return {
+            'account': self.target_account_id,
+            'detail-type': INCREMENTAL_DETAIL_TYPE,
+            'resources': sorted(pending['pendingResources']['SS']),
+            'followUp': True
+        }
+
+    @staticmethod
+    def _merge_pending(event: Dict, pending: Dict) -> Dict:
+        """Merge the changes marked dirty on the lease into the event"""
+
+        arns = BuilderLock._get_incremental_arns(event)
+
+        if not pending.get('dirty') or arns is None:
+            # Nothing left behind, or the event sweeps it all anyway
+            return event
+
+        if pending.get('pendingFull') or not pending.get('pendingResources'):
+            return {
+                **event,
+                'mode': 'full'
+            }
+
+        resources = list(arns)
+        resources.extend(arn for arn in pending['pendingResources']['SS'] if arn not in resources)
+
+        return {
+            **event,
+            'resources': resources
+        }
+
+    @staticmethod
+    def _get_incremental_arns(event: Dict) -> Optional[List[str]]:
+        """Arns the event would rebuild, None if it needs a full sweep"""
+
+        if event.get('mode') != 'full' and event.get('detail-type') == INCREMENTAL_DETAIL_TYPE \
+                and event.get('resources'):
+            return list(event['resources'])
+
+        return None
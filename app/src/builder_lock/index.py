@@ -0,0 +1,31 @@
+"""
+Wrap lambda handler and call main app
+"""
+
+from app import BuilderLock
+
+
+def run_app(evt=None, ctx=None):
+    """Parse event and run main app"""
+
+    # Get target account and the builder execution from event
+    builder_lock = BuilderLock(target_account_id=evt['targetAccountId'], execution_id=evt['executionId'])
+
+    if evt['action'] == 'acquire':
+        return builder_lock.acquire(event=evt['event'])
+
+    if evt['action'] == 'release':
+        return builder_lock.release()
+
+    # Builder failed, let go without a follow-up
+    builder_lock.abandon()
+
+    return None
+
+
+def lambda_handler(event, context):
+    """Lambda handler"""
+    try:
+        return run_app(event, context)
+    except Exception as err:
+        raise err
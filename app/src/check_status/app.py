@@ -2,55 +2,22 @@
 CheckStatus
 
 Checks the status of the stack and returns current status
+
+The status lookup is timed as the statusCheck phase, a stack that settled
+counts the wait attempts it took, emitted as EMF metrics.
 """
 
 import boto3
 from botocore.exceptions import ClientError
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.sts import get_spoke_session
+from cloudwedge.utils.metrics import Metrics
+from cloudwedge.utils.stack_status import (get_stack_error, stack_status_is_complete, stack_status_is_delete,
+                                           stack_status_is_error, stack_status_is_inprogress)
+from cloudwedge.utils.sts import get_spoke_client
 
 LOGGER = get_logger('CheckStatus')
 
 
-# Setup boto3 session
-SESSION = None
-CLIENT_FORMATION = None
-
-
-# Status that will be marked complete with no more actions needed
-TRIGGER_COMPLETE = [
-    'CREATE_COMPLETE',
-    'UPDATE_COMPLETE',
-    'DELETE_COMPLETE'
-]
-
-# Status that will remain in progress
-TRIGGER_INPROGRESS = [
-    'CREATE_IN_PROGRESS',
-    'UPDATE_IN_PROGRESS',
-    'ROLLBACK_IN_PROGRESS',
-    'DELETE_IN_PROGRESS',
-    'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS',
-    'UPDATE_ROLLBACK_IN_PROGRESS',
-    'REVIEW_IN_PROGRESS',
-    'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS'
-]
-
-# Status that will need intervention to recover from
-TRIGGER_ERROR = [
-    'DELETE_FAILED',
-    'CREATE_FAILED',
-    'ROLLBACK_FAILED',
-    'UPDATE_ROLLBACK_FAILED',
-    'UPDATE_ROLLBACK_COMPLETE'
-]
-
-# Status that will trigger a delete stack operation
-TRIGGER_DELETE = [
-    'ROLLBACK_COMPLETE'
-]
-
-
 class CheckStatus():
     def __init__(self, target_account_id=None, event=None):
         # Set up event
@@ -58,18 +25,21 @@ class CheckStatus():
         self.event = event
         # Get stack name from event
         self.stack_name = self.event['stackStatus']['stackName']
+        self.client_formation = None
+        # Phase timings and counts for the run
+        self.metrics = Metrics('CheckStatus', account=target_account_id)
 
     def run(self):
         """Run"""
 
-        global SESSION
-        global CLIENT_FORMATION
-
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
+        try:
+            return self._run()
+        finally:
+            self.metrics.flush()
 
-        if not CLIENT_FORMATION:
-            CLIENT_FORMATION = SESSION.client('cloudformation')
+    def _run(self):
+        # Client for this spoke account, pooled across warm invocations
+        self.client_formation = get_spoke_client(self.target_account_id, 'cloudformation')
 
         # Setup output for return
         output = {
@@ -83,7 +53,8 @@ class CheckStatus():
         output['waitAttempts'] = self.event['stackStatus']['waitAttempts'] + 1
 
         # Get status for the stack
-        stack_status = self._get_stack_status()
+        with self.metrics.phase('statusCheck'):
+            stack_status = self._get_stack_status()
 
         # Triage the status and handle accordingly
         if self._stack_status_is_complete(stack_status):
@@ -95,31 +66,30 @@ class CheckStatus():
             output['inProgress'] = True
 
         elif self._stack_status_is_delete(stack_status):
-            stack_error = {
-                'StackName': self.stack_name,
-                'Message': f'Stack ({self.stack_name}) is in state {stack_status}: create failed and has been deleted. Please review and see whats going to figure out what needs to change.'
-            }
+            stack_error = get_stack_error(self.stack_name, stack_status)
 
             # Stack has a status, that cant be recovered, must delete
             try:
                 self._delete_stack()
             except Exception as err:
                 # Not going to raise here, but it will be published later
-                stack_error['DeleteError'] = err
+                stack_error['DeleteError'] = str(err)
 
             output['hasError'] = True
             output['stackErrors'].append(stack_error)
 
         elif self.stack_status_is_error(stack_status):
             # Stack has an error status
-            stack_error = {
-                'StackName': self.stack_name,
-                'Message': f'Stack ({self.stack_name}) is in state {stack_status} and unrecoverable right now, need some help to fix this up. Please review and see whats going to figure out what needs to change.'
-            }
+            stack_error = get_stack_error(self.stack_name, stack_status)
 
             output['hasError'] = True
             output['stackErrors'].append(stack_error)
 
+        if not output['inProgress']:
+            # Polls it took the stack to settle
+            self.metrics.count('WaitAttempts', output['waitAttempts'], phase='statusCheck')
+            self.metrics.count('StackErrors', len(output['stackErrors']), phase='statusCheck')
+
         return output
 
     def _get_stack_status(self):
@@ -127,7 +97,7 @@ class CheckStatus():
 
         try:
 
-            response = CLIENT_FORMATION.describe_stacks(
+            response = self.client_formation.describe_stacks(
                 StackName=self.stack_name)
             stack = response['Stacks'][0]
             stack_status = stack['StackStatus']
@@ -147,7 +117,7 @@ class CheckStatus():
         LOGGER.info(f'Attempting to delete stack: {self.stack_name}')
 
         try:
-            response = CLIENT_FORMATION.delete_stack(StackName=self.stack_name)
+            response = self.client_formation.delete_stack(StackName=self.stack_name)
             LOGGER.info(f'Delete stack response: {response}')
         except Exception as err:
             LOGGER.error(f'Error deleting stack: {err}')
@@ -156,19 +126,19 @@ class CheckStatus():
     @staticmethod
     def _stack_status_is_complete(status):
         '''Return status'''
-        return bool(status in TRIGGER_COMPLETE)
+        return stack_status_is_complete(status)
 
     @staticmethod
     def _stack_status_is_inprogress(status):
         '''Return status'''
-        return bool(status in TRIGGER_INPROGRESS)
+        return stack_status_is_inprogress(status)
 
     @staticmethod
     def stack_status_is_error(status):
         '''Return status'''
-        return bool(status in TRIGGER_ERROR)
+        return stack_status_is_error(status)
 
     @staticmethod
     def _stack_status_is_delete(status):
         '''Return status'''
-        return bool(status in TRIGGER_DELETE)
+        return stack_status_is_delete(status)
@@ -0,0 +1,143 @@
+"""
+BatchCheckStatus
+
+Checks the status of every stack from a builder Map in one sweep. The
+builder polls this once for the whole run instead of a status execution per
+stack.
+
+Stacks that already settled (their wait was completed by the stack status
+event) are passed through as is, only stacks still in progress are looked
+up, all of them with one paginated describe_stacks.
+
+The sweep is timed as the statusCheck phase, with the stacks still in
+progress, emitted as EMF metrics.
+"""
+
+from typing import Dict
+
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.metrics import Metrics
+from cloudwedge.utils.stack_status import get_stack_status_output, stack_status_is_delete
+from cloudwedge.utils.stacks import STACK_NAME_PREFIX
+from cloudwedge.utils.sts import get_spoke_client
+
+LOGGER = get_logger('BatchCheckStatus')
+
+
+class BatchCheckStatus():
+    def __init__(self, target_account_id=None, event=None):
+        # Set up event
+        self.target_account_id = target_account_id
+        self.batch_status = event['batchStatus']
+        self.client_formation = None
+        # Phase timings and counts for the run
+        self.metrics = Metrics('CheckStatus', account=target_account_id)
+
+    def run(self):
+        """
+        Run
+
+            Returns:
+                {
+                    "inProgress": False,
+                    "hasError": False,
+                    "stackErrors": [],
+                    "stackStatuses": [CheckStatus outputs],
+                    "waitAttempts": 1
+                }
+        """
+
+        try:
+            return self._run()
+        finally:
+            self.metrics.flush()
+
+    def _run(self):
+        # Client for this spoke account, pooled across warm invocations
+        self.client_formation = get_spoke_client(self.target_account_id, 'cloudformation')
+
+        # Map outputs on the first poll, the previous polls statuses after that
+        stack_statuses = [
+            item.get('stackStatus', item) for item in self.batch_status.get('stackStatuses', [])
+        ]
+
+        in_progress_names = [
+            stack_status['stackName'] for stack_status in stack_statuses if stack_status.get('inProgress')
+        ]
+
+        if in_progress_names:
+            # Every stack in one sweep, instead of a lookup per stack
+            with self.metrics.phase('statusCheck'):
+                statuses = self._get_stack_statuses()
+
+            stack_statuses = [
+                self._check_stack(stack_status['stackName'], statuses)
+                if stack_status.get('inProgress') else stack_status
+                for stack_status in stack_statuses
+            ]
+
+        output = {
+            'inProgress': any(stack_status.get('inProgress') for stack_status in stack_statuses),
+            'hasError': any(stack_status.get('hasError') for stack_status in stack_statuses),
+            'stackErrors': [
+                stack_error for stack_status in stack_statuses for stack_error in stack_status.get('stackErrors', [])
+            ],
+            'stackStatuses': [
+                {
+                    'inProgress': stack_status.get('inProgress', False),
+                    'stackName': stack_status['stackName'],
+                    'hasError': stack_status.get('hasError', False),
+                    'stackErrors': stack_status.get('stackErrors', [])
+                }
+                for stack_status in stack_statuses
+            ],
+            'waitAttempts': self.batch_status.get('waitAttempts', 0) + 1
+        }
+
+        LOGGER.info(f"Checked {len(in_progress_names)} stacks in progress, "
+                    f"still in progress: {sum(s['inProgress'] for s in output['stackStatuses'])}, "
+                    f"errors: {len(output['stackErrors'])}")
+
+        self.metrics.count('StacksInProgress', sum(s['inProgress'] for s in output['stackStatuses']),
+                           phase='statusCheck')
+
+        if not output['inProgress']:
+            # Polls it took the whole run to settle
+            self.metrics.count('WaitAttempts', output['waitAttempts'], phase='statusCheck')
+            self.metrics.count('StackErrors', len(output['stackErrors']), phase='statusCheck')
+
+        return output
+
+    def _check_stack(self, stack_name: str, statuses: Dict[str, str]) -> Dict:
+        """Status check output for a single stack from the sweep"""
+
+        # Stacks that are gone dont show up in the sweep
+        stack_status = statuses.get(stack_name, 'DELETE_COMPLETE')
+
+        output = get_stack_status_output(stack_name, stack_status)
+
+        if stack_status_is_delete(stack_status):
+            # Stack has a status, that cant be recovered, must delete
+            try:
+                LOGGER.info(f'Attempting to delete stack: {stack_name}')
+                self.client_formation.delete_stack(StackName=stack_name)
+            except Exception as err:
+                # Not going to raise here, but it will be published later
+                LOGGER.error(f'Error deleting stack: {err}')
+                output['stackErrors'][0]['DeleteError'] = str(err)
+
+        return output
+
+    def _get_stack_statuses(self) -> Dict[str, str]:
+        """Get the status of every cloudwedge stack, keyed by stack name"""
+
+        statuses = {}
+
+        paginator = self.client_formation.get_paginator('describe_stacks')
+
+        for page in paginator.paginate():
+            for stack in page['Stacks']:
+                if stack['StackName'].startswith(STACK_NAME_PREFIX):
+                    statuses[stack['StackName']] = stack['StackStatus']
+
+        return statuses
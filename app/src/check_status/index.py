@@ -2,18 +2,29 @@
 Wrap lambda handler and call main app
 """
 
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+
 from app import CheckStatus
+from batch_status import BatchCheckStatus
 
 
 def run_app(evt=None, ctx=None):
     """Parse event and run main app"""
 
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
     # Get target account from event
     target_account_id = evt['targetAccountId']
 
+    if 'batchStatus' in evt:
+        # Every stack from a builder Map in one sweep
+        resources = BatchCheckStatus(target_account_id=target_account_id, event=evt).run()
+        return API_CALL_RECORDER.add_totals(resources, 'BatchCheckStatus')
+
     resources = CheckStatus(target_account_id=target_account_id, event=evt).run()
 
-    return resources
+    return API_CALL_RECORDER.add_totals(resources, 'CheckStatus')
 
 
 def lambda_handler(event, context):
@@ -12,6 +12,7 @@ import cfnresponse
 
 from cloudwedge.utils.logger import get_logger
 from cloudwedge.models import AWSService
+from cloudwedge.utils.stacks import parse_stack_name
 
 
 LOGGER = get_logger('CleanupResources')
@@ -76,11 +77,11 @@ class CleanupResources():
             for page_instances in paginator:
 
                 for stack in page_instances['Stacks']:
-                    # Filter to stacks that have a tag with identifier
+                    # Filter to stacks that have a tag with identifier, or a generated name (e.g. an alarm shard)
                     if any((
                         tag['Key'].strip() == AWSService.TAG_STACK_ID_KEY and
                         tag['Value'] == AWSService.TAG_STACK_ID_VALUE
-                    ) for tag in stack['Tags']):
+                    ) for tag in stack['Tags']) or parse_stack_name(stack['StackName']):
 
                         stacks.append(stack)
 
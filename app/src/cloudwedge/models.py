@@ -4,6 +4,7 @@ from os import environ
 from typing import Any, Dict, List, Optional, Tuple, TypedDict
 
 import boto3
+from cloudwedge.utils.arnparse import arnparse
 from cloudwedge.utils.logger import get_logger
 
 REGION = environ.get('REGION')
@@ -15,6 +16,11 @@ class AWSTag(TypedDict):
     Value: str
 
 
+class AWSTaggedResource(TypedDict):
+    arn: str
+    tags: List[AWSTag]
+
+
 class AWSResource(TypedDict):
     service: str
     name: str
@@ -51,6 +57,18 @@ class AWSService():
     override_dashboard_metrics_options: Dict[str, Any] = {}
     override_dashboard_metric_properties: Dict[str, Any]
     override_dashboard_widget_properties: Dict[str, Any] = {}
+    # Resource types (e.g. 'rds:db') the service finds through the tagging api
+    # instead of listing every resource and checking its tags one at a time
+    tagging_resource_types: List[str] = []
+    # Resource types from event arns (e.g. 'ec2:instance') that belong to the service,
+    # used by incremental rebuilds to rediscover a single resource
+    event_resource_types: List[str] = []
+    # Resource fields that change the resolved alarm props (get_default_resource_alarm_props and
+    # validation), part of the key resources share resolved alarms by
+    alarm_resolution_keys: List[str] = []
+    # Resource fields the dashboard widgets read besides the name, uniqueId and cloudwatchDimensionId,
+    # part of the input dashboards are fingerprinted by
+    dashboard_resource_keys: List[str] = []
 
     # CloudWedge root tags
     TAG_ACTIVE: Optional[str] = "cloudwedge:active"
@@ -69,6 +87,9 @@ class AWSService():
     TAG_STACK_ID_KEY: str = "cloudwedge:stack"
     TAG_STACK_ID_VALUE: str = "true"
     TAG_STACK_TYPE_KEY: str = "cloudwedge:type"
+    TAG_STACK_SERVICE_KEY: str = "cloudwedge:service"
+    TAG_STACK_DIGEST_KEY: str = "cloudwedge:template-digest"
+    TAG_STACK_INPUT_FINGERPRINT_KEY: str = "cloudwedge:input-fingerprint"
 
     # Defaults
     DEFAULT_OWNER: str = "cloudwedge"
@@ -78,6 +99,9 @@ class AWSService():
         "Statistic", "Period", "TreatMissingData", "EvaluationPeriods", "Threshold", "ComparisonOperator"]
     ALARM_TARGET_SNS: str = environ.get("ALARM_ACTION_TARGET_TOPIC_ARN")
     USER_TARGET_SNS: str = environ.get("USER_TARGET_TOPIC_ARN")
+    # How alarm state changes reach ingest, the alarms sns action or eventbridge alarm state change events
+    ALARM_INGEST_MODE: str = environ.get("ALARM_INGEST_MODE", "sns")
+    ALARM_INGEST_MODE_EVENTS: str = "events"
 
     # Alarm Description keys
     # these are used to create the alarm description e.g. Resource=1s-dustin-stress Metric=CPUUtilization Level=medium Type=AWS/EC2 Owner=cloudwedge
@@ -89,9 +113,20 @@ class AWSService():
 
 
     @abstractmethod
-    def get_resources(session: boto3.session.Session) -> List[AWSResource]:
+    def get_resources(session: boto3.session.Session, tagged_resources: Optional[List[AWSTaggedResource]] = None) -> List[AWSResource]:
+        # Services with tagging_resource_types are handed the resources that opted in
         raise NotImplementedError
 
+    def get_resources_by_arns(session: boto3.session.Session, arns: List[str]) -> Optional[List[AWSResource]]:
+        # Services that can look up single resources implement this, returning
+        # None means the service has to rediscover all of its resources
+        return None
+
+    def get_dimension_id_from_arn(arn: str) -> str:
+        # Match an arn to a resources cloudwatchDimensionId, services override when
+        # the dimension isnt the resource id of the arn
+        return arnparse(arn).resource_id
+
     @abstractmethod
     def get_default_resource_alarm_props(resource: AWSResource) -> Dict[str, str]:
         # The services can override this function if need to add in defaults
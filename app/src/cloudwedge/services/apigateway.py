@@ -11,7 +11,7 @@ import jmespath
 from typing import List, Any, Dict, Optional
 
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile, TagsApi
 from cloudwedge.models import AWSService, AWSResource
 
 REGION = environ.get('REGION')
@@ -31,6 +31,8 @@ class ApiGatewayService(AWSService):
     cloudwatch_namespace = "AWS/ApiGateway"
     cloudwatch_dashboard_section_title = "Api Gateway"
     cloudwatch_dimension = "EnvironmentName"
+    # Event arns only carry the api id, so the service is rediscovered as a whole
+    event_resource_types = ["apigateway"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["Latency",
                        "IntegrationLatency", "5XXError", "4XXError"]
@@ -83,14 +85,16 @@ class ApiGatewayService(AWSService):
                     # e.g. {'STAGE': 'prod', 'cloudwedge:active': 'true'}
                     converted_tags = TagsApi.convert_dict_to_tags(rest_api_tags)
 
+                    # Read everything cloudwedge needs from the tags in one pass
+                    tag_profile = TagProfile(converted_tags)
+
                     # If the active monitoring tag is on the instance, include in resource collection
-                    # Stripping key so no whitespace mismatch
-                    if any((tag['Key'].strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true') for tag in converted_tags):
+                    if tag_profile.is_active:
                         # This resource has opted in to cloudwedge
 
                         # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(converted_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(converted_tags)
+                        owner_from_tag = tag_profile.owner
+                        name_from_tag = tag_profile.name
                         rest_api_name = rest_api['name']
 
                         # Setup ApiGateway values
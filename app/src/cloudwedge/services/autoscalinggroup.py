@@ -12,7 +12,7 @@ import boto3
 import jmespath
 from cloudwedge.models import AWSResource, AWSService
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile
 
 REGION = environ.get("REGION")
 
@@ -33,6 +33,10 @@ class AutoScalingGroupService(AWSService):
     cloudwatch_namespace = "AWS/EC2"
     cloudwatch_dashboard_section_title = "Autoscaling"
     cloudwatch_dimension = "AutoScalingGroupName"
+    # Event arns for groups are rediscovered as a whole service
+    event_resource_types = ["autoscaling:autoScalingGroup"]
+    # Groups collecting group metrics get an extra widget
+    dashboard_resource_keys = ["metrics_enabled"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["CPUUtilization", "NetworkIn", "NetworkOut"]
     # Alarm defaults for the service, applied if metric default doesnt exist
@@ -110,20 +114,16 @@ class AutoScalingGroupService(AWSService):
 
                     asg_tags = asg["Tags"]
 
-                    # If the active monitoring tag is on the instance, include in resource collection,
-                    # Stripping key so no whitespace mismatch
-                    if any(
-                        (
-                            tag["Key"].strip() == AWSService.TAG_ACTIVE
-                            and tag["Value"] == "true"
-                        )
-                        for tag in asg_tags
-                    ):
+                    # Read everything cloudwedge needs from the tags in one pass
+                    tag_profile = TagProfile(asg_tags)
+
+                    # If the active monitoring tag is on the instance, include in resource collection
+                    if tag_profile.is_active:
                         # This resource has opted in to cloudwedge
 
                         # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(asg_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(asg_tags)
+                        owner_from_tag = tag_profile.owner
+                        name_from_tag = tag_profile.name
 
                         # Setup AutoScalingGroup values
                         asg_id = asg["AutoScalingGroupARN"]
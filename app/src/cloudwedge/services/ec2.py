@@ -10,8 +10,9 @@ import boto3
 import jmespath
 from typing import List, Any, Dict, Optional
 
+from cloudwedge.utils.arnparse import arnparse
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile
 from cloudwedge.models import AWSService, AWSResource
 
 REGION = environ.get('REGION')
@@ -33,6 +34,10 @@ class EC2Service(AWSService):
     cloudwatch_namespace = "AWS/EC2"
     cloudwatch_dashboard_section_title = "EC2"
     cloudwatch_dimension = "InstanceId"
+    # Event arns for instances can be looked up on their own
+    event_resource_types = ["ec2:instance"]
+    # Detailed monitoring changes the default and allowed period
+    alarm_resolution_keys = ["ec2DetailedMonitoring"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["CPUUtilization",
                        "StatusCheckFailed_Instance", "StatusCheckFailed_System", "DiskWriteOps"]
@@ -132,6 +137,26 @@ class EC2Service(AWSService):
         Return all AWS EC2 instances within scope, based on the tags
         """
 
+        return EC2Service._get_instances(session)
+
+    @staticmethod
+    def get_resources_by_arns(session: boto3.session.Session, arns: List[str]) -> List[EC2Resource]:
+        """
+        Return the AWS EC2 instances for the arns that are within scope, based on the tags
+        """
+
+        # arn:aws:ec2:us-west-2:ACCOUNTID:instance/i-07c281f74d763f868 > i-07c281f74d763f868
+        instance_ids = [arnparse(arn).resource_id for arn in arns]
+
+        # Filter instead of using InstanceIds, so a terminated instance isnt an error
+        return EC2Service._get_instances(session, [{'Name': "instance-id", 'Values': instance_ids}])
+
+    @staticmethod
+    def _get_instances(session: boto3.session.Session, extra_filters: Optional[List[Dict[str, Any]]] = None) -> List[EC2Resource]:
+        """
+        Return AWS EC2 instances within scope, based on the tags and any extra filters
+        """
+
         try:
             instances: List[EC2Resource] = []
 
@@ -149,6 +174,7 @@ class EC2Service(AWSService):
                             'Name': "instance-state-name",
                             'Values': ["pending", "running"],
                         },
+                        *(extra_filters or [])
                     ]
                 )
             )
@@ -166,8 +192,9 @@ class EC2Service(AWSService):
                 # Get values from instance details
                 instance_id = instance['InstanceId']
                 tags = instance.get('Tags')
-                resource_owner = TagsApi.get_owner_from_tags(tags)
-                resource_name = TagsApi.get_name_from_tags(tags)
+                tag_profile = TagProfile(tags)
+                resource_owner = tag_profile.owner
+                resource_name = tag_profile.name
 
                 instance_state = instance.get('State', {}).get('Name', None)
                 monitoring_state = instance.get(
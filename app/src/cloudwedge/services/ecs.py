@@ -14,7 +14,7 @@ import jmespath
 from typing import List, Any, Dict, Optional
 
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile, TagsApi
 from cloudwedge.models import AWSService, AWSResource
 
 REGION = environ.get('REGION')
@@ -35,6 +35,8 @@ class ECSService(AWSService):
     cloudwatch_namespace = "AWS/ECS"
     cloudwatch_dashboard_section_title = "ECS"
     cloudwatch_dimension = "ClusterName"
+    # Event arns for clusters can be looked up on their own
+    event_resource_types = ["ecs:cluster"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["CPUUtilization", "MemoryUtilization"]
     # Alarm defaults for the service, applied if metric default doesnt exist
@@ -106,39 +108,32 @@ class ECSService(AWSService):
                     include=['TAGS']
                 )
 
-                for cluster in res_clusters['clusters']:
+                cleaned_resources.extend(ECSService._clean_clusters(res_clusters['clusters']))
 
-                    cluster_tags = cluster.get('tags', {})
-
-                    converted_tags = TagsApi.convert_lowercase_tags_keys(cluster_tags)
+            return cleaned_resources
 
-                    if any((tag['Key'].strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true') for tag in converted_tags):
-                        # This resource has opted in to cloudwedge
+        except Exception as err:
+            LOGGER.info(
+                f"Failed to get clusters information with error: {err}")
+            raise err
 
-                        # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(converted_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(converted_tags)
-                        cluster_name = cluster['clusterName']
+    @staticmethod
+    def get_resources_by_arns(session: boto3.session.Session, arns: List[str]) -> List[ECSResource]:
+        """
+        Return the AWS ECS clusters for the arns that are within scope, based on the tags
+        """
 
-                        # Setup ECS values
-                        service = ECSService.name
-                        resource_name = name_from_tag or cluster_name
-                        resource_id = cluster_name
-                        resource_owner = owner_from_tag
-                        tags = converted_tags
+        try:
+            cleaned_resources: List[ECSResource] = []
 
-                        # Create ECS
-                        clean_resource = ECSResource(
-                            service=service,
-                            name=resource_name,
-                            uniqueId=resource_id,
-                            cloudwatchDimensionId=resource_id,
-                            owner=resource_owner,
-                            tags=tags
-                        )
+            # Describe takes up to 100 clusters and skips the ones that dont exist
+            for i in range(0, len(arns), 100):
+                res_clusters = session.client('ecs').describe_clusters(
+                    clusters=arns[i:i + 100],
+                    include=['TAGS']
+                )
 
-                        # Add to collection
-                        cleaned_resources.append(clean_resource)
+                cleaned_resources.extend(ECSService._clean_clusters(res_clusters['clusters']))
 
             return cleaned_resources
 
@@ -146,3 +141,50 @@ class ECSService(AWSService):
             LOGGER.info(
                 f"Failed to get clusters information with error: {err}")
             raise err
+
+    @staticmethod
+    def _clean_clusters(clusters: List[Dict[str, Any]]) -> List[ECSResource]:
+        """
+        Get the clusters that opted in to cloudwedge as ECSResource
+        """
+
+        cleaned_resources: List[ECSResource] = []
+
+        for cluster in clusters:
+
+            cluster_tags = cluster.get('tags', {})
+
+            converted_tags = TagsApi.convert_lowercase_tags_keys(cluster_tags)
+
+            # Read everything cloudwedge needs from the tags in one pass
+            tag_profile = TagProfile(converted_tags)
+
+            if tag_profile.is_active:
+                # This resource has opted in to cloudwedge
+
+                # Get values from tags if they exist
+                owner_from_tag = tag_profile.owner
+                name_from_tag = tag_profile.name
+                cluster_name = cluster['clusterName']
+
+                # Setup ECS values
+                service = ECSService.name
+                resource_name = name_from_tag or cluster_name
+                resource_id = cluster_name
+                resource_owner = owner_from_tag
+                tags = converted_tags
+
+                # Create ECS
+                clean_resource = ECSResource(
+                    service=service,
+                    name=resource_name,
+                    uniqueId=resource_id,
+                    cloudwatchDimensionId=resource_id,
+                    owner=resource_owner,
+                    tags=tags
+                )
+
+                # Add to collection
+                cleaned_resources.append(clean_resource)
+
+        return cleaned_resources
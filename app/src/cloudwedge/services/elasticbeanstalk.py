@@ -10,14 +10,18 @@ import boto3
 import jmespath
 from typing import List, Any, Dict, Optional
 
+from cloudwedge.utils.arnparse import arnparse
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
-from cloudwedge.models import AWSService, AWSResource
+from cloudwedge.utils.tags import TagProfile, TagsApi
+from cloudwedge.models import AWSService, AWSResource, AWSTaggedResource
 
 REGION = environ.get('REGION')
 
 LOGGER = get_logger("cloudwedge.elasticbeanstalk")
 
+# Max number of environment names sent in a single describe call
+DESCRIBE_BATCH_SIZE = 100
+
 
 # Model for Service, extending AWSResource
 class ElasticBeanstalkResource(AWSResource):
@@ -31,6 +35,8 @@ class ElasticBeanstalkService(AWSService):
     cloudwatch_namespace = "AWS/ElasticBeanstalk"
     cloudwatch_dashboard_section_title = "Elastic Beanstalk"
     cloudwatch_dimension = "EnvironmentName"
+    # Opted in environments are found with the tagging api
+    tagging_resource_types = ["elasticbeanstalk:environment"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["ApplicationRequests2xx",
                        "ApplicationRequests3xx", "ApplicationRequests4xx", "ApplicationRequests5xx"]
@@ -50,6 +56,15 @@ class ElasticBeanstalkService(AWSService):
     # There are dashboard additions that can be added at the metric level
     override_dashboard_metric_properties = {}
 
+    @staticmethod
+    def get_dimension_id_from_arn(arn: str) -> str:
+        """
+        Environment name from the arn
+        """
+
+        # arn:aws:elasticbeanstalk:us-west-2:ACCOUNTID:environment/my-app/my-env > my-env
+        return arnparse(arn).resource_id.split('/')[-1]
+
     @staticmethod
     def build_dashboard_widgets(resources: List[ElasticBeanstalkResource]) -> List[Any]:
         """
@@ -60,7 +75,7 @@ class ElasticBeanstalkService(AWSService):
         return AWSService.build_dashboard_widgets(ElasticBeanstalkService, resources)
 
     @ staticmethod
-    def get_resources(session: boto3.session.Session) -> List[ElasticBeanstalkResource]:
+    def get_resources(session: boto3.session.Session, tagged_resources: Optional[List[AWSTaggedResource]] = None) -> List[ElasticBeanstalkResource]:
         """
         Return all AWS ElasticBeanstalk resources within scope, based on the tags
         """
@@ -69,28 +84,35 @@ class ElasticBeanstalkService(AWSService):
             # Get things in a neat elasticbeanstalk resource object
             cleaned_resources: List[ElasticBeanstalkResource] = []
 
-            # Get paginator for service
-            paginator = session.client('elasticbeanstalk').get_paginator(
-                'describe_environments').paginate()
+            # Get the environments that have opted in to cloudwedge, keyed by arn
+            tagged_resources = TagsApi.get_service_tagged_resources(session, ElasticBeanstalkService) if tagged_resources is None else tagged_resources
+            tags_by_arn = {tagged_resource['arn']: tagged_resource['tags'] for tagged_resource in tagged_resources}
+
+            # e.g. arn:aws:elasticbeanstalk:us-west-2:ACCOUNTID:environment/my-app/my-env > my-env
+            environment_names = sorted({arnparse(arn).resource_id.split('/')[-1] for arn in tags_by_arn})
 
-            # Collect all resources
-            for page_resources in paginator:
-                for environment in page_resources['Environments']:
+            # Describe just the opted in environments, so terminated environments are dropped
+            for i in range(0, len(environment_names), DESCRIBE_BATCH_SIZE):
+                paginator = session.client('elasticbeanstalk').get_paginator(
+                    'describe_environments').paginate(
+                        EnvironmentNames=environment_names[i:i + DESCRIBE_BATCH_SIZE],
+                        IncludeDeleted=False
+                    )
 
-                    # For each env, get the tags
-                    env_resource_tags = session.client('elasticbeanstalk').list_tags_for_resource(
-                        ResourceArn=environment['EnvironmentArn'])
+                # Collect all resources
+                for page_resources in paginator:
+                    for environment in page_resources['Environments']:
 
-                    env_tags = env_resource_tags['ResourceTags']
+                        # Names are only unique per application, match back on the arn
+                        env_tags = tags_by_arn.get(environment['EnvironmentArn'])
 
-                    # If the active monitoring tag is on the instance, include in resource collection
-                    # Stripping key so no whitespace mismatch
-                    if any((tag['Key'].strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true') for tag in env_tags):
-                        # This resource has opted in to cloudwedge
+                        if env_tags is None:
+                            continue
 
                         # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(env_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(env_tags)
+                        tag_profile = TagProfile(env_tags)
+                        owner_from_tag = tag_profile.owner
+                        name_from_tag = tag_profile.name
                         environment_id = environment['EnvironmentName']
 
                         # Setup ElasticBeanstalk values
@@ -6,17 +6,20 @@ outlined in cloudwedge.models.AWSService
 """
 
 import os
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import boto3
 import jmespath
 
-from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.models import AWSResource, AWSService, AWSTaggedResource
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile, TagsApi
 
 LOGGER = get_logger('cloudwedge.rds')
 
+# Max number of instance arns sent in a single describe filter
+DESCRIBE_FILTER_BATCH_SIZE = 100
+
 
 # Model for Service, extending AWSResource
 class RDSResource(AWSResource):
@@ -32,6 +35,8 @@ class RDSService(AWSService):
     cloudwatch_namespace = "AWS/RDS"
     cloudwatch_dashboard_section_title = "RDS"
     cloudwatch_dimension = "DBInstanceIdentifier"
+    # Opted in instances are found with the tagging api
+    tagging_resource_types = ["rds:db"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["CPUUtilization", "FreeableMemory", "FreeStorageSpace"]
     # Alarm defaults for the service, applied if metric default doesnt exist
@@ -83,7 +88,7 @@ class RDSService(AWSService):
         return AWSService.build_dashboard_widgets(RDSService, resources)
 
     @staticmethod
-    def get_resources(session: boto3.session.Session) -> List[RDSResource]:
+    def get_resources(session: boto3.session.Session, tagged_resources: Optional[List[AWSTaggedResource]] = None) -> List[RDSResource]:
         """
         Return all AWS RDS instances within scope, based on the tags
         """
@@ -92,29 +97,34 @@ class RDSService(AWSService):
             # Collect resources
             cleaned_resources = []
 
-            # Get paginator for rds instances
-            paginator = session.client('rds').get_paginator(
-                'describe_db_instances').paginate()
+            # Get the instances that have opted in to cloudwedge, keyed by arn
+            # e.g. {'arn:aws:rds:us-west-2:ACCOUNTID:db:my-db': [{'Key': 'cloudwedge:active', 'Value': 'true'}]}
+            tagged_resources = TagsApi.get_service_tagged_resources(session, RDSService) if tagged_resources is None else tagged_resources
+            tags_by_arn = {tagged_resource['arn']: tagged_resource['tags'] for tagged_resource in tagged_resources}
 
-            for page_db_instances in paginator:
-                # In each paginator, loop through the instances returned for the page
-                for db_instance in page_db_instances['DBInstances']:
+            db_instance_arns = list(tags_by_arn.keys())
 
-                    # For each db, get the tags on the instance
-                    db_instance_tags = session.client('rds').list_tags_for_resource(
-                        ResourceName=db_instance['DBInstanceArn'])
+            # Only describe the opted in instances, the db engine is not in the tags
+            for i in range(0, len(db_instance_arns), DESCRIBE_FILTER_BATCH_SIZE):
+                paginator = session.client('rds').get_paginator(
+                    'describe_db_instances').paginate(
+                        Filters=[
+                            {'Name': 'db-instance-id',
+                                'Values': db_instance_arns[i:i + DESCRIBE_FILTER_BATCH_SIZE]}
+                        ]
+                    )
 
-                    # e.g. [{'Key': 'notifications', 'Value': 'true'}]
-                    db_tags = db_instance_tags['TagList']
+                for page_db_instances in paginator:
+                    # In each paginator, loop through the instances returned for the page
+                    for db_instance in page_db_instances['DBInstances']:
 
-                    # If the active monitoring tag is on the instance, include in resource collection
-                    # Stripping key so no whitespace mismatch
-                    if any((tag['Key'].strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true') for tag in db_tags):
-                        # This resource has opted in to cloudwedge
+                        # e.g. [{'Key': 'notifications', 'Value': 'true'}]
+                        db_tags = tags_by_arn[db_instance['DBInstanceArn']]
 
                         # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(db_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(db_tags)
+                        tag_profile = TagProfile(db_tags)
+                        owner_from_tag = tag_profile.owner
+                        name_from_tag = tag_profile.name
                         database_id = db_instance['DBInstanceIdentifier']
 
                         # Setup RDSResource values
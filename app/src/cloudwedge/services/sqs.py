@@ -6,18 +6,21 @@ outlined in cloudwedge.models.AWSService
 """
 
 from os import environ
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import boto3
-from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.models import AWSResource, AWSService, AWSTaggedResource
 from cloudwedge.utils.arnparse import arnparse
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile, TagsApi
 
 REGION = environ.get('REGION')
 
 LOGGER = get_logger('cloudwedge.sqs')
 
+# Max number of queue urls returned by a single list queues page
+LIST_QUEUES_PAGE_SIZE = 1000
+
 
 # Model for Service, extending AWSResource
 class SQSResource(AWSResource):
@@ -31,6 +34,8 @@ class SQSService(AWSService):
     cloudwatch_namespace = "AWS/SQS"
     cloudwatch_dashboard_section_title = "SQS"
     cloudwatch_dimension = "QueueName"
+    # Opted in queues are found with the tagging api
+    tagging_resource_types = ["sqs"]
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["ApproximateAgeOfOldestMessage", "NumberOfMessagesSent"]
     default_dashboard_metrics = [
@@ -165,80 +170,41 @@ class SQSService(AWSService):
 
 
     @ staticmethod
-    def get_resources(session: boto3.session.Session) -> List[SQSResource]:
+    def get_resources(session: boto3.session.Session, tagged_resources: Optional[List[AWSTaggedResource]] = None) -> List[SQSResource]:
         """
         Return all AWS SQS instances within scope, based on the tags
         """
 
-        SQS_RESOURCE = session.resource('sqs')
-        SQS_CLIENT = session.client('sqs')
-
         try:
-            instances: List[SQSResource] = []
-
-            # Get paginator for service
-            paginator = SQS_CLIENT.get_paginator('list_queues').paginate()
-
-            # Filters=[
-            #     # Filter for only resources that have cloudwedge tag
-            #     {'Name': f"tag:{AWSService.TAG_ACTIVE}",
-            #         'Values': ["true"]},
-            # ]
-
-            # Collect all instances
-            for page_instances in paginator:
-                for queue_url in page_instances['QueueUrls']:
-
-
-                    # For each db, get the tags on the instance
-                    sqs_instance_tags = SQS_CLIENT.list_queue_tags(
-                        QueueUrl=queue_url
-                    )
-
-                    # e.g. [{'Key': 'notifications', 'Value': 'true'}]
-                    sqs_tags = sqs_instance_tags['Tags']
-
-                    # If the active monitoring tag is on the instance, include in resource collection
-                    # Stripping key so no whitespace mismatch
-                    if any((tag_key.strip() == AWSService.TAG_ACTIVE and tag_val == 'true') for tag_key, tag_val in sqs_tags.items()):
-                        # Add this queue to resource list
-                        queue_res = SQS_RESOURCE.Queue(queue_url)
-
-                        instances.append({"QueueUrl": queue_url, "Tags": sqs_tags, **queue_res.attributes})
+            # Get the queues that have opted in to cloudwedge, the tagging api gives us
+            # the arn and tags so there is no need to look at each queue
+            # >>> Example Tagged Resource
+            # 'arn': 'arn:aws:sqs:us-west-2:ACCOUNTID:cc-west-prd-sqs-billing-invocation-dlq'
+            # 'tags': [{'Key': 'cloudwedge:active', 'Value': 'true'}]
+            tagged_resources = TagsApi.get_service_tagged_resources(session, SQSService) if tagged_resources is None else tagged_resources
 
             # Get things in a neat sqs resource object
             cleaned_resources: List[SQSResource] = []
 
+            # The tagging api keeps returning deleted queues for a while, only keep queues that still exist
+            queue_names = SQSService._get_queue_names(session) if tagged_resources else set()
 
-            # >>> Example Instance
-            # 'QueueUrl': 'url'
-            # 'Tags': {tagKey: tagValue}
-            # 'QueueArn':'arn:aws:sqs:us-west-2:ACCOUNTID:cc-west-prd-sqs-billing-invocation-dlq'
-            # 'ApproximateNumberOfMessages':'0'
-            # 'ApproximateNumberOfMessagesNotVisible':'0'
-            # 'ApproximateNumberOfMessagesDelayed':'0'
-            # 'CreatedTimestamp':'1625761037'
-            # 'LastModifiedTimestamp':'1625761037'
-            # 'VisibilityTimeout':'900'
-            # 'MaximumMessageSize':'262144'
-            # 'MessageRetentionPeriod':'1209600'
-            # 'DelaySeconds':'0'
-            # 'ReceiveMessageWaitTimeSeconds':'20'
-            # 'KmsMasterKeyId':'alias/aws/sqs'
-            # 'KmsDataKeyReusePeriodSeconds':'300'
-
-            for instance in instances:
+            for tagged_resource in tagged_resources:
 
                 # Get values from instance details
-                tags = [{"Key": tag_key, "Value": tag_val} for tag_key, tag_val in instance.get('Tags').items()]
+                tags = tagged_resource['tags']
+
+                arn = arnparse(tagged_resource['arn'])
 
-                arn = arnparse(instance['QueueArn'])
+                if arn.resource_id not in queue_names:
+                    LOGGER.info(f"Skipping deleted queue: {tagged_resource['arn']}")
+                    continue
 
                 # Setup SQSResource values
                 service = SQSService.name
                 resource_name = arn.resource_id
                 resource_id = resource_name
-                resource_owner = TagsApi.get_owner_from_tags(tags)
+                resource_owner = TagProfile(tags).owner
                 tags = tags
 
                 # Create SQSResource
@@ -260,3 +226,18 @@ class SQSService(AWSService):
             LOGGER.info(
                 f"Failed to get instances information with error: {err}")
             raise err
+
+    @staticmethod
+    def _get_queue_names(session: boto3.session.Session) -> Set[str]:
+        """Names of every queue in the region, a page of urls per call"""
+
+        queue_names = set()
+
+        paginator = session.client('sqs').get_paginator('list_queues').paginate(
+            PaginationConfig={'PageSize': LIST_QUEUES_PAGE_SIZE})
+
+        for page_queues in paginator:
+            # e.g. https://sqs.us-west-2.amazonaws.com/ACCOUNTID/my-queue
+            queue_names.update(queue_url.split('/')[-1] for queue_url in page_queues.get('QueueUrls', []))
+
+        return queue_names
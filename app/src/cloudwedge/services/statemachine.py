@@ -6,12 +6,13 @@ outlined in cloudwedge.models.AWSService
 """
 
 from os import environ
-from typing import Any, List, Tuple
+from typing import Any, List, Optional, Set, Tuple
 
 import boto3
-from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.models import AWSResource, AWSService, AWSTaggedResource
+from cloudwedge.utils.arnparse import arnparse
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile, TagsApi
 
 REGION = environ.get('REGION')
 
@@ -30,6 +31,8 @@ class StateMachineService(AWSService):
     cloudwatch_namespace = "AWS/States"
     cloudwatch_dashboard_section_title = "States"
     cloudwatch_dimension = "StateMachineArn"
+    # Opted in state machines are found with the tagging api
+    tagging_resource_types = ["states:stateMachine"]
 
     # Default metric to be used when metrics are not explicit in tags
     default_metrics = ["ExecutionsFailed",
@@ -64,6 +67,14 @@ class StateMachineService(AWSService):
         }
     }
 
+    @staticmethod
+    def get_dimension_id_from_arn(arn: str) -> str:
+        """
+        State machines are measured by their full arn
+        """
+
+        return arn
+
     @staticmethod
     def build_dashboard_widgets(resources: List[StateMachineResource]) -> List[Any]:
         """
@@ -160,7 +171,7 @@ class StateMachineService(AWSService):
         return front_widgets, back_widgets
 
     @ staticmethod
-    def get_resources(session: boto3.session.Session) -> List[StateMachineResource]:
+    def get_resources(session: boto3.session.Session, tagged_resources: Optional[List[AWSTaggedResource]] = None) -> List[StateMachineResource]:
         """
         Return all AWS StateMachine resources within scope, based on the tags
         """
@@ -170,55 +181,48 @@ class StateMachineService(AWSService):
             # Get things in a neat statemachine resource object
             cleaned_resources: List[StateMachineResource] = []
 
-            # Get paginator for service
-            paginator = session.client('stepfunctions').get_paginator(
-                'list_state_machines').paginate()
-
-            # Collect all resources
-            for page_resources in paginator:
-                for state_machine in page_resources['stateMachines']:
-
-                    state_arn = state_machine['stateMachineArn']
-
-                    # For each state, get the tags
-                    states_resource_tags = session.client('stepfunctions').list_tags_for_resource(
-                        resourceArn=state_arn)
-
-                    states_tags = states_resource_tags['tags']
-
-                    # Keys for the tags are 'key' and 'value' so convert that to capitalize
-                    converted_tags = TagsApi.convert_lowercase_tags_keys(
-                        states_tags)
-
-                    # If the active monitoring tag is on the instance, include in resource collection
-                    # Stripping key so no whitespace mismatch
-                    if any((tag['Key'].strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true') for tag in converted_tags):
-                        # This resource has opted in to cloudwedge
-
-                        # Get values from tags if they exist
-                        owner_from_tag = TagsApi.get_owner_from_tags(converted_tags)
-                        name_from_tag = TagsApi.get_name_from_tags(converted_tags)
-                        state_name = state_machine['name']
-
-                        # Setup StateMachine values
-                        service = StateMachineService.name
-                        resource_name = name_from_tag or state_name
-                        resource_id = state_arn
-                        resource_owner = owner_from_tag
-                        tags = converted_tags
-
-                        # Create StateMachine
-                        clean_resource = StateMachineResource(
-                            service=service,
-                            name=resource_name,
-                            uniqueId=resource_name,
-                            cloudwatchDimensionId=resource_id,
-                            owner=resource_owner,
-                            tags=tags
-                        )
-
-                        # Add to collection
-                        cleaned_resources.append(clean_resource)
+            # Get the state machines that have opted in to cloudwedge
+            tagged_resources = TagsApi.get_service_tagged_resources(session, StateMachineService) if tagged_resources is None else tagged_resources
+
+            # The tagging api keeps returning deleted state machines for a while, only keep ones that still exist
+            state_machine_arns = StateMachineService._get_state_machine_arns(session) if tagged_resources else set()
+
+            # Collect all resources, everything needed is on the arn and the tags
+            for tagged_resource in tagged_resources:
+
+                # e.g. arn:aws:states:us-west-2:ACCOUNTID:stateMachine:my-machine
+                state_arn = tagged_resource['arn']
+                states_tags = tagged_resource['tags']
+
+                if state_arn not in state_machine_arns:
+                    LOGGER.info(f"Skipping deleted state machine: {state_arn}")
+                    continue
+
+                # Get values from tags if they exist
+                tag_profile = TagProfile(states_tags)
+                owner_from_tag = tag_profile.owner
+                name_from_tag = tag_profile.name
+                state_name = arnparse(state_arn).resource_id
+
+                # Setup StateMachine values
+                service = StateMachineService.name
+                resource_name = name_from_tag or state_name
+                resource_id = state_arn
+                resource_owner = owner_from_tag
+                tags = states_tags
+
+                # Create StateMachine
+                clean_resource = StateMachineResource(
+                    service=service,
+                    name=resource_name,
+                    uniqueId=resource_name,
+                    cloudwatchDimensionId=resource_id,
+                    owner=resource_owner,
+                    tags=tags
+                )
+
+                # Add to collection
+                cleaned_resources.append(clean_resource)
 
             return cleaned_resources
 
@@ -226,3 +230,17 @@ class StateMachineService(AWSService):
             LOGGER.info(
                 f"Failed to get resources information with error: {err}")
             raise err
+
+    @staticmethod
+    def _get_state_machine_arns(session: boto3.session.Session) -> Set[str]:
+        """Arns of every state machine in the region, a page of them per call"""
+
+        state_machine_arns = set()
+
+        paginator = session.client('stepfunctions').get_paginator('list_state_machines').paginate()
+
+        for page_state_machines in paginator:
+            state_machine_arns.update(
+                state_machine['stateMachineArn'] for state_machine in page_state_machines['stateMachines'])
+
+        return state_machine_arns
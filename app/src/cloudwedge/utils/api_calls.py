@@ -0,0 +1,179 @@
+'''
+ApiCalls
+
+Counts every api call made through the spoke sessions, by (service,
+operation), with its latency, the retries botocore made and the attempts
+that were throttled. Spoke accounts share their api quotas with the
+workloads running in them, so each handler reports what its run cost.
+
+The recorder hooks the session events, so nothing calling the clients has
+to change:
+    before-parameter-build  the call starts
+    needs-retry             an attempt finished, throttled or not
+    after-call              the call returned (after any retries)
+    after-call-error        the call raised before a response came back
+
+API_CALL_RECORDER is attached to every spoke session as a spoke session
+hook. A handler resets it when its run starts and adds the totals to its
+output when it ends. Handlers run once per stack inside a Map only add the
+call count, their outputs are all kept in the execution state.
+'''
+
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+
+from cloudwedge.utils.logger import get_logger
+
+# Setup logger
+LOGGER = get_logger('util.api_calls')
+
+# Where the start of the call is kept between events
+CONTEXT_STARTED_AT_KEY = 'cloudwedgeApiCallStartedAt'
+
+# Error codes botocore treats as throttling
+THROTTLE_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException'
+}
+
+
+class ApiCallRecorder():
+    def __init__(self):
+        # Stats keyed by (service, operation)
+        self.stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # Discovery calls from a worker pool
+        self.lock = threading.Lock()
+
+    def attach(self, session: boto3.session.Session):
+        '''Count the calls of every client made from the session after this'''
+
+        session.events.register('before-parameter-build', self._on_call_start,
+                                unique_id='cloudwedge-api-calls-start')
+        session.events.register('needs-retry', self._on_attempt, unique_id='cloudwedge-api-calls-attempt')
+        session.events.register('after-call', self._on_call_end, unique_id='cloudwedge-api-calls-end')
+        session.events.register('after-call-error', self._on_call_error, unique_id='cloudwedge-api-calls-error')
+
+    def reset(self):
+        '''Start counting a new run'''
+
+        with self.lock:
+            self.stats = {}
+
+    def get_totals(self) -> Dict[str, Any]:
+        '''
+        Totals for the run
+
+            Returns:
+                {
+                    "calls": 12,
+                    "retries": 1,
+                    "throttles": 1,
+                    "errors": 0,
+                    "latencyMs": 840.2,
+                    "operations": {
+                        "ec2.DescribeInstances": {"calls": 2, "retries": 1, "throttles": 1, "errors": 0,
+                                                  "latencyMs": 410.5, "maxLatencyMs": 390.1}
+                    }
+                }
+        '''
+
+        with self.lock:
+            operations = {
+                f'{service_name}.{operation_name}': {
+                    **stats,
+                    'latencyMs': round(stats['latencyMs'], 1),
+                    'maxLatencyMs': round(stats['maxLatencyMs'], 1)
+                }
+                for (service_name, operation_name), stats in sorted(self.stats.items())
+            }
+
+        return {
+            'calls': sum(stats['calls'] for stats in operations.values()),
+            'retries': sum(stats['retries'] for stats in operations.values()),
+            'throttles': sum(stats['throttles'] for stats in operations.values()),
+            'errors': sum(stats['errors'] for stats in operations.values()),
+            'latencyMs': round(sum(stats['latencyMs'] for stats in operations.values()), 1),
+            'operations': operations
+        }
+
+    def add_totals(self, output: Optional[Dict], handler: str, operations: bool = True) -> Optional[Dict]:
+        '''Log the totals for the run and add them to the output as apiCalls, just the count without operations'''
+
+        totals = self.get_totals()
+
+        LOGGER.info(f"{handler} made {totals['calls']} api calls, {totals['retries']} retries, "
+                    f"{totals['throttles']} throttled, {totals['errors']} errors: {totals['operations']}")
+
+        if isinstance(output, dict):
+            output['apiCalls'] = totals if operations else totals['calls']
+
+        return output
+
+    def _get_stats(self, model) -> Dict[str, Any]:
+        '''Stats for the operation, lock must be held'''
+
+        key = (model.service_model.service_name, model.name)
+
+        if key not in self.stats:
+            self.stats[key] = {'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0,
+                               'latencyMs': 0.0, 'maxLatencyMs': 0.0}
+
+        return self.stats[key]
+
+    @staticmethod
+    def _on_call_start(context: Optional[Dict[str, Any]] = None, **kwargs):
+        if context is not None:
+            context[CONTEXT_STARTED_AT_KEY] = time.perf_counter()
+
+    def _on_attempt(self, operation=None, response=None, **kwargs):
+        '''Every attempt, the last one included, throttled ones are counted here'''
+
+        if operation is None or not response:
+            return None
+
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            with self.lock:
+                self._get_stats(operation)['throttles'] += 1
+
+        # Never decides on the retry, thats left to botocore
+        return None
+
+    def _on_call_end(self, model=None, parsed=None, context=None, **kwargs):
+        self._record_call(model, context, parsed or {}, failed=bool((parsed or {}).get('Error')))
+
+    def _on_call_error(self, model=None, context=None, **kwargs):
+        self._record_call(model, context, {}, failed=True)
+
+    def _record_call(self, model, context: Optional[Dict[str, Any]], parsed: Dict[str, Any], failed: bool):
+        if model is None:
+            return
+
+        started_at = (context or {}).get(CONTEXT_STARTED_AT_KEY)
+        latency_ms = (time.perf_counter() - started_at) * 1000 if started_at else 0.0
+
+        with self.lock:
+            stats = self._get_stats(model)
+            stats['calls'] += 1
+            stats['retries'] += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+            stats['errors'] += int(failed)
+            stats['latencyMs'] += latency_ms
+            stats['maxLatencyMs'] = max(stats['maxLatencyMs'], latency_ms)
+
+
+# Attached to every spoke session, shared by every handler in the container
+API_CALL_RECORDER = ApiCallRecorder()
@@ -56,6 +56,14 @@ def arnparse(arn_str):
     )
 
 
+def arn_resource_type(arn):
+    """Resource type used to match arns to services e.g. 'rds:db' or 'sqs'"""
+
+    # arn:aws:states:us-west-2:ACCOUNTID:stateMachine:my-machine > 'states:stateMachine'
+    # arn:aws:sqs:us-west-2:ACCOUNTID:my-queue > 'sqs'
+    return f'{arn.service}:{arn.resource_type}' if arn.resource_type else arn.service
+
+
 def _parse_resource(resource):
     first_separator_index = -1
     for idx, c in enumerate(resource):
@@ -0,0 +1,110 @@
+'''claim_check.py
+
+Step functions fail an execution when the state goes over 256KB. Handlers
+that return large fields check them in to the private assets bucket,
+compressed, and pass a small pointer in their place:
+
+    {
+        "ownerResources": {
+            "claimCheck": {
+                "bucket": "bucket",
+                "key": "claim-checks/<account>/<digest>.json.gz"
+            }
+        }
+    }
+
+Each index.py checks the pointers back out before calling its app, so the
+apps see the same event either way. Payloads under the threshold stay
+inline and cost nothing extra.
+'''
+
+import gzip
+import hashlib
+import json
+from os import environ
+from typing import Any, Dict, List
+
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.s3 import s3_get_object, s3_save_object
+
+LOGGER = get_logger('util.claim_check')
+
+PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+
+# Payloads larger than this have their large fields checked in, leaves room
+# for the states that add their results alongside
+CLAIM_CHECK_THRESHOLD_BYTES = int(environ.get('CLAIM_CHECK_THRESHOLD_BYTES', '131072'))
+
+CLAIM_CHECK_KEY = 'claimCheck'
+
+
+class MissingClaimCheckError(Exception):
+    def __init__(self, field: str, key: str):
+        self.field = field
+        self.key = key
+
+    def __str__(self):
+        return f'claim check for {self.field} is missing from s3: {self.key}'
+
+
+def check_in(session, target_account_id: str, payload: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    '''Replace the fields with pointers to s3 when the payload is over the threshold'''
+
+    payload_bytes = len(json.dumps(payload))
+
+    if payload_bytes <= CLAIM_CHECK_THRESHOLD_BYTES:
+        return payload
+
+    checked_in = dict(payload)
+
+    for field in fields:
+        if checked_in.get(field) is None:
+            continue
+
+        content = json.dumps(checked_in[field], separators=(',', ':')).encode('utf-8')
+
+        # Same content lands on the same key, a rerun doesnt write it again under a new name
+        key = f'claim-checks/{target_account_id}/{hashlib.sha256(content).hexdigest()}.json.gz'
+
+        s3_save_object(session=session, bucket=PRIVATE_ASSETS_BUCKET, key=key,
+                       content=gzip.compress(content))
+
+        checked_in[field] = {
+            CLAIM_CHECK_KEY: {
+                'bucket': PRIVATE_ASSETS_BUCKET,
+                'key': key
+            }
+        }
+
+    LOGGER.info(f'Checked in {fields} from a {payload_bytes} byte payload, now {len(json.dumps(checked_in))} bytes')
+
+    return checked_in
+
+
+def check_out(session, payload: Dict[str, Any]) -> Dict[str, Any]:
+    '''Replace any pointers in the payload with the content they point to'''
+
+    if not isinstance(payload, dict) or not any(is_claim_check(value) for value in payload.values()):
+        return payload
+
+    checked_out = dict(payload)
+
+    for field, value in payload.items():
+        if not is_claim_check(value):
+            continue
+
+        content = s3_get_object(session=session, bucket=value[CLAIM_CHECK_KEY]['bucket'],
+                                key=value[CLAIM_CHECK_KEY]['key'])
+
+        if content is None:
+            raise MissingClaimCheckError(field, value[CLAIM_CHECK_KEY]['key'])
+
+        checked_out[field] = json.loads(gzip.decompress(content))
+
+    return checked_out
+
+
+def is_claim_check(value: Any) -> bool:
+    '''Check if the value is a claim check pointer'''
+
+    return isinstance(value, dict) and list(value.keys()) == [CLAIM_CHECK_KEY]
@@ -0,0 +1,219 @@
+'''
+Metrics
+
+Times named phases of a handler run and counts items per phase, then
+emits them as CloudWatch embedded metric format (EMF) log lines.
+CloudWatch turns the lines into metrics, no put_metric_data calls needed.
+
+Every measurement carries the Handler dimension, plus whichever of
+Account, Owner, Service, Phase (or anything else) it was recorded with.
+Each line also rolls up to just Handler (and Phase), so the totals can be
+graphed without knowing every account and owner.
+
+METRICS_MODE picks where the lines go:
+    emf:   printed to stdout for cloudwatch logs (default)
+    local: kept in LOCAL_METRICS_COLLECTOR, for tests
+    off:   nothing is recorded
+'''
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from os import environ
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from cloudwedge.utils.logger import get_logger
+
+# Setup logger
+LOGGER = get_logger('util.metrics')
+
+METRICS_MODE_EMF = 'emf'
+METRICS_MODE_LOCAL = 'local'
+METRICS_MODE_OFF = 'off'
+METRICS_MODE = environ.get('METRICS_MODE', METRICS_MODE_EMF).lower()
+
+METRICS_NAMESPACE = environ.get('METRICS_NAMESPACE', 'CloudWedge')
+
+UNIT_MILLISECONDS = 'Milliseconds'
+UNIT_COUNT = 'Count'
+UNIT_BYTES = 'Bytes'
+
+# EMF takes at most 100 metrics per line and 100 values per metric
+EMF_MAX_METRICS = 100
+EMF_MAX_VALUES = 100
+
+# Dimensions every measurement rolls up to
+ROLLUP_DIMENSIONS = ['Handler', 'Phase']
+
+
+class EmfSink():
+    '''Print the lines to stdout, lambda ships them to cloudwatch logs'''
+
+    def emit(self, document: Dict[str, Any]):
+        print(json.dumps(document, separators=(',', ':')), flush=True)
+
+
+class LocalMetricsCollector():
+    '''Keep the lines in memory, stand in for tests'''
+
+    def __init__(self):
+        self.documents: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def emit(self, document: Dict[str, Any]):
+        with self.lock:
+            self.documents.append(document)
+
+    def get_values(self, name: str, **dimensions) -> List[float]:
+        '''Values of the metric recorded with (at least) the given dimensions'''
+
+        wanted = {_get_dimension_name(key): str(value) for key, value in dimensions.items()}
+        values: List[float] = []
+
+        with self.lock:
+            for document in self.documents:
+                if name in document and all(document.get(key) == value for key, value in wanted.items()):
+                    values.extend(document[name])
+
+        return values
+
+    def clear(self):
+        with self.lock:
+            self.documents = []
+
+
+class Metrics():
+    def __init__(self, handler: str, account: Optional[str] = None, sink=None,
+                 namespace: str = METRICS_NAMESPACE, enabled: bool = True):
+
+        # Dimensions on every measurement of the run
+        self.dimensions = {'Handler': handler}
+
+        if account:
+            self.dimensions['Account'] = str(account)
+
+        # EmfSink or LocalMetricsCollector, defaults to the one for METRICS_MODE, None records nothing
+        self.sink = (sink if sink is not None else get_metrics_sink()) if enabled else None
+        self.namespace = namespace
+
+        # Values by dimensions, then by metric name with its unit
+        self.values: Dict[Tuple[Tuple[str, str], ...], Dict[str, Tuple[str, List[float]]]] = {}
+        # Builds on worker pools record from many threads
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, **dimensions) -> Iterator[None]:
+        '''Time the block as the phase, recorded as PhaseLatency even if the block raises'''
+
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.put('PhaseLatency', (time.perf_counter() - started_at) * 1000, UNIT_MILLISECONDS,
+                     phase=name, **dimensions)
+
+    def count(self, name: str, value: float, unit: str = UNIT_COUNT, **dimensions):
+        '''Count items e.g. count('Resources', 12, phase='discovery', service='ec2')'''
+
+        self.put(name, value, unit, **dimensions)
+
+    def put(self, name: str, value: float, unit: str, **dimensions):
+        '''Record a value for the metric'''
+
+        if self.sink is None:
+            return
+
+        key = tuple(sorted({
+            **self.dimensions,
+            **{_get_dimension_name(key): str(value) for key, value in dimensions.items() if value is not None}
+        }.items()))
+
+        with self.lock:
+            self.values.setdefault(key, {}).setdefault(name, (unit, []))[1].append(value)
+
+    def flush(self):
+        '''Emit everything recorded so far, one line per set of dimensions'''
+
+        if self.sink is None:
+            return
+
+        with self.lock:
+            values = self.values
+            self.values = {}
+
+        timestamp = int(time.time() * 1000)
+
+        try:
+            for key, metrics in values.items():
+                for document in self._get_documents(timestamp, dict(key), metrics):
+                    self.sink.emit(document)
+
+        except Exception as err:
+            # Metrics are never worth failing the run for
+            LOGGER.warning(f'Failed to emit metrics: {err}')
+
+    def _get_documents(self, timestamp: int, dimensions: Dict[str, str],
+                       metrics: Dict[str, Tuple[str, List[float]]]) -> List[Dict[str, Any]]:
+        '''EMF lines for one set of dimensions, split to fit the limits'''
+
+        dimension_sets = [sorted(dimensions)]
+        rollup = [key for key in ROLLUP_DIMENSIONS if key in dimensions]
+
+        if rollup != dimension_sets[0]:
+            dimension_sets.append(rollup)
+
+        # Each chunk of values goes on its own line
+        chunks: List[Dict[str, Tuple[str, List[float]]]] = []
+
+        for name, (unit, metric_values) in metrics.items():
+            for index, start in enumerate(range(0, len(metric_values), EMF_MAX_VALUES)):
+                if index == len(chunks):
+                    chunks.append({})
+                chunks[index][name] = (unit, metric_values[start:start + EMF_MAX_VALUES])
+
+        documents = []
+
+        for chunk in chunks:
+            names = list(chunk)
+
+            for start in range(0, len(names), EMF_MAX_METRICS):
+                chunk_names = names[start:start + EMF_MAX_METRICS]
+
+                documents.append({
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': dimension_sets,
+                            'Metrics': [{'Name': name, 'Unit': chunk[name][0]} for name in chunk_names]
+                        }]
+                    },
+                    **dimensions,
+                    **{name: chunk[name][1] for name in chunk_names}
+                })
+
+        return documents
+
+
+def _get_dimension_name(key: str) -> str:
+    '''Keyword to dimension name e.g. stackType > StackType'''
+
+    return key[:1].upper() + key[1:]
+
+
+def get_metrics_sink():
+    '''Sink for the configured mode, None when metrics are off'''
+
+    if METRICS_MODE == METRICS_MODE_OFF:
+        return None
+
+    if METRICS_MODE == METRICS_MODE_LOCAL:
+        return LOCAL_METRICS_COLLECTOR
+
+    return EMF_SINK
+
+
+EMF_SINK = EmfSink()
+LOCAL_METRICS_COLLECTOR = LocalMetricsCollector()
@@ -1,30 +1,75 @@
 '''s3.py'''
 import os
+import threading
+import weakref
+from typing import Optional
 
 import boto3
+from botocore.exceptions import ClientError
 
 from cloudwedge.utils.logger import get_logger
 
 # Setup logger
 LOGGER = get_logger('util.s3')
 
-RESOURCE_S3 = None
+# S3 clients cached per session, so a warm container serving another
+# spoke account doesnt reuse the first accounts credentials
+CLIENTS_S3 = weakref.WeakKeyDictionary()
+# Creating clients from a session isnt thread safe, the clients themselves are
+CLIENTS_S3_LOCK = threading.Lock()
 
 
 def s3_save_object(session, bucket: str, key: str, content=None):
     '''Save the contents to the given target object'''
 
-    global RESOURCE_S3
+    client_s3 = _get_client_s3(session)
 
-    if not RESOURCE_S3:
-        RESOURCE_S3 = session.resource('s3')
+    try:
+        client_s3.put_object(Bucket=bucket, Key=key, Body=content)
+
+        return key
+
+    except Exception as err:
+        raise err
 
-    s3_object = RESOURCE_S3.Object(bucket, key)
+
+def s3_get_object(session, bucket: str, key: str) -> Optional[bytes]:
+    '''Get the contents of the target object, None if it doesnt exist'''
+
+    client_s3 = _get_client_s3(session)
 
     try:
-        s3_object.put(Body=content)
+        response = client_s3.get_object(Bucket=bucket, Key=key)
+
+        return response['Body'].read()
+
+    except ClientError as err:
+        if err.response['Error']['Code'] in ['NoSuchKey', '404']:
+            return None
+
+        raise err
+
+
+def s3_delete_object(session, bucket: str, key: str):
+    '''Delete the target object, deleting a missing object is not an error'''
 
-        return s3_object.key
+    client_s3 = _get_client_s3(session)
+
+    try:
+        client_s3.delete_object(Bucket=bucket, Key=key)
 
     except Exception as err:
         raise err
+
+
+def _get_client_s3(session):
+    '''Get the cached s3 client for the session'''
+
+    with CLIENTS_S3_LOCK:
+        client_s3 = CLIENTS_S3.get(session)
+
+        if not client_s3:
+            client_s3 = session.client('s3')
+            CLIENTS_S3[session] = client_s3
+
+    return client_s3
@@ -0,0 +1,109 @@
+'''
+Stack Status
+
+Buckets for the cloudformation stack statuses, shared by the status check
+that polls a stack and the callback that is told about it by events.
+'''
+
+from typing import Dict, Optional
+
+# Status that will be marked complete with no more actions needed
+TRIGGER_COMPLETE = [
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'DELETE_COMPLETE'
+]
+
+# Status that will remain in progress
+TRIGGER_INPROGRESS = [
+    'CREATE_IN_PROGRESS',
+    'UPDATE_IN_PROGRESS',
+    'ROLLBACK_IN_PROGRESS',
+    'DELETE_IN_PROGRESS',
+    'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS',
+    'UPDATE_ROLLBACK_IN_PROGRESS',
+    'REVIEW_IN_PROGRESS',
+    'UPDATE_ROLLBACK_COMPLETE_CLEANUP_IN_PROGRESS'
+]
+
+# Status that will need intervention to recover from
+TRIGGER_ERROR = [
+    'DELETE_FAILED',
+    'CREATE_FAILED',
+    'ROLLBACK_FAILED',
+    'UPDATE_ROLLBACK_FAILED',
+    'UPDATE_ROLLBACK_COMPLETE'
+]
+
+# Status that will trigger a delete stack operation
+TRIGGER_DELETE = [
+    'ROLLBACK_COMPLETE'
+]
+
+
+def stack_status_is_complete(status: str) -> bool:
+    '''Return status'''
+    return bool(status in TRIGGER_COMPLETE)
+
+
+def stack_status_is_inprogress(status: str) -> bool:
+    '''Return status'''
+    return bool(status in TRIGGER_INPROGRESS)
+
+
+def stack_status_is_error(status: str) -> bool:
+    '''Return status'''
+    return bool(status in TRIGGER_ERROR)
+
+
+def stack_status_is_delete(status: str) -> bool:
+    '''Return status'''
+    return bool(status in TRIGGER_DELETE)
+
+
+def get_stack_error(stack_name: str, status: str) -> Optional[Dict]:
+    '''Stack error for the status, None when the status isnt an error'''
+
+    if stack_status_is_delete(status):
+        return {
+            'StackName': stack_name,
+            'Message': f'Stack ({stack_name}) is in state {status}: create failed and has been deleted. Please review and see whats going to figure out what needs to change.'
+        }
+
+    if stack_status_is_error(status):
+        return {
+            'StackName': stack_name,
+            'Message': f'Stack ({stack_name}) is in state {status} and unrecoverable right now, need some help to fix this up. Please review and see whats going to figure out what needs to change.'
+        }
+
+    return None
+
+
+def get_stack_status_output(stack_name: str, status: str) -> Dict:
+    '''
+    Status check output for the stack in the status, a stack in a delete status
+    still needs deleting by the caller
+
+        Returns:
+            {
+                "inProgress": False,
+                "stackName": "cloudwedge-autogen-owner-alarms-stack",
+                "hasError": False,
+                "stackErrors": []
+            }
+    '''
+
+    output = {
+        'inProgress': stack_status_is_inprogress(status),
+        'stackName': stack_name,
+        'hasError': False,
+        'stackErrors': []
+    }
+
+    stack_error = get_stack_error(stack_name, status)
+
+    if stack_error:
+        output['hasError'] = True
+        output['stackErrors'].append(stack_error)
+
+    return output
@@ -0,0 +1,91 @@
+'''
+Stacks
+
+Naming for the stacks cloudwedge generates, shared by the handlers that
+create, triage and clean them up.
+
+Alarm and dashboard stacks are sharded when an owner has more than fits
+in one stack. Shard 0 keeps the original name so owners that fit in one
+stack are unchanged:
+
+    cloudwedge-autogen-<owner>-alarms-stack
+    cloudwedge-autogen-<owner>-alarms-<shard>-stack
+    cloudwedge-autogen-<owner>-dashboard-stack
+    cloudwedge-autogen-<owner>-dashboard-<shard>-stack
+
+Alarms can also be partitioned into a stack per service of the owner, so a
+change to one service only updates that services stack. Each service is
+sharded on its own:
+
+    cloudwedge-autogen-<owner>-alarms-<service>-stack
+    cloudwedge-autogen-<owner>-alarms-<service>-<shard>-stack
+'''
+
+import hashlib
+import re
+from typing import Dict, Optional
+
+STACK_NAME_PREFIX = 'cloudwedge-autogen-'
+
+STACK_TYPE_ALARMS = 'alarms'
+STACK_TYPE_DASHBOARD = 'dashboard'
+
+RE_STACK_NAME = re.compile(
+    rf'^{STACK_NAME_PREFIX}(?P<owner>.+)-(?P<type>{STACK_TYPE_ALARMS}|{STACK_TYPE_DASHBOARD})'
+    # Service names start with a letter, shards are numbers
+    r'(?:-(?P<service>[a-z][a-z0-9]*))?(?:-(?P<shard>\d+))?-stack$'
+)
+
+
+def get_alarms_stack_name(owner: str, shard: int = 0, service: Optional[str] = None) -> str:
+    '''Name of the alarms stack for the owners shard, or the shard of one of its services'''
+
+    partition = f'{STACK_TYPE_ALARMS}-{service}' if service else STACK_TYPE_ALARMS
+
+    if shard:
+        return f'{STACK_NAME_PREFIX}{owner}-{partition}-{shard}-stack'
+
+    return f'{STACK_NAME_PREFIX}{owner}-{partition}-stack'
+
+
+def get_dashboard_stack_name(owner: str, shard: int = 0) -> str:
+    '''Name of the dashboard stack for the owners shard'''
+
+    if shard:
+        return f'{STACK_NAME_PREFIX}{owner}-{STACK_TYPE_DASHBOARD}-{shard}-stack'
+
+    return f'{STACK_NAME_PREFIX}{owner}-{STACK_TYPE_DASHBOARD}-stack'
+
+
+def get_shard_index(unique_id: str, shard_count: int) -> int:
+    '''Stable shard for a resource, the same across runs and lambda containers'''
+
+    return int(hashlib.md5(unique_id.encode('utf-8')).hexdigest(), 16) % shard_count
+
+
+def parse_stack_name(stack_name: str) -> Optional[Dict]:
+    '''
+    Parse a generated stack name, None when its not one of ours
+
+        Returns:
+            {
+                "owner": "owner",
+                "type": "alarms",
+                "service": "sqs",
+                "shard": 0
+            }
+
+        service is None unless the alarms are partitioned by service
+    '''
+
+    match = RE_STACK_NAME.match(stack_name)
+
+    if not match:
+        return None
+
+    return {
+        'owner': match.group('owner'),
+        'type': match.group('type'),
+        'service': match.group('service'),
+        'shard': int(match.group('shard') or 0)
+    }
@@ -1,21 +1,121 @@
-'''s3.py'''
+'''sts.py'''
+import threading
+from datetime import datetime, timedelta, timezone
 from os import environ
+from typing import Callable, Dict, List, Optional, Tuple
 
 import boto3
 
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
 from cloudwedge.utils.logger import get_logger
 
 # Setup logger
-LOGGER = get_logger('util.s3')
+LOGGER = get_logger('util.sts')
 
 SESSION = boto3.session.Session()
 STS_CLIENT = SESSION.client('sts')
 
 SPOKE_WORKER_ROLE_NAME = environ.get('SPOKE_WORKER_ROLE_NAME')
+REGION = environ.get('REGION')
 
+# Refresh spoke credentials this many seconds before they expire
+SPOKE_SESSION_REFRESH_MARGIN = int(environ.get('SPOKE_SESSION_REFRESH_MARGIN', '300'))
 
-def get_spoke_session(target_account_id):
-    '''Get boto3 session for target spoke aws account'''
+# Run on every spoke session before any client is made from it, api calls are always counted
+SPOKE_SESSION_HOOKS: List[Callable[[boto3.session.Session], None]] = [API_CALL_RECORDER.attach]
+
+
+class SpokeSessionPool():
+    '''
+    Pool of spoke sessions keyed by (account, region)
+
+    A warm lambda container can serve more than one spoke account, so sessions
+    are kept per account and the assumed role credentials are refreshed before
+    they expire. Clients are cached per (account, region, service) so warm
+    invocations skip both the assume role and the client construction.
+    '''
+
+    def __init__(self, refresh_margin_seconds: int = SPOKE_SESSION_REFRESH_MARGIN):
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        # (account, region) > {'session': Session, 'expiration': datetime, 'clients': {service: client}}
+        self._entries: Dict[Tuple[str, Optional[str]], Dict] = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, target_account_id: str, region_name: Optional[str] = None) -> boto3.session.Session:
+        '''Get a session for the spoke account, assuming the role only if needed'''
+
+        return self._get_entry(target_account_id, region_name)['session']
+
+    def get_client(self, target_account_id: str, service_name: str, region_name: Optional[str] = None):
+        '''Get a cached client for the spoke account'''
+
+        entry = self._get_entry(target_account_id, region_name)
+
+        with self._lock:
+            client = entry['clients'].get(service_name)
+
+            if not client:
+                client = entry['session'].client(service_name)
+                entry['clients'][service_name] = client
+
+        return client
+
+    def add_session(self, target_account_id: str, session: boto3.session.Session,
+                    region_name: Optional[str] = None, expiration: Optional[datetime] = None):
+        '''Use a session built elsewhere for the spoke account e.g. one replaying recorded responses'''
+
+        region_name = region_name or REGION
+
+        with self._lock:
+            self._entries[(str(target_account_id), region_name)] = {
+                'session': attach_spoke_session_hooks(session),
+                # Never refreshed unless it expires
+                'expiration': expiration or datetime.max.replace(tzinfo=timezone.utc),
+                'clients': {}
+            }
+
+    def clear(self):
+        '''Drop every session and client'''
+
+        with self._lock:
+            self._entries = {}
+
+    def _get_entry(self, target_account_id: str, region_name: Optional[str]) -> Dict:
+        '''Get the pool entry, creating or refreshing it when the credentials are close to expiring'''
+
+        region_name = region_name or REGION
+        key = (str(target_account_id), region_name)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry and not self._is_expiring(entry['expiration']):
+                return entry
+
+            if entry:
+                LOGGER.info(f"Spoke credentials for {key} expire at {entry['expiration']}, refreshing")
+
+            # Clients are bound to the old credentials, so they are dropped with the entry
+            session, expiration = _assume_spoke_session(target_account_id, region_name)
+
+            entry = {
+                'session': session,
+                'expiration': expiration,
+                'clients': {}
+            }
+
+            self._entries[key] = entry
+
+            return entry
+
+    def _is_expiring(self, expiration: datetime) -> bool:
+        '''Check if the credentials expire within the refresh margin'''
+
+        return datetime.now(timezone.utc) + self.refresh_margin >= expiration
+
+
+def _assume_spoke_session(target_account_id, region_name=None) -> Tuple[boto3.session.Session, datetime]:
+    '''Assume the spoke worker role and return a session with its expiration'''
     LOGGER.info(f"Getting session in the spoke target account: {target_account_id}")
 
     spoke_target_role = f"arn:aws:iam::{target_account_id}:role/{SPOKE_WORKER_ROLE_NAME}"
@@ -34,9 +134,42 @@ def get_spoke_session(target_account_id):
             aws_access_key_id=spoke_assume_role['Credentials']['AccessKeyId'],
             aws_secret_access_key=spoke_assume_role['Credentials']['SecretAccessKey'],
             aws_session_token=spoke_assume_role['Credentials']['SessionToken'],
+            region_name=region_name
         )
     except Exception as err:
         LOGGER.error(f"Failed to create boto3 session for spoke using the assumed role credentials with error: {err}")
         raise err
 
-    return spoke_session
+    return attach_spoke_session_hooks(spoke_session), spoke_assume_role['Credentials']['Expiration']
+
+
+def add_spoke_session_hook(hook: Callable[[boto3.session.Session], None]):
+    '''Run the hook on every spoke session built from now on e.g. to register event handlers'''
+
+    if hook not in SPOKE_SESSION_HOOKS:
+        SPOKE_SESSION_HOOKS.append(hook)
+
+
+def attach_spoke_session_hooks(session: boto3.session.Session) -> boto3.session.Session:
+    '''Run the spoke session hooks on a session, also used for sessions cloned from a spoke session'''
+
+    for hook in SPOKE_SESSION_HOOKS:
+        hook(session)
+
+    return session
+
+
+# Shared by every handler in the container
+SPOKE_SESSION_POOL = SpokeSessionPool()
+
+
+def get_spoke_session(target_account_id, region_name=None):
+    '''Get boto3 session for target spoke aws account'''
+
+    return SPOKE_SESSION_POOL.get_session(target_account_id, region_name)
+
+
+def get_spoke_client(target_account_id, service_name, region_name=None):
+    '''Get cached boto3 client for target spoke aws account'''
+
+    return SPOKE_SESSION_POOL.get_client(target_account_id, service_name, region_name)
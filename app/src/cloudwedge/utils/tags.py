@@ -1,14 +1,150 @@
 """tags.py"""
 import re
 import os
-from typing import Tuple, Dict, List
+from typing import Dict, List, Optional, Tuple
 
-from cloudwedge.models import AWSService, AWSTag
+from cloudwedge.models import AWSService, AWSTag, AWSTaggedResource
+from cloudwedge.utils.arnparse import arn_resource_type, arnparse
 from cloudwedge.utils.logger import get_logger
 
 # Setup logger
 LOGGER = get_logger('util.tags')
 
+# Max number of arns the tagging api accepts in a single request
+TAGGING_ARN_BATCH_SIZE = 100
+
+# Metric prop override keys e.g. cloudwedge:alarm:metric:CPUUtilization:prop:Threshold
+RE_TAG_METRIC_PROP = re.compile(f'{re.escape(AWSService.TAG_ALARM_METRIC_PREFIX)}(.+?):prop:(.*)')
+# Supported alarm props keyed by their lowered name, tags can use any case
+SUPPORTED_ALARM_PROPS_BY_LOWER = {prop.lower(): prop for prop in AWSService.SUPPORTED_ALARM_PROPS}
+# Tags that list metrics for a specific level
+TAG_METRICS_BY_LEVEL = {
+    'critical': AWSService.TAG_METRICS_CRITICAL,
+    'high': AWSService.TAG_METRICS_HIGH,
+    'medium': AWSService.TAG_METRICS_MEDIUM,
+    'low': AWSService.TAG_METRICS_LOW
+}
+
+
+class TagProfile():
+    """
+    Everything cloudwedge reads from a resources tags, parsed in a single pass
+
+    Building the alarms for a resource used to scan every tag again for every
+    metric and prop, the profile is built once per resource and read from there.
+    """
+
+    def __init__(self, tags: List[AWSTag]):
+        # Tags as they were on the resource
+        self.tags = tags if type(tags) is list else []
+
+        # Has the cloudwedge active tag
+        self.is_active = False
+        self.owner = AWSService.DEFAULT_OWNER
+        self.name = None
+        self.level = AWSService.DEFAULT_LEVEL
+
+        # Metrics explicitly listed on the tags, per level
+        self.has_metrics = False
+        self.metrics_by_level: Dict[str, List[str]] = {}
+
+        # Root alarm prop overrides e.g. cloudwedge:alarm:prop:Threshold
+        self.alarm_props: Dict[str, str] = {}
+        # Metric alarm prop overrides, keyed by cleaned metric name
+        self.metric_alarm_props: Dict[str, Dict[str, str]] = {}
+
+        self._parse()
+
+    def get_metric_alarm_props(self, metric: str, supported_metrics: List[str]) -> Dict[str, str]:
+        """Get the prop overrides for a metric, only if the service supports the metric"""
+
+        clean_metric = TagsApi.clean_value(metric)
+
+        if not any(clean_metric == TagsApi.clean_value(supported_metric) for supported_metric in supported_metrics):
+            return {}
+
+        return dict(self.metric_alarm_props.get(clean_metric, {}))
+
+    def _parse(self):
+        """Single pass over the tags"""
+
+        # First tag wins for plain values, same as looking the key up
+        values: Dict[str, str] = {}
+
+        for tag in self.tags:
+            key = tag['Key']
+
+            values.setdefault(key, tag['Value'])
+
+            # Stripping key so no whitespace mismatch
+            if key.strip() == AWSService.TAG_ACTIVE and tag['Value'] == 'true':
+                self.is_active = True
+
+            # Does the tag have the alarms props prefix
+            if AWSService.TAG_ALARM_PROP_PREFIX in key:
+                # Remaining bit of the tag is the target prop, is it valid?
+                target_prop = SUPPORTED_ALARM_PROPS_BY_LOWER.get(
+                    key.replace(AWSService.TAG_ALARM_PROP_PREFIX, '').lower())
+
+                if target_prop:
+                    self.alarm_props[target_prop] = tag['Value']
+
+            # Does the tag have the metrics props prefix
+            elif AWSService.TAG_ALARM_METRIC_PREFIX in key:
+                match = RE_TAG_METRIC_PROP.search(key)
+
+                if match:
+                    target_prop = SUPPORTED_ALARM_PROPS_BY_LOWER.get(match.group(2).lower())
+
+                    if target_prop:
+                        self.metric_alarm_props.setdefault(
+                            TagsApi.clean_value(match.group(1)), {})[target_prop] = tag['Value']
+
+        if AWSService.TAG_OWNER in values:
+            self.owner = values[AWSService.TAG_OWNER]
+
+        self.name = values.get('Name')
+
+        # Level if its a supported value, else the default
+        if values.get(AWSService.TAG_LEVEL) in AWSService.SUPPORTED_ALERT_LEVELS:
+            self.level = values[AWSService.TAG_LEVEL]
+
+        self._parse_metrics(values)
+
+    def _parse_metrics(self, values: Dict[str, str]):
+        """Metrics for each level, if a metric is on more than one level the highest level wins"""
+
+        # Each level can have its own set of metrics, dict keeps the tag order
+        level_metrics = {
+            level: dict.fromkeys(TagProfile._split_metrics(values.get(tag_key)))
+            for level, tag_key in TAG_METRICS_BY_LEVEL.items()
+        }
+
+        # Metrics from the plain metrics tag inherit the level from the level tag, or the default
+        level_metrics[self.level].update(dict.fromkeys(TagProfile._split_metrics(values.get(AWSService.TAG_METRICS))))
+
+        # Keep running track of metrics that have been created
+        all_metrics = set()
+
+        # Check each metric level, starting with critical since its highest
+        for level in ['critical', 'high', 'medium', 'low']:
+            # Metrics for the level, minus what has already been tracked
+            self.metrics_by_level[level] = [metric for metric in level_metrics[level] if metric not in all_metrics]
+            all_metrics.update(self.metrics_by_level[level])
+
+        # Check if any metrics were found, can be used to toggle to default metrics
+        self.has_metrics = bool(all_metrics)
+
+    @staticmethod
+    def _split_metrics(value: Optional[str]) -> List[str]:
+        """Tag value will be string like: 'CPUUtilization | StatusCheckFailed_Instance'"""
+
+        if value is None:
+            return []
+
+        # Remove white space and then split, to get nice list
+        return value.replace(' ', '').split('|')
+
 
 class TagsApi():
 
@@ -40,34 +176,102 @@ class TagsApi():
 
         return standard_tags
 
+    @staticmethod
+    def get_tagged_resources(session, resource_types: List[str]) -> Dict[str, List[AWSTaggedResource]]:
+        """
+        Get every resource that opted in to cloudwedge with one tagging api query
+
+            Returns:
+                {
+                    'rds:db': [{'arn': 'arn:aws:rds:us-west-2:ACCOUNTID:db:my-db', 'tags': [AWSTag]}],
+                    'sqs': [{'arn': 'arn:aws:sqs:us-west-2:ACCOUNTID:my-queue', 'tags': [AWSTag]}]
+                }
+        """
+
+        tagged_resources = {resource_type: [] for resource_type in resource_types}
+
+        if not resource_types:
+            return tagged_resources
+
+        paginator = session.client('resourcegroupstaggingapi').get_paginator('get_resources').paginate(
+            TagFilters=[
+                # Filter for only resources that have cloudwedge tag, the key has to match exactly
+                # here, a key with whitespace around it is no longer taken as opting in
+                {'Key': AWSService.TAG_ACTIVE, 'Values': ['true']}
+            ],
+            ResourceTypeFilters=resource_types
+        )
+
+        for page_resources in paginator:
+            for tag_mapping in page_resources['ResourceTagMappingList']:
+                # e.g. arn:aws:states:us-west-2:ACCOUNTID:stateMachine:my-machine > 'states:stateMachine'
+                resource_type = arn_resource_type(arnparse(tag_mapping['ResourceARN']))
+
+                tagged_resources.setdefault(resource_type, []).append(AWSTaggedResource(
+                    arn=tag_mapping['ResourceARN'],
+                    tags=tag_mapping.get('Tags', [])
+                ))
+
+        return tagged_resources
+
+    @staticmethod
+    def get_tagged_resources_by_arns(session, arns: List[str]) -> List[AWSTaggedResource]:
+        """Get tags for specific arns, keeping only the ones that opted in to cloudwedge"""
+
+        tagged_resources = []
+
+        client = session.client('resourcegroupstaggingapi')
+
+        # Arn list cant be combined with tag filters, so the active tag is checked here
+        for i in range(0, len(arns), TAGGING_ARN_BATCH_SIZE):
+            paginator = client.get_paginator('get_resources').paginate(
+                ResourceARNList=arns[i:i + TAGGING_ARN_BATCH_SIZE]
+            )
+
+            for page_resources in paginator:
+                for tag_mapping in page_resources['ResourceTagMappingList']:
+                    tags = tag_mapping.get('Tags', [])
+
+                    if TagProfile(tags).is_active:
+                        tagged_resources.append(AWSTaggedResource(
+                            arn=tag_mapping['ResourceARN'],
+                            tags=tags
+                        ))
+
+        return tagged_resources
+
+    @staticmethod
+    def get_service_tagged_resources(session, service, tagged_resources_by_type=None) -> List[AWSTaggedResource]:
+        """Get tagged resources for the service, querying the tagging api if they were not handed over"""
+
+        if tagged_resources_by_type is None:
+            tagged_resources_by_type = TagsApi.get_tagged_resources(session, service.tagging_resource_types)
+
+        return [
+            tagged_resource
+            for resource_type in service.tagging_resource_types
+            for tagged_resource in tagged_resources_by_type.get(resource_type, [])
+        ]
+
     @staticmethod
     def get_owner_from_tags(tags: List[AWSTag]) -> str:
         """Find owner tag and return its value"""
 
-        owner_tag = TagsApi.get_tag_by_key(tags, AWSService.TAG_OWNER)
-
-        return owner_tag['Value'] if owner_tag else AWSService.DEFAULT_OWNER
+        return TagProfile(tags).owner
 
 
     @staticmethod
     def get_name_from_tags(tags: List[AWSTag]) -> str:
         """Find name tag and return its value"""
 
-        name_tag = TagsApi.get_tag_by_key(tags, 'Name')
-
-        return name_tag['Value'] if name_tag else None
+        return TagProfile(tags).name
 
 
     @staticmethod
     def get_alert_level_from_tags(tags: List[AWSTag]) -> str:
         """Find alert level tag and return its value"""
 
-        found_tag = TagsApi.get_tag_by_key(tags, AWSService.TAG_LEVEL)
-
-        found_level = found_tag['Value'] if found_tag else None
-
-        # Return level if its a supported value, else return default
-        return found_level if found_level in AWSService.SUPPORTED_ALERT_LEVELS else AWSService.DEFAULT_LEVEL
+        return TagProfile(tags).level
 
 
     @staticmethod
@@ -93,54 +297,9 @@ class TagsApi():
     def get_metrics_by_level_from_tags(tags: List[AWSTag]) -> Tuple[bool, Dict[str, List[str]]]:
         """Find metrics from tag and return value for each level"""
 
-        # Get metrics from the tags for specific levels, each level can have its own
-        # set of metrics. If there is overlap, the high level takes precedence
-        level_metrics_sets = {
-            'critical': set(TagsApi.get_metrics_from_tags(tags, AWSService.TAG_METRICS_CRITICAL)),
-            'high': set(TagsApi.get_metrics_from_tags(tags, AWSService.TAG_METRICS_HIGH)),
-            'medium': set(TagsApi.get_metrics_from_tags(tags, AWSService.TAG_METRICS_MEDIUM)),
-            'low': set(TagsApi.get_metrics_from_tags(tags, AWSService.TAG_METRICS_LOW))
-        }
-
-        # In addition to a tag for specific level, there is a tag that can list metrics
-        # and the metrics from that list inherit the level defined either by a tag that
-        # defines the level, or fallback to default level
-        dynamic_alert_level = TagsApi.get_alert_level_from_tags(tags)
-        dynamic_metrics_set = set(
-            TagsApi.get_metrics_from_tags(tags, AWSService.TAG_METRICS))
-        # Add to the level set
-        level_metrics_sets.get(dynamic_alert_level).update(dynamic_metrics_set)
-
-        # Now, the individual levels do dont have duplicates, but now we check for duplicates
-        # across levels, keeping the metric with highest level
-
-        # Setup final return object
-        metrics_by_level = {
-            # We can just add critical, because its highest
-            'critical': list(level_metrics_sets['critical']),
-            'high': None,
-            'medium': None,
-            'low': None
-        }
-
-        # Keep running track of metrics that have been created
-        all_metrics_set = set()
-        # Add critical metrics to tracking
-        all_metrics_set.update(level_metrics_sets['critical'])
-
-        # Check each metric level, starting with high, then medium, then low
-        for level in ['high', 'medium', 'low']:
-            # Get metrics for the level, minus what has already been tracked
-            scrubbed_metrics = level_metrics_sets[level] - all_metrics_set
-            # Add these metrics to tracking
-            all_metrics_set.update(scrubbed_metrics)
-            # Add them in list form to output obj
-            metrics_by_level[level] = list(scrubbed_metrics)
-
-        # Check if any metrics were found, can be used to toggle to default metrics
-        has_metrics = bool(all_metrics_set)
+        tag_profile = TagProfile(tags)
 
-        return has_metrics, metrics_by_level
+        return tag_profile.has_metrics, tag_profile.metrics_by_level
 
 
     @staticmethod
@@ -159,58 +318,14 @@ class TagsApi():
     @staticmethod
     def get_tags_alarm_props(tags: List[AWSTag]):
         """Get alarm props override from the tags"""
-        alarm_props = {}
 
-        for tag in tags:
-
-            # Does the tag have the alarms props prefix
-            if not tag['Key'].find(AWSService.TAG_ALARM_PROP_PREFIX) == -1:
-                # This tag is attempting to override an alarm prop
-
-                # Replace prefix with empty to leave the remain bit of the tag
-                # which is the target prop value
-                target_prop = tag['Key'].replace(AWSService.TAG_ALARM_PROP_PREFIX, '')
-
-                # Is the target prop valid?
-                for supported_prop in AWSService.SUPPORTED_ALARM_PROPS:
-                    if target_prop.lower() == supported_prop.lower():
-                        # This target prop is supported, set it has a default with its value
-                        alarm_props[supported_prop] = tag['Value']
-
-        return alarm_props
+        return dict(TagProfile(tags).alarm_props)
 
     @staticmethod
     def get_tags_metric_props(tags: List[AWSTag], metric: str, supported_metrics: List[str]):
         """Get metric props override from the tags"""
-        metric_props = {}
 
-        for tag in tags:
-            # Does the tag have the metrics props prefix
-            if not tag['Key'].find(AWSService.TAG_ALARM_METRIC_PREFIX) == -1:
-                # This tag is attempting to override a metric prop
-
-                # Get the target metric e.g. Tag['Key']= cloudwedge:alarm:metric:CPUUtilization:prop:Threshold
-                try:
-                    tag_override_metric = re.search(f'{AWSService.TAG_ALARM_METRIC_PREFIX}(.+?):prop:', tag['Key']).group(1)
-                except AttributeError:
-                    tag_override_metric = None
-
-                if tag_override_metric and TagsApi.clean_value(metric) == TagsApi.clean_value(tag_override_metric):
-                    # Is the target metric valid
-                    for supported_metric in supported_metrics:
-                        if TagsApi.clean_value(tag_override_metric) == TagsApi.clean_value(supported_metric):
-                            # Target metric is supported
-
-                            # Now check if the prop its trying to edit is valid
-                            target_prop = tag['Key'].replace(f'{AWSService.TAG_ALARM_METRIC_PREFIX}{tag_override_metric}:prop:', '')
-
-                            # Is the target prop valid?
-                            for supported_prop in AWSService.SUPPORTED_ALARM_PROPS:
-                                if target_prop.lower() == supported_prop.lower():
-                                    # This target prop is supported, set it has a default with its value
-                                    metric_props[supported_prop] = tag['Value']
-
-        return metric_props
+        return TagProfile(tags).get_metric_alarm_props(metric, supported_metrics)
 
     @staticmethod
     def clean_value(value: str):
@@ -0,0 +1,153 @@
+"""
+CoalesceEvents
+
+Tag changes come in bursts, editing a few cloudwedge tags on a resource or
+tagging an autoscaling group fires an event per tag per resource. Starting
+a builder for each of them has the runs fighting over the same stacks.
+
+Events are buffered per spoke account instead, and every event schedules a
+flush after the quiet window. A flush only goes ahead if no event arrived
+after the one that scheduled it, then exactly one builder execution is
+started with the changed arns of every buffered event merged together. An
+account that never goes quiet is still flushed once its oldest event has
+waited BUILDER_MAX_WAIT_SECONDS.
+"""
+
+import json
+import time
+from os import environ
+from typing import Callable, Dict, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from cloudwedge.utils.logger import get_logger
+
+LOGGER = get_logger('CoalesceEvents')
+
+# ARN of the builder step function the merged event is sent to
+STEPFUNCTION_ARN = environ.get('STEPFUNCTION_ARN')
+
+# Seconds an account must go without a new event before the builder is started
+BUILDER_QUIET_WINDOW_SECONDS = int(environ.get('BUILDER_QUIET_WINDOW_SECONDS', '60'))
+# Seconds the oldest buffered event may wait, even if the account never goes quiet
+BUILDER_MAX_WAIT_SECONDS = int(environ.get('BUILDER_MAX_WAIT_SECONDS', '600'))
+
+# Events that name the resources they changed, the builder can rebuild just those
+INCREMENTAL_DETAIL_TYPE = 'Tag Change on Resource'
+
+MICROSECONDS = 1000000
+
+
+def start_builder_execution(name: str, builder_input: Dict):
+    '''Start the builder step function, a flush delivered twice starts it once'''
+
+    client_states = boto3.client('stepfunctions')
+
+    try:
+        client_states.start_execution(stateMachineArn=STEPFUNCTION_ARN, name=name, input=json.dumps(builder_input))
+
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ExecutionAlreadyExists':
+            raise err
+
+        LOGGER.info(f'Builder execution {name} already started')
+
+
+class CoalesceEvents():
+    def __init__(self, event_buffer, flush_queue,
+                 start_builder: Callable[[str, Dict], None] = start_builder_execution,
+                 quiet_window_seconds: int = BUILDER_QUIET_WINDOW_SECONDS,
+                 max_wait_seconds: int = BUILDER_MAX_WAIT_SECONDS):
+
+        # Where the events wait, S3EventBuffer or LocalEventBuffer
+        self.event_buffer = event_buffer
+        # Wakes up the flush after the window, SqsFlushQueue or LocalFlushQueue
+        self.flush_queue = flush_queue
+        # Starts the builder with the merged event
+        self.start_builder = start_builder
+        self.quiet_window_seconds = quiet_window_seconds
+        self.max_wait_seconds = max_wait_seconds
+
+    def add_event(self, event: Dict, received_at: Optional[int] = None) -> str:
+        """Buffer the event and schedule a flush for the account after the quiet window"""
+
+        account = event['account']
+        region = event['region']
+        received_at = received_at or int(time.time() * MICROSECONDS)
+
+        entry_id = self.event_buffer.add(account, region, received_at, event)
+
+        LOGGER.info(f"Buffered {event.get('detail-type')} for {account}/{region}: {entry_id}")
+
+        self.flush_queue.schedule({
+            'account': account,
+            'region': region,
+            'entryId': entry_id
+        }, self.quiet_window_seconds)
+
+        return entry_id
+
+    def flush(self, message: Dict, now: Optional[int] = None) -> Optional[Dict]:
+        """Start the builder for the account if it has gone quiet, returns the builder input"""
+
+        account = message['account']
+        region = message['region']
+        now = now or int(time.time() * MICROSECONDS)
+
+        entries = self.event_buffer.list(account, region)
+
+        if not entries:
+            # An earlier flush already took these events
+            return None
+
+        latest_entry_id = entries[-1][0]
+        waited_seconds = (now - self._get_received_at(entries[0][0])) / MICROSECONDS
+
+        if latest_entry_id > message['entryId'] and waited_seconds < self.max_wait_seconds:
+            # A newer event arrived, the flush it scheduled will pick these up
+            return None
+
+        builder_input = self._merge_events([event for _, event in entries])
+
+        LOGGER.info(f'Flushing {len(entries)} events for {account}/{region} after {round(waited_seconds, 1)}s')
+
+        # Named by the last event, so a flush delivered twice doesnt start a second builder
+        self.start_builder(f'coalesced-{account}-{region}-{latest_entry_id}', builder_input)
+
+        # Only the entries that were read, anything that arrived since waits for its own flush
+        self.event_buffer.delete(account, region, [entry_id for entry_id, _ in entries])
+
+        return builder_input
+
+    @staticmethod
+    def _merge_events(events: List[Dict]) -> Dict:
+        """Merge the buffered events into one builder input"""
+
+        latest = events[-1]
+
+        if all(event.get('detail-type') == INCREMENTAL_DETAIL_TYPE and event.get('resources') for event in events):
+            # Every event named its resources, rebuild just those
+            resources: List[str] = []
+
+            for event in events:
+                resources.extend(arn for arn in event['resources'] if arn not in resources)
+
+            return {
+                **latest,
+                'resources': resources,
+                'coalescedEvents': len(events)
+            }
+
+        # Something in the burst cant be narrowed down (e.g. autoscaling cloudtrail events), sweep it all
+        return {
+            **latest,
+            'mode': 'full',
+            'coalescedEvents': len(events)
+        }
+
+    @staticmethod
+    def _get_received_at(entry_id: str) -> int:
+        """Time the entry was buffered, from its id"""
+
+        return int(entry_id.split('-')[0])
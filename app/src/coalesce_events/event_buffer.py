@@ -0,0 +1,139 @@
+"""
+EventBuffer
+
+Where the coalescer keeps the events waiting for their account's quiet
+window to close, and the queue that wakes it up when the window may have
+closed.
+
+The buffer is append only, every event is its own entry keyed by the time
+it arrived. A flush only deletes the entries it read, so an event that
+lands while a flush is running is kept for the next one.
+
+The local stand-ins keep everything in memory, so the coalescer can be run
+in tests without s3 or sqs.
+"""
+
+import json
+import time
+import uuid
+from os import environ
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+
+from cloudwedge.utils.logger import get_logger
+
+LOGGER = get_logger('EventBuffer')
+
+PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+FLUSH_QUEUE_URL = environ.get('FLUSH_QUEUE_URL')
+
+# SQS cant delay a message longer than 15 minutes
+MAX_DELAY_SECONDS = 900
+
+
+class S3EventBuffer():
+    '''Buffer entries as objects in the private assets bucket'''
+
+    def __init__(self, bucket: str = PRIVATE_ASSETS_BUCKET):
+        self.bucket = bucket
+        self.client_s3 = boto3.client('s3')
+
+    def add(self, account: str, region: str, received_at: int, event: Dict) -> str:
+        '''Add the event to the accounts buffer and return its entry id'''
+
+        entry_id = self._get_entry_id(received_at)
+
+        self.client_s3.put_object(Bucket=self.bucket, Key=f'{self._get_prefix(account, region)}{entry_id}.json',
+                                  Body=json.dumps(event))
+
+        return entry_id
+
+    def list(self, account: str, region: str) -> List[Tuple[str, Dict]]:
+        '''Get the buffered (entry id, event) for the account, oldest first'''
+
+        prefix = self._get_prefix(account, region)
+        entries = []
+
+        paginator = self.client_s3.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                entry_id = item['Key'][len(prefix):-len('.json')]
+                body = self.client_s3.get_object(Bucket=self.bucket, Key=item['Key'])['Body'].read()
+                entries.append((entry_id, json.loads(body)))
+
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def delete(self, account: str, region: str, entry_ids: List[str]):
+        '''Delete the entries from the accounts buffer'''
+
+        prefix = self._get_prefix(account, region)
+
+        for index in range(0, len(entry_ids), 1000):
+            self.client_s3.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': f'{prefix}{entry_id}.json'} for entry_id in entry_ids[index:index + 1000]],
+                'Quiet': True
+            })
+
+    @staticmethod
+    def _get_prefix(account: str, region: str) -> str:
+        return f'event-buffers/{account}/{region}/'
+
+    @staticmethod
+    def _get_entry_id(received_at: int) -> str:
+        # Sorts by arrival time, the suffix keeps events in the same instant apart
+        return f'{received_at:020d}-{uuid.uuid4().hex[:8]}'
+
+
+class LocalEventBuffer():
+    '''Buffer entries in memory, stand in for tests'''
+
+    def __init__(self):
+        self.entries: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+
+    def add(self, account: str, region: str, received_at: int, event: Dict) -> str:
+        entry_id = S3EventBuffer._get_entry_id(received_at)
+        self.entries.setdefault((account, region), {})[entry_id] = event
+        return entry_id
+
+    def list(self, account: str, region: str) -> List[Tuple[str, Dict]]:
+        return sorted(self.entries.get((account, region), {}).items(), key=lambda entry: entry[0])
+
+    def delete(self, account: str, region: str, entry_ids: List[str]):
+        for entry_id in entry_ids:
+            self.entries.get((account, region), {}).pop(entry_id, None)
+
+
+class SqsFlushQueue():
+    '''Wake up the coalescer with a delayed sqs message'''
+
+    def __init__(self, queue_url: str = FLUSH_QUEUE_URL):
+        self.queue_url = queue_url
+        self.client_sqs = boto3.client('sqs')
+
+    def schedule(self, message: Dict, delay_seconds: int):
+        '''Deliver the message back to the coalescer after the delay'''
+
+        self.client_sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message),
+                                     DelaySeconds=min(max(0, delay_seconds), MAX_DELAY_SECONDS))
+
+
+class LocalFlushQueue():
+    '''Keep the delayed messages in memory, stand in for tests'''
+
+    def __init__(self):
+        self.messages: List[Tuple[float, Dict]] = []
+
+    def schedule(self, message: Dict, delay_seconds: int):
+        self.messages.append((time.time() + delay_seconds, message))
+
+    def pop_due(self, now: Optional[float] = None) -> List[Dict]:
+        '''Take the messages whose delay has passed'''
+
+        now = time.time() if now is None else now
+
+        due = [message for deliver_at, message in self.messages if deliver_at <= now]
+        self.messages = [(deliver_at, message) for deliver_at, message in self.messages if deliver_at > now]
+
+        return due
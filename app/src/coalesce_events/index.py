@@ -0,0 +1,34 @@
+"""
+Wrap lambda handler and call main app
+"""
+
+import json
+
+from app import CoalesceEvents
+from event_buffer import S3EventBuffer, SqsFlushQueue
+
+
+def run_app(evt=None, ctx=None):
+    """Parse event and run main app"""
+
+    coalescer = CoalesceEvents(event_buffer=S3EventBuffer(), flush_queue=SqsFlushQueue())
+
+    if 'Records' in evt:
+        # Delayed flush messages from the queue
+        for record in evt['Records']:
+            coalescer.flush(json.loads(record['body']))
+
+        return None
+
+    # Tag change event from the rule
+    coalescer.add_event(evt)
+
+    return None
+
+
+def lambda_handler(event, context):
+    """Lambda handler"""
+    try:
+        return run_app(event, context)
+    except Exception as err:
+        raise err
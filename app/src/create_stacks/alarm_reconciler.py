@@ -0,0 +1,252 @@
+"""
+AlarmReconciler
+
+AlarmReconciler is the direct deploy mode for alarms. Instead of shipping
+an alarms stack and waiting on cloudformation, it reads the alarms that
+already exist in the spoke account and applies only the difference with
+put_metric_alarm and delete_alarms, so a threshold change lands in seconds.
+
+Only the owners being reconciled are touched. Alarms are matched to their
+owner from the Owner= key in the alarm description, the same way alerts
+are routed. The description keeps the owner tag as it was written, owners
+are compared lowercased like the owner stack names.
+
+Writes go through a small worker pool sharing one token bucket, so the
+call latency overlaps while the account stays under the cloudwatch write
+rate. A run stops writing at its deadline and reports what is left as
+pending. The next run diffs again, so it picks up where this one stopped.
+"""
+
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from typing import Any, Dict, List, Optional, Set
+
+from cloudwedge.models import AWSService
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.stacks import STACK_NAME_PREFIX
+
+LOGGER = get_logger('AlarmReconciler')
+
+# put_metric_alarm calls per second, cloudwatch throttles alarm writes hard
+ALARM_RECONCILE_RATE = float(environ.get('ALARM_RECONCILE_RATE', '3'))
+# Alarm writes in flight at the same time, the rate limiter still paces them
+ALARM_RECONCILE_MAX_WORKERS = int(environ.get('ALARM_RECONCILE_MAX_WORKERS', '4'))
+
+# Most alarm names delete_alarms takes in one call
+DELETE_ALARMS_BATCH_SIZE = 100
+
+RE_ALARM_OWNER = re.compile(rf'(?:^| ){AWSService.ALARM_DESCRIPTION_KEY_OWNER}=(\S+)')
+
+# Props that are numbers in the api but may be strings in the templates
+INT_ALARM_PROPS = ['Period', 'EvaluationPeriods']
+FLOAT_ALARM_PROPS = ['Threshold']
+
+# Props compared against the existing alarm, anything else is set by cloudwatch
+COMPARED_ALARM_PROPS = [
+    'AlarmDescription', 'AlarmActions', 'Namespace', 'MetricName', 'Dimensions', 'Statistic',
+    'Period', 'EvaluationPeriods', 'Threshold', 'ComparisonOperator', 'TreatMissingData'
+]
+
+
+class RateLimiter():
+    '''Token bucket, blocks the caller until a call is allowed'''
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        '''Wait for the next slot'''
+
+        with self._lock:
+            now = time.monotonic()
+            wait_seconds = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+class AlarmReconciler():
+    def __init__(self, client_cloudwatch, rate: float = ALARM_RECONCILE_RATE,
+                 max_workers: int = ALARM_RECONCILE_MAX_WORKERS):
+        # Cloudwatch client for the spoke account
+        self.client_cloudwatch = client_cloudwatch
+        # Paces the alarm writes, shared by every worker
+        self.rate_limiter = RateLimiter(rate)
+        # Alarm writes in flight at the same time
+        self.max_workers = max(1, max_workers)
+
+    def run(self, desired_alarms: List[Dict[str, Any]], owners: Optional[List[str]] = None,
+            skip_owners: Optional[List[str]] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Make the alarms of the owners match the desired alarms
+
+            desired_alarms: alarm properties as built by the ResourceAlarmFactory
+            owners: owners to reconcile, None means every owner
+            skip_owners: owners that must not be touched, e.g. their alarms are still in a stack
+            deadline: time.monotonic() to stop writing at, what is left is returned as pending
+
+            Returns:
+                {
+                    "put": 2,
+                    "deleted": 1,
+                    "unchanged": 40,
+                    "pendingPut": 0,
+                    "pendingDelete": 0
+                }
+        """
+
+        skip_owners = {owner.lower() for owner in skip_owners or []}
+
+        desired = {
+            alarm['AlarmName']: self._get_alarm_request(alarm) for alarm in desired_alarms
+            if self._get_alarm_owner(alarm) not in skip_owners
+        }
+
+        existing = self._get_existing_alarms()
+
+        # Alarms that are new, or have drifted from the desired props
+        to_put = [
+            request for alarm_name, request in desired.items()
+            if alarm_name not in existing or not self._is_alarm_equal(request, existing[alarm_name])
+        ]
+
+        # Alarms of the owners being reconciled that are no longer wanted
+        managed_owners: Optional[Set[str]] = {owner.lower() for owner in owners} if owners is not None else None
+
+        to_delete = [
+            alarm_name for alarm_name, alarm in existing.items()
+            if alarm_name not in desired
+            and self._get_alarm_owner(alarm) not in skip_owners
+            and (managed_owners is None or self._get_alarm_owner(alarm) in managed_owners)
+        ]
+
+        LOGGER.info(f'Reconciling alarms, put: {len(to_put)}, delete: {len(to_delete)}, '
+                    f'unchanged: {len(desired) - len(to_put)}')
+
+        put = self._put_alarms(to_put, deadline)
+        deleted = self._delete_alarms(to_delete, deadline)
+
+        if put < len(to_put) or deleted < len(to_delete):
+            LOGGER.info(f'Reconcile deadline reached, pending put: {len(to_put) - put}, '
+                        f'delete: {len(to_delete) - deleted}')
+
+        return {
+            'put': put,
+            'deleted': deleted,
+            'unchanged': len(desired) - len(to_put),
+            'pendingPut': len(to_put) - put,
+            'pendingDelete': len(to_delete) - deleted
+        }
+
+    def _get_existing_alarms(self) -> Dict[str, Dict[str, Any]]:
+        """Get every cloudwedge alarm in the account, keyed by alarm name"""
+
+        existing = {}
+
+        paginator = self.client_cloudwatch.get_paginator('describe_alarms')
+
+        for page in paginator.paginate(AlarmNamePrefix=STACK_NAME_PREFIX, AlarmTypes=['MetricAlarm']):
+            for alarm in page['MetricAlarms']:
+                existing[alarm['AlarmName']] = alarm
+
+        return existing
+
+    def _put_alarms(self, requests: List[Dict[str, Any]], deadline: Optional[float] = None) -> int:
+        """Create or update the alarms on the worker pool, return how many were put before the deadline"""
+
+        if not requests:
+            return 0
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(requests)))
+
+        try:
+            # Raises the first failed put, once every put in flight is done
+            return sum(executor.map(lambda request: self._put_alarm(request, deadline), requests))
+        finally:
+            executor.shutdown(wait=True)
+
+    def _put_alarm(self, request: Dict[str, Any], deadline: Optional[float]) -> bool:
+        """Put one alarm when its slot comes before the deadline"""
+
+        if self._is_past(deadline):
+            return False
+
+        self.rate_limiter.wait()
+
+        if self._is_past(deadline):
+            return False
+
+        LOGGER.info(f"Put alarm: {request['AlarmName']}")
+        self.client_cloudwatch.put_metric_alarm(**request)
+
+        return True
+
+    def _delete_alarms(self, alarm_names: List[str], deadline: Optional[float] = None) -> int:
+        """Delete the alarms in batches, return how many were deleted before the deadline"""
+
+        deleted = 0
+
+        for index in range(0, len(alarm_names), DELETE_ALARMS_BATCH_SIZE):
+            batch = alarm_names[index:index + DELETE_ALARMS_BATCH_SIZE]
+
+            self.rate_limiter.wait()
+
+            if self._is_past(deadline):
+                break
+
+            LOGGER.info(f'Delete alarms: {batch}')
+            self.client_cloudwatch.delete_alarms(AlarmNames=batch)
+
+            deleted += len(batch)
+
+        return deleted
+
+    @staticmethod
+    def _is_past(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    @staticmethod
+    def _get_alarm_request(alarm: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert the template alarm properties to a put_metric_alarm request"""
+
+        request = dict(alarm)
+
+        for prop in INT_ALARM_PROPS:
+            request[prop] = int(request[prop])
+
+        for prop in FLOAT_ALARM_PROPS:
+            request[prop] = float(request[prop])
+
+        return request
+
+    @staticmethod
+    def _is_alarm_equal(request: Dict[str, Any], alarm: Dict[str, Any]) -> bool:
+        """Check the existing alarm already has the requested props"""
+
+        for prop in COMPARED_ALARM_PROPS:
+            requested = request.get(prop)
+            current = alarm.get(prop)
+
+            if prop == 'Dimensions':
+                # Dimension order isnt kept by cloudwatch
+                requested = sorted((d['Name'], d['Value']) for d in requested or [])
+                current = sorted((d['Name'], d['Value']) for d in current or [])
+
+            if requested != current:
+                return False
+
+        return True
+
+    @staticmethod
+    def _get_alarm_owner(alarm: Dict[str, Any]) -> Optional[str]:
+        """Owner of the alarm from its description, lowercased"""
+
+        match = RE_ALARM_OWNER.search(alarm.get('AlarmDescription') or '')
+
+        return match.group(1).lower() if match else None
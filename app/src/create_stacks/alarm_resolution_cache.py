@@ -0,0 +1,110 @@
+"""
+AlarmResolutionCache
+
+Resources in the same autoscaling group or environment usually carry the
+exact same cloudwedge tags, so the levels, metrics and alarm props they
+resolve to are the same too. The cache keeps the resolved alarms keyed by
+(service, cloudwedge tag signature, service discriminators) so each distinct
+configuration is resolved once, and every other resource only has its
+names, dimensions and description stamped on.
+"""
+
+import threading
+from collections import OrderedDict
+from os import environ
+from typing import Any, Callable, Dict, List, Tuple
+
+from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.utils.logger import get_logger
+
+LOGGER = get_logger('AlarmResolutionCache')
+
+# Max number of resolved configurations kept, oldest are dropped first
+ALARM_RESOLUTION_CACHE_SIZE = int(environ.get('ALARM_RESOLUTION_CACHE_SIZE', '10000'))
+
+# Only these tags change how alarms resolve, Name and the rest dont
+CLOUDWEDGE_TAG_MARKER = 'cloudwedge:'
+
+
+class AlarmResolutionCache():
+    def __init__(self, max_size: int = ALARM_RESOLUTION_CACHE_SIZE):
+        self.max_size = max_size
+        # Key > resolved alarms, ordered by last use
+        self._entries: 'OrderedDict[Tuple, List[Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(service: AWSService, resource: AWSResource) -> Tuple:
+        """Cache key for the resource, anything that can change the resolved alarms is part of it"""
+
+        # Tag keys are unique on a resource, so sorting doesnt lose anything
+        tag_signature = tuple(sorted(
+            (tag['Key'], tag['Value']) for tag in (resource.get('tags') or [])
+            if CLOUDWEDGE_TAG_MARKER in tag['Key']
+        ))
+
+        # Resource values the service uses for its default props and validation
+        discriminators = tuple(
+            (resource_key, resource.get(resource_key)) for resource_key in service.alarm_resolution_keys
+        )
+
+        return (service.name, tag_signature, discriminators)
+
+    def get(self, key: Tuple, resolve: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Get the resolved alarms for the key, resolving them on a miss"""
+
+        with self._lock:
+            resolved = self._entries.get(key)
+
+            if resolved is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return resolved
+
+            self.misses += 1
+
+        # Resolve outside the lock, two threads resolving the same key get the same answer
+        resolved = resolve()
+
+        with self._lock:
+            self._entries[key] = resolved
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return resolved
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit rate since the stats were last reset"""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self._entries)
+            }
+
+    def reset_stats(self):
+        """Reset the counters, the resolved alarms are kept"""
+
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def clear(self):
+        """Drop every resolved configuration"""
+
+        with self._lock:
+            self._entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+
+# Shared across the factories, and warm invocations of the container
+ALARM_RESOLUTION_CACHE = AlarmResolutionCache()
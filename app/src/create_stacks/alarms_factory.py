@@ -3,27 +3,58 @@ AlarmsFactory
 
 AlarmsFactory receives a group of resources and builds cloudformation
 alarms stack templates for them.
+
+An owner with more alarms than fit in one stack is split into shard stacks.
+Resources are assigned to a shard by a stable hash of their uniqueId, so
+adding or removing a resource only touches the shard it lands in. The shard
+count doubles when a shard goes over the limits, which splits each shard in
+two instead of reshuffling every resource.
+
+With ALARM_STACK_PARTITION=service each service of the owner gets its own
+alarm stacks, sharded the same way. A tag change on one queue then only
+updates the sqs stack, and one bad alarm only rolls back its own service.
+Partitioned alarm names end with the service, so moving between the modes
+creates new alarms instead of fighting the old stack over the same names.
+
+In the direct deploy mode no stacks are built, get_alarms returns the alarm
+properties for every resource so they can be reconciled with cloudwatch.
 """
-import hashlib
 import json
-import time
 from os import environ
-from typing import Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from alarm_resolution_cache import ALARM_RESOLUTION_CACHE
 from resource_alarm_factory import ResourceAlarmFactory
+from template_store import TemplateStore
 
 from cloudwedge.models import AWSResource
 from cloudwedge.services import ServiceRegistry
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.s3 import s3_save_object
-
-PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+from cloudwedge.utils.metrics import UNIT_BYTES, Metrics
+from cloudwedge.utils.stacks import STACK_TYPE_ALARMS, get_alarms_stack_name, get_shard_index
 
 LOGGER = get_logger('AlarmsFactory')
 
+# CloudFormation allows 500 resources and a 1MB template from s3, keep a little headroom
+ALARM_STACK_MAX_RESOURCES = int(environ.get('ALARM_STACK_MAX_RESOURCES', '450'))
+ALARM_STACK_MAX_BYTES = int(environ.get('ALARM_STACK_MAX_BYTES', '1000000'))
+# Upper bound on the shard count, an owner needing more is a configuration problem
+ALARM_STACK_MAX_SHARDS = int(environ.get('ALARM_STACK_MAX_SHARDS', '64'))
+
+# Alarm stacks per owner, or per service of the owner
+ALARM_STACK_PARTITION_OWNER = 'owner'
+ALARM_STACK_PARTITION_SERVICE = 'service'
+ALARM_STACK_PARTITION = environ.get('ALARM_STACK_PARTITION', ALARM_STACK_PARTITION_OWNER).lower()
+
+# Room left in each shard for the template header
+TEMPLATE_OVERHEAD_BYTES = 1024
+# Room left on each alarm for the shard suffix on its name
+ALARM_NAME_SUFFIX_BYTES = len(f'-{ALARM_STACK_MAX_SHARDS}')
+
 
 class AlarmsFactory():
-    def __init__(self, session, owner, resources: Dict[str, List[AWSResource]]):
+    def __init__(self, session, owner, resources: Dict[str, List[AWSResource]],
+                 deployed_digests: Optional[Dict[str, Optional[str]]] = None, metrics: Optional[Metrics] = None):
         LOGGER.info(f'🚨🏭 AlarmsFactory: {owner}')
 
         # Track the session provided
@@ -32,34 +63,80 @@ class AlarmsFactory():
         self.owner = owner
         # Collection of resources, grouped by service
         self.resources = resources
+        # Template digests tagged on the deployed stacks, keyed by stack name
+        self.deployed_digests = deployed_digests or {}
+        # Upload timings and template sizes go on the runs metrics
+        self.metrics = metrics or Metrics('CreateStacks', enabled=False)
 
-        # Hold the templates that are created
-        self.alarms = {
-            'stackName': f'cloudwedge-autogen-{self.owner}-alarms-stack',
-            's3TemplateKey': None,
-            'template': {
-                "AWSTemplateFormatVersion": "2010-09-09",
-                "Description": f"CloudWedge Alarm Stack for all resources that have owner {self.owner}. This stack is created dynamically by CloudWedge.",
-                "Resources": {}
+        # Hold the templates that are created, one per shard
+        self.stacks: List[Dict] = []
+
+    def get_stacks_details(self) -> List[Dict]:
+        """Return stack details for every shard"""
+
+        stacks_details = []
+
+        for stack in self.stacks:
+            stack_details = {
+                'stackName': stack['stackName'],
+                's3TemplateKey': stack['s3TemplateKey'],
+                'templateDigest': stack['templateDigest'],
+                'unchanged': stack['unchanged'],
+                'stackType': STACK_TYPE_ALARMS,
+                'stackOwner': self.owner
             }
-        }
 
-    def get_stack_details(self):
-        """Return stack details"""
+            if stack['stackService']:
+                # Tagged on the stack, triage orphans it with the owners service
+                stack_details['stackService'] = stack['stackService']
 
-        return {
-            'stackName': self.alarms['stackName'],
-            's3TemplateKey': self.alarms['s3TemplateKey'],
-            'stackType': 'alarms',
-            'stackOwner': self.owner
-        }
+            stacks_details.append(stack_details)
+
+        return stacks_details
 
     def build(self):
-        """Build alarms template for all the resources"""
+        """Build alarms templates for all the resources"""
 
-        # Reset the template
-        self.alarms['template']['Resources'] = {}
-        self.alarms['s3TemplateKey'] = None
+        # Reset the templates
+        self.stacks = []
+
+        # Alarms for each resource, kept apart so they can be placed in a shard
+        resource_templates = self._build_resource_templates()
+
+        LOGGER.info(f'Alarm resolution after {self.owner}: {ALARM_RESOLUTION_CACHE.get_stats()}')
+
+        for service_name, partition_templates in self._get_partitions(resource_templates):
+            # Split the alarms into as many shards as it takes to fit the limits
+            shards = self._get_shards(partition_templates, service_name)
+
+            for shard, shard_templates in enumerate(shards):
+                if not shard_templates and shard:
+                    # Nothing hashed to this shard, dont deploy an empty stack
+                    continue
+
+                stack = self._build_stack(shard, shard_templates, service_name)
+
+                # Save the template to s3
+                self._save_stack(stack)
+
+                self.stacks.append(stack)
+
+        # # LOCAL: write template
+        # self._write_template(self.stacks[0]['template'])
+
+    def get_alarms(self) -> List[Dict[str, Any]]:
+        """Alarm properties for every resource, used by the direct deploy mode instead of stacks"""
+
+        return [
+            alarm['Properties']
+            for _, _, resource_template in self._build_resource_templates()
+            for alarm in resource_template.values()
+        ]
+
+    def _build_resource_templates(self) -> List[Tuple[str, str, Dict]]:
+        """Build the alarms for every resource, paired with the service and the resources uniqueId"""
+
+        resource_templates: List[Tuple[str, str, Dict]] = []
 
         # For each resource in the service group
         for service_name, service_resources in self.resources.items():
@@ -71,31 +148,155 @@ class AlarmsFactory():
                 resource_alarm_factory = ResourceAlarmFactory(resource=resource, service=service)
                 # Build all the alarms for the resource
                 resource_alarms_template = resource_alarm_factory.build()
-                # Add alarms for this resource to the templates Resources section
-                self.alarms['template']['Resources'].update(
-                    resource_alarms_template)
 
-        # Save the template to s3
-        self._save_stack(self.alarms)
+                if resource_alarms_template:
+                    resource_templates.append((service_name, resource['uniqueId'], resource_alarms_template))
 
-        # # LOCAL: write template
-        # self._write_template(self.alarms['template'])
+        return resource_templates
+
+    @staticmethod
+    def _get_partitions(resource_templates: List[Tuple[str, str, Dict]]
+                        ) -> Iterator[Tuple[Optional[str], List[Tuple[str, Dict]]]]:
+        """
+        Group the resource templates into the stacks partitions, keyed by service
+        when partitioned by service and None for the owners one partition
+        """
+
+        if ALARM_STACK_PARTITION != ALARM_STACK_PARTITION_SERVICE:
+            # Owner partition is always built, even without alarms
+            yield None, [(unique_id, resource_template) for _, unique_id, resource_template in resource_templates]
+            return
+
+        partitions: Dict[str, List[Tuple[str, Dict]]] = {}
+
+        for service_name, unique_id, resource_template in resource_templates:
+            partitions.setdefault(service_name, []).append((unique_id, resource_template))
 
+        # Services without alarms get no stack
+        yield from partitions.items()
+
+    def _get_shards(self, resource_templates: List[Tuple[str, Dict]],
+                    service_name: Optional[str] = None) -> List[List[Dict]]:
+        """Assign the resource templates to the smallest power of two shard count that fits"""
+
+        # Room on each alarm name for the suffixes the shard can add
+        suffix_bytes = ALARM_NAME_SUFFIX_BYTES + (len(f'-{service_name}') if service_name else 0)
+
+        shard_count = 1
+
+        while True:
+            shards: List[List[Dict]] = [[] for _ in range(shard_count)]
+
+            for unique_id, resource_template in resource_templates:
+                shards[get_shard_index(unique_id, shard_count)].append(resource_template)
+
+            if all(self._shard_fits(shard_templates, suffix_bytes) for shard_templates in shards):
+                break
+
+            if shard_count * 2 > ALARM_STACK_MAX_SHARDS:
+                # Deploy what we have, cloudformation will report the stack that doesnt fit
+                LOGGER.error(f'Alarms for {self.owner} {service_name or ""} dont fit in '
+                             f'{ALARM_STACK_MAX_SHARDS} shards')
+                break
+
+            shard_count *= 2
+
+        if shard_count > 1:
+            LOGGER.info(f'Split alarms for {self.owner} {service_name or ""} into {shard_count} shards: '
+                        f'{[sum(len(t) for t in shard_templates) for shard_templates in shards]} alarms')
+
+        return shards
+
+    @staticmethod
+    def _shard_fits(shard_templates: List[Dict], suffix_bytes: int = ALARM_NAME_SUFFIX_BYTES) -> bool:
+        """Check the shard is within the cloudformation resource and template size limits"""
+
+        resource_count = sum(len(resource_template) for resource_template in shard_templates)
+
+        if resource_count > ALARM_STACK_MAX_RESOURCES:
+            return False
+
+        template_bytes = TEMPLATE_OVERHEAD_BYTES + resource_count * suffix_bytes + sum(
+            len(json.dumps(resource_template)) for resource_template in shard_templates)
+
+        return template_bytes <= ALARM_STACK_MAX_BYTES
+
+    def _build_stack(self, shard: int, shard_templates: List[Dict], service_name: Optional[str] = None) -> Dict:
+        """Build the stack template for one shard, of the owner or one of its services"""
+
+        stack = {
+            'stackName': get_alarms_stack_name(self.owner, shard, service_name),
+            'stackService': service_name,
+            's3TemplateKey': None,
+            'templateDigest': None,
+            'unchanged': False,
+            'template': {
+                "AWSTemplateFormatVersion": "2010-09-09",
+                "Description": f"CloudWedge Alarm Stack for all resources that have owner {self.owner}. This stack is created dynamically by CloudWedge.",
+                "Resources": {}
+            }
+        }
+
+        if service_name:
+            stack['template']['Description'] = f"{stack['template']['Description']} Service {service_name}."
+
+        if shard:
+            stack['template']['Description'] = f"{stack['template']['Description']} Shard {shard}."
+
+        # Partitioned alarms end with the service, then the shard
+        suffix = ''.join(f'-{part}' for part in [service_name, shard] if part)
+
+        for resource_template in shard_templates:
+            # Add alarms for this resource to the templates Resources section
+            stack['template']['Resources'].update(
+                self._get_shard_alarms(suffix, resource_template))
+
+        return stack
+
+    @staticmethod
+    def _get_shard_alarms(suffix: str, resource_template: Dict) -> Dict:
+        """
+        Suffix the alarm names outside the owners shard 0 with the service and shard.
+        An alarm that moves shards then gets a new name, so the old shard deleting it
+        cant remove the copy the new shard just created.
+        """
+
+        if not suffix:
+            return resource_template
+
+        return {
+            logical_id: {
+                **alarm,
+                'Properties': {
+                    **alarm['Properties'],
+                    'AlarmName': f"{alarm['Properties']['AlarmName']}{suffix}"
+                }
+            }
+            for logical_id, alarm in resource_template.items()
+        }
 
     def _save_stack(self, stack):
-        """Save the stack to s3 and return the key"""
-        # Convert template to string
-        s3_content = json.dumps(stack['template'])
+        """Save the stack to s3 under its digest, unless the deployed stack already has it"""
+        # Digest of the template content
+        digest = TemplateStore.get_digest(stack['template'])
 
-        # Make s3 key for this stack
-        # s3_key = f'templates/{stack["stackName"]}/template.json'
-        s3_key = f'templates/{stack["stackName"]}/{int(time.time())}/template.json'
+        stack['templateDigest'] = digest
+
+        if digest == self.deployed_digests.get(stack['stackName']):
+            # Deployed stack is already running this template, nothing to save or deploy
+            LOGGER.info(f'Template unchanged for {stack["stackName"]}: {digest}')
+            stack['unchanged'] = True
+            return
 
         # Save the template
-        saved_key = s3_save_object(session=self.session, bucket=PRIVATE_ASSETS_BUCKET, key=s3_key,
-                              content=s3_content)
+        with self.metrics.phase('templateUpload', owner=self.owner, stackType=STACK_TYPE_ALARMS):
+            saved_key = TemplateStore.save(session=self.session, stack_name=stack['stackName'],
+                                           template=stack['template'], digest=digest)
+
+        self.metrics.count('TemplateBytes', len(json.dumps(stack['template'])), UNIT_BYTES,
+                           owner=self.owner, stackType=STACK_TYPE_ALARMS)
 
-        self.alarms['s3TemplateKey'] = saved_key
+        stack['s3TemplateKey'] = saved_key
 
     # @staticmethod
     # def _write_template(cf_template):
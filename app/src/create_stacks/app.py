@@ -4,79 +4,434 @@ CreateStacks
 Takes resources and creates a cloudformation template that includes
 cloud watch alarms for each of the resources grouped by the owner.
 Then saves the template to s3.
+
+Templates are content addressed, a stack whose deployed template digest
+matches the new one is left out of the stacks to deploy.
+
+Before that, the input of each stack type is fingerprinted on its own. An
+owners alarm or dashboard stacks whose input matches the fingerprint on the
+deployed primary stack arent built at all, so a threshold tag change only
+builds and deploys the alarms. The primary stack of a type that is built
+is always deployed, to stamp the new fingerprint on it. Alarms partitioned
+by service have no primary stack, they are always built and only the
+services whose template changed are deployed.
+
+Alarm and dashboard shard stacks an owner no longer needs are returned as
+stale stacks, they are deleted once the new shards are deployed.
+
+Resources with the same cloudwedge tags share their resolved alarms, the
+hit rate of that cache is returned as alarmResolution.
+
+Owners are built on a bounded worker pool. The alarm and dashboard builds
+for an owner are separate tasks, so their templates are built and uploaded
+to s3 alongside every other owners. Stacks are returned in owner order no
+matter what order the builds finished in.
+
+Alarms are deployed as stacks by default. In the direct deploy mode no
+alarm stacks are built and only dashboards go through cloudformation. The
+run hands the resources on to the ReconcileAlarms step, which runs after
+the stale stacks are deleted and reconciles the alarms straight with
+cloudwatch. An owner moving off its alarm stack is reconciled in the same
+run its stack is deleted. Owners whose alarm stack is still deployed are
+left alone, so a stack deletion cant remove the alarms the reconciler just
+put. A reconcile that runs out of time returns the work left as pending,
+and the step runs again until none is.
+
+Each owners alarm and dashboard builds, the template uploads and the
+reconcile are timed as phases, with alarms and template bytes per owner,
+and emitted as EMF metrics.
 """
 
 import itertools
-from typing import Dict, List
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import environ
+from typing import Any, Callable, Dict, List, Optional
 
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.sts import get_spoke_session
+from cloudwedge.utils.metrics import Metrics
+from cloudwedge.utils.stacks import (STACK_TYPE_ALARMS, STACK_TYPE_DASHBOARD, get_alarms_stack_name,
+                                     get_dashboard_stack_name, parse_stack_name)
+from cloudwedge.utils.sts import get_spoke_client, get_spoke_session
 
+from alarm_reconciler import AlarmReconciler
+from alarm_resolution_cache import ALARM_RESOLUTION_CACHE
 from alarms_factory import AlarmsFactory
 from dashboard_factory import DashboardFactory
+from stack_fingerprint import StackFingerprint
+from template_store import TemplateStore
 
 LOGGER = get_logger('CreateStacks')
 
-SESSION = None
+# Max number of stack builds (alarms or dashboard for one owner) run at the same time
+CREATE_STACKS_MAX_WORKERS = int(environ.get('CREATE_STACKS_MAX_WORKERS', '8'))
+# Build owners one after the other, handy when debugging a single owner
+CREATE_STACKS_SERIAL = environ.get('CREATE_STACKS_SERIAL', 'false').lower() == 'true'
+
+# How alarms are deployed, as cloudformation stacks or reconciled directly with cloudwatch
+ALARM_DEPLOY_MODE_CLOUDFORMATION = 'cloudformation'
+ALARM_DEPLOY_MODE_DIRECT = 'direct'
+ALARM_DEPLOY_MODE = environ.get('ALARM_DEPLOY_MODE', ALARM_DEPLOY_MODE_CLOUDFORMATION).lower()
+
+# Name of the stack carrying the input fingerprint for each stack type of an owner
+PRIMARY_STACK_NAMES: Dict[str, Callable[[str], str]] = {
+    STACK_TYPE_ALARMS: get_alarms_stack_name,
+    STACK_TYPE_DASHBOARD: get_dashboard_stack_name
+}
 
 
 class CreateStacks():
     def __init__(self, target_account_id):
         self.target_account_id = target_account_id
+        self.session = None
+        # Deployed stacks with their template digest tag, keyed by stack name
+        self.deployed_stacks = {}
+        # Deployed stacks with the fingerprint of the input they were built from, keyed by stack name
+        self.deployed_fingerprints = {}
+        # Alarm properties keyed by owner, built by the direct deploy mode reconcile
+        self.desired_alarms: Dict[str, List[Dict]] = {}
+        # Phase timings and counts for the run
+        self.metrics = Metrics('CreateStacks', account=target_account_id)
 
     def run(self, event=None):
         """Run"""
 
-        global SESSION
+        try:
+            return self._run(event)
+        finally:
+            self.metrics.flush()
+
+    def _run(self, event=None):
+        # Session for this spoke account, pooled across warm invocations
+        self.session = get_spoke_session(self.target_account_id)
+
+        # Digests for every deployed stack in one sweep, instead of a lookup per stack
+        with self.metrics.phase('deployedStacks'):
+            deployed_stacks = TemplateStore.get_deployed_stacks(
+                get_spoke_client(self.target_account_id, 'cloudformation'))
+
+        self.deployed_stacks = {stack_name: tags['digest'] for stack_name, tags in deployed_stacks.items()}
+        self.deployed_fingerprints = {
+            stack_name: tags['inputFingerprint'] for stack_name, tags in deployed_stacks.items()
+        }
 
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
+        # Hit rate is reported per run, resolved alarms stay warm across runs
+        ALARM_RESOLUTION_CACHE.reset_stats()
 
         output = {
             'stacks': [],
+            'unchangedStacks': [],
+            'staleStacks': [],
+            'hasStaleStacks': False,
+            'reconcileAlarms': ALARM_DEPLOY_MODE == ALARM_DEPLOY_MODE_DIRECT,
             'targetAccountId': self.target_account_id
         }
 
         owner_resources = event['ownerResources']
 
+        # Incremental runs name the owners that changed, None means every owner
+        changed_owners = event.get('changedOwners')
+
+        if changed_owners is not None:
+            LOGGER.info(f'Only building stacks for changed owners: {changed_owners}')
+
+        owners_to_build = {
+            owner: resources for owner, resources in owner_resources.items()
+            if changed_owners is None or owner in changed_owners
+        }
+
+        started_at = time.monotonic()
+
         # Build out alarms cloud formation for each owner
-        for owner, owner_resources in owner_resources.items():
-            # Build stacks for owner
-            stacks_details = self._create_stacks(owner, owner_resources)
+        with self.metrics.phase('build'):
+            stacks_details_by_owner = self._build_owners(owners_to_build)
+
+        LOGGER.info(f'Built stacks for {len(owners_to_build)} owners in {round(time.monotonic() - started_at, 2)}s')
+
+        for owner, stacks_details in stacks_details_by_owner.items():
+            for stack_details in stacks_details:
+                if stack_details['unchanged']:
+                    # Already deployed, just track the name
+                    output['unchangedStacks'].append(stack_details['stackName'])
+                else:
+                    # Add stack to list of stacks that were created
+                    output['stacks'].append(stack_details)
+
+            # Shards the owner had before but doesnt need now
+            output['staleStacks'].extend(self._get_stale_stacks(owner, stacks_details))
+
+        output['hasStaleStacks'] = bool(output['staleStacks'])
+
+        if output['reconcileAlarms']:
+            # Alarms go straight to cloudwatch once the stale stacks are gone, ReconcileAlarms builds them
+            output['ownerResources'] = owner_resources
+            output['changedOwners'] = changed_owners
+
+        output['alarmResolution'] = ALARM_RESOLUTION_CACHE.get_stats()
 
-            # Add stack to list of stacks that were created
-            output['stacks'].extend(stacks_details)
+        LOGGER.info(f"Alarm resolution: {output['alarmResolution']}")
+
+        LOGGER.info(f"Stacks to deploy: {len(output['stacks'])}, unchanged: {len(output['unchangedStacks'])}, "
+                    f"stale: {len(output['staleStacks'])}")
+
+        self.metrics.count('StacksToDeploy', len(output['stacks']), phase='build')
+        self.metrics.count('UnchangedStacks', len(output['unchangedStacks']), phase='build')
+        self.metrics.count('StaleStacks', len(output['staleStacks']), phase='build')
 
         return output
 
+    def _build_owners(self, owners_to_build: Dict[str, Dict]) -> Dict[str, List[Dict[str, str]]]:
+        """Build the stacks for every owner, keyed by owner in the order given"""
+
+        if CREATE_STACKS_SERIAL or CREATE_STACKS_MAX_WORKERS == 1:
+            return {
+                owner: self._create_stacks(owner, resources) for owner, resources in owners_to_build.items()
+            }
+
+        executor = ThreadPoolExecutor(max_workers=CREATE_STACKS_MAX_WORKERS)
+
+        try:
+            # Alarms and dashboard for each owner are separate tasks, so they run side by side
+            futures: Dict[str, List[Future]] = {
+                owner: [
+                    executor.submit(build, owner, resources)
+                    for build in self._get_stack_builders()
+                ]
+                for owner, resources in owners_to_build.items()
+            }
+
+            # Raises the first failed build, failing the run just like a serial build
+            return {
+                owner: list(itertools.chain.from_iterable(future.result() for future in owner_futures))
+                for owner, owner_futures in futures.items()
+            }
+
+        finally:
+            executor.shutdown(wait=True)
+
+    def _get_stack_builders(self) -> List[Callable[[str, Dict], List[Dict[str, str]]]]:
+        """Builders for each stack type of an owner, in the order their stacks are returned"""
+
+        return [
+            self._create_alarms_stacks,
+            self._create_dashboard_stacks
+        ]
+
     def _create_stacks(self, owner_name: str, owner_resources) -> List[Dict[str, str]]:
         """
         Create stack based on owner name
         Include every service and its resources
         """
 
+        return list(itertools.chain.from_iterable(
+            build(owner_name, owner_resources) for build in self._get_stack_builders()
+        ))
+
+    def _create_alarms_stacks(self, owner_name: str, owner_resources) -> List[Dict[str, str]]:
+        """Create the alarm stacks for the owner"""
+
         stacks = []
 
+        if ALARM_DEPLOY_MODE == ALARM_DEPLOY_MODE_DIRECT:
+            # No alarm stacks, ReconcileAlarms builds the alarms after the stale stacks are deleted
+            return stacks
+
+        fingerprint = StackFingerprint.get_alarms_fingerprint(owner_resources)
+
+        unchanged_stacks = self._get_unchanged_stacks(owner_name, STACK_TYPE_ALARMS, fingerprint)
+
+        if unchanged_stacks is not None:
+            return unchanged_stacks
+
         # Setup stack factory for this owners set of resources
-        alarms = AlarmsFactory(SESSION, owner_name, owner_resources)
-        # Build the alarms template
-        alarms.build()
+        alarms = AlarmsFactory(self.session, owner_name, owner_resources,
+                               deployed_digests=self._get_deployed_digests(owner_name, STACK_TYPE_ALARMS),
+                               metrics=self.metrics)
+
+        # Build the alarms templates, one per shard
+        with self.metrics.phase('alarmsBuild', owner=owner_name):
+            alarms.build()
+
+        self.metrics.count('Alarms', sum(len(stack['template']['Resources']) for stack in alarms.stacks),
+                           phase='alarmsBuild', owner=owner_name)
         # Get details on what was created for tracking
-        alarm_stack_details = alarms.get_stack_details()
-        # Add account id to details
-        alarm_stack_details['targetAccountId'] = self.target_account_id
-        stacks.append(alarm_stack_details)
-        LOGGER.info(f"Alarm Stack: {alarm_stack_details}")
+        for alarm_stack_details in alarms.get_stacks_details():
+            # Add account id and the input it was built from to details
+            alarm_stack_details['targetAccountId'] = self.target_account_id
+            alarm_stack_details['inputFingerprint'] = fingerprint
+            stacks.append(alarm_stack_details)
+            LOGGER.info(f"Alarm Stack: {alarm_stack_details}")
+
+        return stacks
+
+    def _create_dashboard_stacks(self, owner_name: str, owner_resources) -> List[Dict[str, str]]:
+        """Create the dashboard stacks for the owner"""
+
+        stacks = []
+
+        fingerprint = StackFingerprint.get_dashboard_fingerprint(owner_resources)
+
+        unchanged_stacks = self._get_unchanged_stacks(owner_name, STACK_TYPE_DASHBOARD, fingerprint)
+
+        if unchanged_stacks is not None:
+            return unchanged_stacks
 
         # Setup stack factory for this owners set of resources
-        dashboard = DashboardFactory(SESSION, owner_name, owner_resources)
-        # Build the dashboard template
-        dashboard.build()
+        dashboard = DashboardFactory(self.session, owner_name, owner_resources,
+                                     deployed_digests=self._get_deployed_digests(owner_name, STACK_TYPE_DASHBOARD),
+                                     metrics=self.metrics)
+        # Build the dashboard templates, one per dashboard
+        with self.metrics.phase('dashboardBuild', owner=owner_name):
+            dashboard.build()
         # Get details on what was created for tracking
-        dashboard_stack_details = dashboard.get_stack_details()
-        # Add account id to details
-        dashboard_stack_details['targetAccountId'] = self.target_account_id
-        stacks.append(dashboard_stack_details)
-        LOGGER.info(f"Dashboard Stack: {dashboard_stack_details}")
+        for dashboard_stack_details in dashboard.get_stacks_details():
+            # Add account id and the input it was built from to details
+            dashboard_stack_details['targetAccountId'] = self.target_account_id
+            dashboard_stack_details['inputFingerprint'] = fingerprint
+            stacks.append(dashboard_stack_details)
+            LOGGER.info(f"Dashboard Stack: {dashboard_stack_details}")
 
         return stacks
+
+    def _get_unchanged_stacks(self, owner_name: str, stack_type: str, fingerprint: str) -> Optional[List[Dict]]:
+        """
+        Details of the owners deployed stacks of the type when they were built from
+        the same input, None when they need building
+        """
+
+        if self.deployed_fingerprints.get(PRIMARY_STACK_NAMES[stack_type](owner_name)) != fingerprint:
+            return None
+
+        stack_names = [
+            stack_name for stack_name, stack in zip(self.deployed_stacks, map(parse_stack_name, self.deployed_stacks))
+            if stack and stack['owner'] == owner_name and stack['type'] == stack_type and not stack['service']
+        ]
+
+        if any(self.deployed_stacks[stack_name] is None for stack_name in stack_names):
+            # A shard is still deploying or failed to, build so it is deployed again
+            return None
+
+        LOGGER.info(f'Input unchanged for {owner_name} {stack_type} stacks: {fingerprint}')
+
+        self.metrics.count('UnchangedInputStacks', len(stack_names), phase='build', owner=owner_name,
+                           stackType=stack_type)
+
+        return [
+            {
+                'stackName': stack_name,
+                's3TemplateKey': None,
+                'templateDigest': self.deployed_stacks[stack_name],
+                'unchanged': True,
+                'stackType': stack_type,
+                'stackOwner': owner_name,
+                'targetAccountId': self.target_account_id,
+                'inputFingerprint': fingerprint
+            }
+            for stack_name in stack_names
+        ]
+
+    def _get_deployed_digests(self, owner_name: str, stack_type: str) -> Dict[str, Optional[str]]:
+        """
+        Deployed digests for a stack type being built. The primary stack is deployed
+        even if its template is unchanged, so it carries the new input fingerprint.
+        """
+
+        return {**self.deployed_stacks, PRIMARY_STACK_NAMES[stack_type](owner_name): None}
+
+    def reconcile(self, event=None, deadline: Optional[float] = None):
+        """Reconcile the alarms of the direct deploy mode, stopping at the deadline"""
+
+        try:
+            return self._reconcile(event, deadline)
+        finally:
+            self.metrics.flush()
+
+    def _reconcile(self, event=None, deadline: Optional[float] = None):
+        # Session for this spoke account, pooled across warm invocations
+        self.session = get_spoke_session(self.target_account_id)
+
+        # Listed again, the stale alarm stacks were deleted since the stacks were built
+        with self.metrics.phase('deployedStacks'):
+            deployed_stacks = TemplateStore.get_deployed_stacks(
+                get_spoke_client(self.target_account_id, 'cloudformation'))
+
+        self.deployed_stacks = {stack_name: tags['digest'] for stack_name, tags in deployed_stacks.items()}
+
+        ALARM_RESOLUTION_CACHE.reset_stats()
+
+        changed_owners = event.get('changedOwners')
+
+        for owner_name, owner_resources in event['ownerResources'].items():
+            if changed_owners is not None and owner_name not in changed_owners:
+                continue
+
+            alarms = AlarmsFactory(self.session, owner_name, owner_resources, metrics=self.metrics)
+
+            with self.metrics.phase('alarmsBuild', owner=owner_name):
+                self.desired_alarms[owner_name] = alarms.get_alarms()
+
+            self.metrics.count('Alarms', len(self.desired_alarms[owner_name]), phase='alarmsBuild', owner=owner_name)
+
+        with self.metrics.phase('reconcile'):
+            output = self._reconcile_alarms(changed_owners, deadline)
+
+        # Pending work runs again in the next pass, it diffs what is left
+        output['hasPending'] = bool(output['pendingPut'] or output['pendingDelete'])
+        output['passes'] = (event.get('alarmReconcile') or {}).get('passes', 0) + 1
+        output['alarmResolution'] = ALARM_RESOLUTION_CACHE.get_stats()
+
+        self.metrics.count('AlarmsPut', output['put'], phase='reconcile')
+        self.metrics.count('AlarmsDeleted', output['deleted'], phase='reconcile')
+        self.metrics.count('AlarmsPending', output['pendingPut'] + output['pendingDelete'], phase='reconcile')
+
+        LOGGER.info(f'Alarm reconcile: {output}')
+
+        return output
+
+    def _reconcile_alarms(self, changed_owners: Optional[List[str]], deadline: Optional[float] = None
+                          ) -> Dict[str, Any]:
+        """Reconcile the built alarms with the alarms in cloudwatch"""
+
+        # Owners still on an alarm stack, their alarms are the stacks until it is deleted
+        skip_owners = sorted({
+            stack['owner'] for stack in map(parse_stack_name, self.deployed_stacks)
+            if stack and stack['type'] == STACK_TYPE_ALARMS
+        })
+
+        if skip_owners:
+            LOGGER.info(f'Not reconciling alarms for owners with alarm stacks: {skip_owners}')
+
+        reconciler = AlarmReconciler(get_spoke_client(self.target_account_id, 'cloudwatch'))
+
+        result = reconciler.run(
+            desired_alarms=list(itertools.chain.from_iterable(self.desired_alarms.values())),
+            owners=changed_owners,
+            skip_owners=skip_owners,
+            deadline=deadline
+        )
+
+        result['skippedOwners'] = skip_owners
+
+        return result
+
+    def _get_stale_stacks(self, owner_name: str, stacks_details: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Get deployed shards for the owner that werent built this time"""
+
+        built_stack_names = {stack_details['stackName'] for stack_details in stacks_details}
+
+        stale_stacks = []
+
+        for stack_name in self.deployed_stacks:
+            stack = parse_stack_name(stack_name)
+
+            if not stack or stack['owner'] != owner_name:
+                continue
+
+            if stack_name not in built_stack_names:
+                LOGGER.info(f'Stale {stack["type"]} shard: {stack_name}')
+                stale_stacks.append({
+                    'stackOwner': owner_name,
+                    'stackName': stack_name
+                })
+
+        return stale_stacks
@@ -3,32 +3,42 @@ DashboardFactory
 
 DashboardFactory receives a group of resources and builds a cloudformation
 dashboard stack template with them.
+
+An owner with more widgets than fit in one dashboard is split into numbered
+dashboards, each in its own stack with its own front matter and links to the
+others. Resources are assigned to a dashboard by a stable hash of their
+uniqueId, the same way alarm stacks are sharded, so the dashboards a change
+doesnt touch keep the same template and are skipped on deploy.
 """
-import hashlib
 import json
-import time
 from os import environ
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-from resource_alarm_factory import ResourceAlarmFactory
+from template_store import TemplateStore
 
 from cloudwedge.models import AWSResource, AWSService
 from cloudwedge.services import ServiceRegistry
-from cloudwedge.utils.helpers import get_local_time
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.s3 import s3_save_object
+from cloudwedge.utils.metrics import UNIT_BYTES, Metrics
+from cloudwedge.utils.stacks import STACK_TYPE_DASHBOARD, get_dashboard_stack_name, get_shard_index
 
-PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
 PUBLIC_ASSETS_BUCKET = environ.get('PUBLIC_ASSETS_BUCKET')
 
 ENVIRONMENT = environ.get('ENVIRONMENT')
 REGION = environ.get('REGION')
 
+# CloudWatch allows 500 widgets per dashboard, cloudformation a 1MB template from s3
+DASHBOARD_MAX_WIDGETS = int(environ.get('DASHBOARD_MAX_WIDGETS', '500'))
+DASHBOARD_MAX_BYTES = int(environ.get('DASHBOARD_MAX_BYTES', '1000000'))
+# Upper bound on the number of dashboards for an owner
+DASHBOARD_MAX_SHARDS = int(environ.get('DASHBOARD_MAX_SHARDS', '16'))
+
 LOGGER = get_logger("DashboardFactory")
 
 
 class DashboardFactory():
-    def __init__(self, session, owner, resources: Dict[str, List[AWSResource]]):
+    def __init__(self, session, owner, resources: Dict[str, List[AWSResource]],
+                 deployed_digests: Optional[Dict[str, Optional[str]]] = None, metrics: Optional[Metrics] = None):
         LOGGER.info(f"📊🏭 DashboardFactory: {owner}")
 
         self.session = session
@@ -36,13 +46,98 @@ class DashboardFactory():
         self.owner = owner
         # Collection of resources, grouped by service
         self.resources = resources
+        # Template digests tagged on the deployed stacks, keyed by stack name
+        self.deployed_digests = deployed_digests or {}
+        # Upload timings and template sizes go on the runs metrics
+        self.metrics = metrics or Metrics('CreateStacks', enabled=False)
+
+        # Hold the templates that are created, one per dashboard
+        self.stacks: List[Dict] = []
+
+    def get_stacks_details(self) -> List[Dict]:
+        """Return stack details for every dashboard"""
+
+        return [
+            {
+                'stackName': stack['stackName'],
+                's3TemplateKey': stack['s3TemplateKey'],
+                'templateDigest': stack['templateDigest'],
+                'unchanged': stack['unchanged'],
+                'stackType': STACK_TYPE_DASHBOARD,
+                'stackOwner': self.owner
+            }
+            for stack in self.stacks
+        ]
+
+    def get_dashboard_name(self, shard: int = 0) -> str:
+        """Name of the owners dashboard, the first one keeps the unnumbered name"""
+
+        if shard:
+            return f"cloudwedge-autogen-dashboard-{self.owner}-{shard}"
+
+        return f"cloudwedge-autogen-dashboard-{self.owner}"
+
+    def build(self):
+        """Build dashboard templates for all the resources"""
+
+        # Reset the templates
+        self.stacks = []
+
+        shard_count = 1
+
+        while True:
+            shards = self._get_shards(shard_count)
+
+            # Dashboards with resources, plus the first one that is always kept
+            dashboard_shards = [shard for shard, shard_resources in enumerate(shards) if shard == 0 or shard_resources]
+
+            # Build the dashboards, measuring them as they go
+            stacks = [
+                self._build_stack(shard, shards[shard], dashboard_shards) for shard in dashboard_shards
+            ]
+
+            if all(stack['fits'] for stack in stacks):
+                break
+
+            if shard_count * 2 > DASHBOARD_MAX_SHARDS:
+                # Deploy what we have, cloudformation will report the dashboard that doesnt fit
+                LOGGER.error(f'Dashboard for {self.owner} doesnt fit in {DASHBOARD_MAX_SHARDS} dashboards')
+                break
+
+            shard_count *= 2
+
+        if len(stacks) > 1:
+            LOGGER.info(f'Split dashboard for {self.owner} into {len(stacks)} dashboards: '
+                        f'{[stack["widgetCount"] for stack in stacks]} widgets')
+
+        for stack in stacks:
+            # Save the template to s3
+            self._save_stack(stack)
+
+            self.stacks.append(stack)
+
+    def _get_shards(self, shard_count: int) -> List[Dict[str, List[AWSResource]]]:
+        """Assign the resources to the dashboards, keeping the service order"""
 
-        self.dashboard_name = f"cloudwedge-autogen-dashboard-{self.owner}"
+        shards: List[Dict[str, List[AWSResource]]] = [{} for _ in range(shard_count)]
 
-        # Hold the templates that are created
-        self.dashboard = {
-            'stackName': f"cloudwedge-autogen-{self.owner}-dashboard-stack",
+        for service_name, service_resources in self.resources.items():
+            # Sort so the widgets dont move around when discovery returns resources in another order
+            for resource in sorted(service_resources, key=lambda r: (r['name'], r['uniqueId'])):
+                shard = get_shard_index(resource['uniqueId'], shard_count)
+                shards[shard].setdefault(service_name, []).append(resource)
+
+        return shards
+
+    def _build_stack(self, shard: int, shard_resources: Dict[str, List[AWSResource]],
+                     dashboard_shards: List[int]) -> Dict:
+        """Build the stack template for one dashboard and measure it against the limits"""
+
+        stack = {
+            'stackName': get_dashboard_stack_name(self.owner, shard),
             's3TemplateKey': None,
+            'templateDigest': None,
+            'unchanged': False,
             'template': {
                 'AWSTemplateFormatVersion': "2010-09-09",
                 'Description': f"CloudWedge Dashboard Stack for all resources that have owner {self.owner}. This stack is created dynamically by CloudWedge.",
@@ -50,32 +145,15 @@ class DashboardFactory():
             }
         }
 
-    def get_stack_details(self):
-        """Return stack details"""
-
-        return {
-            'stackName': self.dashboard['stackName'],
-            's3TemplateKey': self.dashboard['s3TemplateKey'],
-            'stackType': 'dashboard',
-            'stackOwner': self.owner
-        }
-
-    def build(self):
-        """Build dashboard template for all the resources"""
-
-        # Reset the template
-        self.dashboard['template']['Resources'] = {}
-        self.dashboard['s3TemplateKey'] = None
-
         # Collect dashboard widgets
         widgets = []
 
         # Build widgets for the front matter to the dashboard
-        widgets_front_matter = self._build_frontmatter()
+        widgets_front_matter = self._build_frontmatter(shard, dashboard_shards)
         widgets.extend(widgets_front_matter)
 
         # Build widgets for each resource in the service group
-        for service_name, service_resources in self.resources.items():
+        for service_name, service_resources in shard_resources.items():
             # Get the service class from the registry
             service = ServiceRegistry.get_service(service_name)
 
@@ -95,19 +173,26 @@ class DashboardFactory():
         })
 
         # Build the template resources using the string body
-        template_resources = self._build_template_resources(dashboard_body)
+        template_resources = self._build_template_resources(self.get_dashboard_name(shard), dashboard_body)
 
         # Set the resources on the cloudformation template
-        self.dashboard['template']['Resources'].update(template_resources)
+        stack['template']['Resources'].update(template_resources)
+
+        # Measure the dashboard, the body is escaped inside the template so measure the template
+        stack['widgetCount'] = len(widgets)
+        stack['fits'] = (
+            len(widgets) <= DASHBOARD_MAX_WIDGETS and
+            len(json.dumps(stack['template'])) <= DASHBOARD_MAX_BYTES
+        )
 
-        # Save the template to s3
-        self._save_stack(self.dashboard)
+        return stack
 
-    def _build_frontmatter(self):
+    def _build_frontmatter(self, shard: int = 0, dashboard_shards: Optional[List[int]] = None):
         '''Build out the dashboard frontmatter for the instances'''
 
+        dashboard_shards = dashboard_shards or [shard]
+
         stack_link = f'https://{REGION}.console.aws.amazon.com/cloudformation/home?region={REGION}#/stacks?filteringText=cloudwedge-autogen-{self.owner}'
-        date_created = get_local_time().strftime('%b %d %I:%M %p')
 
         # Text widget for naming dashboard
         widgets = [
@@ -130,7 +215,7 @@ class DashboardFactory():
                 'properties': {
                     'markdown': (
                         f"[button: View {self.owner.capitalize()}'s CloudWedge Stacks ↗️]({stack_link}) | [button: View CloudWedge Documentation ↗️](http://cloudwedge.1strategy.com)\n"
-                        f"#### ⏱ Dashboard was auto generated by CloudWedge at {date_created} \n"
+                        f"#### ⏱ Dashboard is auto generated by CloudWedge, see the stacks for when it last changed\n"
                         f"#### 🏷 Resources are included based on tag configuration"
                     )
                 }
@@ -158,6 +243,29 @@ class DashboardFactory():
             }
         ]
 
+        if len(dashboard_shards) > 1:
+            # Link every dashboard for the owner, the one being viewed isnt a link
+            dashboard_links = [
+                f'**{position}**' if dashboard_shard == shard else
+                f'[{position}](https://{REGION}.console.aws.amazon.com/cloudwatch/home?region={REGION}#dashboards:name={self.get_dashboard_name(dashboard_shard)})'
+                for position, dashboard_shard in enumerate(dashboard_shards, start=1)
+            ]
+
+            widgets[-1]['properties']['markdown'] = (
+                f'## ⭐️ {self.owner.capitalize()} ({dashboard_shards.index(shard) + 1} of {len(dashboard_shards)})'
+            )
+
+            widgets.append({
+                'type': 'text',
+                'x': 0,
+                'y': 5,
+                'width': 24,
+                'height': 1,
+                'properties': {
+                    'markdown': f'#### 📑 Dashboards: {" | ".join(dashboard_links)}'
+                }
+            })
+
         return widgets
 
     def _build_backmatter(self):
@@ -191,14 +299,14 @@ class DashboardFactory():
 
         return widgets
 
-    def _build_template_resources(self, dashboard_body: str):
+    def _build_template_resources(self, dashboard_name: str, dashboard_body: str):
         """Build the cloudformation template resources section"""
 
         resources = {
             'CloudWedgeDashboard': {
                 'Type': 'AWS::CloudWatch::Dashboard',
                         'Properties': {
-                            'DashboardName': self.dashboard_name,
+                            'DashboardName': dashboard_name,
                             'DashboardBody': dashboard_body
                         }
             }
@@ -207,15 +315,24 @@ class DashboardFactory():
         return resources
 
     def _save_stack(self, stack):
-        """Save the stack to s3 and return the key"""
-        # Convert template to string
-        s3_content = json.dumps(stack['template'])
+        """Save the stack to s3 under its digest, unless the deployed stack already has it"""
+        # Digest of the template content
+        digest = TemplateStore.get_digest(stack['template'])
+
+        stack['templateDigest'] = digest
 
-        # Make s3 key for this stack
-        s3_key = f'templates/{stack["stackName"]}/{int(time.time())}/template.json'
+        if digest == self.deployed_digests.get(stack['stackName']):
+            # Deployed stack is already running this template, nothing to save or deploy
+            LOGGER.info(f'Template unchanged for {stack["stackName"]}: {digest}')
+            stack['unchanged'] = True
+            return
 
         # Save the template
-        saved_key = s3_save_object(session=self.session, bucket=PRIVATE_ASSETS_BUCKET, key=s3_key,
-                                   content=s3_content)
+        with self.metrics.phase('templateUpload', owner=self.owner, stackType=STACK_TYPE_DASHBOARD):
+            saved_key = TemplateStore.save(session=self.session, stack_name=stack['stackName'],
+                                           template=stack['template'], digest=digest)
+
+        self.metrics.count('TemplateBytes', len(json.dumps(stack['template'])), UNIT_BYTES,
+                           owner=self.owner, stackType=STACK_TYPE_DASHBOARD)
 
-        self.dashboard['s3TemplateKey'] = saved_key
+        stack['s3TemplateKey'] = saved_key
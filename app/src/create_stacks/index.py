@@ -2,18 +2,61 @@
 Wrap lambda handler and call main app
 """
 
+import time
+
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+from cloudwedge.utils.claim_check import check_in, check_out
+from cloudwedge.utils.sts import get_spoke_session
+
 from app import CreateStacks
 
+# Time kept back from the lambda timeout for the alarm writes in flight and the metrics
+RECONCILE_DEADLINE_MARGIN_SECONDS = 15
+
 
 def run_app(evt=None, ctx=None):
     """Parse event and run main app"""
 
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
     # Get target account from event
     target_account_id = evt['targetAccountId']
 
+    # Resolve any fields passed by reference
+    evt = check_out(get_spoke_session(target_account_id), evt)
+
     resources = CreateStacks(target_account_id).run(event=evt)
 
-    return resources
+    # Resources handed on to ReconcileAlarms in the direct deploy mode
+    resources = check_in(get_spoke_session(target_account_id), target_account_id, resources,
+                         fields=['ownerResources'])
+
+    return API_CALL_RECORDER.add_totals(resources, 'CreateStacks')
+
+
+def run_reconcile(evt=None, ctx=None):
+    """Parse event and reconcile the alarms"""
+
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
+    # Get target account from event
+    target_account_id = evt['targetAccountId']
+
+    # Resolve any fields passed by reference
+    evt = check_out(get_spoke_session(target_account_id), evt)
+
+    # Stop writing before the lambda times out, the rest is left pending for the next pass
+    deadline = None
+
+    if ctx is not None:
+        deadline = time.monotonic() + ctx.get_remaining_time_in_millis() / 1000 - RECONCILE_DEADLINE_MARGIN_SECONDS
+
+    result = CreateStacks(target_account_id).reconcile(event=evt, deadline=deadline)
+
+    return API_CALL_RECORDER.add_totals(result, 'ReconcileAlarms')
+
 
 def lambda_handler(event, context):
     """Lambda handler"""
@@ -21,3 +64,11 @@ def lambda_handler(event, context):
         return run_app(event, context)
     except Exception as err:
         raise err
+
+
+def reconcile_handler(event, context):
+    """Lambda handler for the ReconcileAlarms step"""
+    try:
+        return run_reconcile(event, context)
+    except Exception as err:
+        raise err
@@ -5,17 +5,26 @@ ResourceAlarmFactory receives a resource and builds a cloudformation
 stack templates for it based on its service configuration. Depending
 on the tags on the resource, the resource may have an alarm created
 for multiple metrics.
+
+Levels, metrics and alarm props are resolved once per distinct tag
+configuration through the AlarmResolutionCache, the per resource work is
+stamping the names, dimensions and description on the resolved alarms.
 """
 
 import hashlib
-from typing import Dict, List
+from typing import Any, Dict, List
+
+from alarm_resolution_cache import ALARM_RESOLUTION_CACHE
 
 from cloudwedge.models import AWSResource, AWSService
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.tags import TagsApi
+from cloudwedge.utils.tags import TagProfile
 
 LOGGER = get_logger("ResourceAlarmFactory")
 
+# Supported metric keys indexed by cleaned value, keyed by service name
+SUPPORTED_METRIC_KEYS: Dict[str, Dict[str, List[str]]] = {}
+
 
 class ResourceAlarmFactory():
     def __init__(self, resource: AWSResource, service: AWSService):
@@ -27,6 +36,8 @@ class ResourceAlarmFactory():
         # Set up variables
         self.resource = resource
         self.service = service
+        # Tags parsed once when the alarms are resolved, every metric reads from the profile
+        self.tag_profile = None
         # Template will have a json object for each metric alarm
         self.all_resource_alarms_template = {}
 
@@ -36,6 +47,29 @@ class ResourceAlarmFactory():
     def build(self):
         """Build alarm json object for every metric"""
 
+        # Levels, metrics and props for the alarms, shared by resources with the same tags
+        resolved_alarms = ALARM_RESOLUTION_CACHE.get(
+            ALARM_RESOLUTION_CACHE.get_key(self.service, self.resource), self._resolve_alarms)
+
+        for resolved_alarm in resolved_alarms:
+            # Build the metric template for this single metric
+            single_alarm_template = self._build_alarm(
+                level=resolved_alarm['level'], metric=resolved_alarm['metric'],
+                dynamic_alarm_props=resolved_alarm['props'])
+
+            # Add the metric to the coll
+            self.all_resource_alarms_template.update(
+                single_alarm_template)
+
+        return self.all_resource_alarms_template
+
+    def _resolve_alarms(self) -> List[Dict[str, Any]]:
+        """Resolve the level, metric and alarm props of every alarm the resource gets"""
+
+        self.tag_profile = TagProfile(self.resource['tags'])
+
+        resolved_alarms = []
+
         # Get metrics by level for this resource
         resource_metrics_by_level = self._get_metrics_by_level()
 
@@ -46,28 +80,34 @@ class ResourceAlarmFactory():
 
             # For each metric in the level
             for metric in level_metrics:
-                metric_supported = False
-                # TODO: maybe think about this more, the trick is to do a caseinsensitve dict key
-                # lookup
-                # First question to check is if this metric is supported by the service
-                for supported_metric_key in self.service.supported_metrics.keys():
-                    # Get the key that matches, but cleaning value to allow some variation in matching
-                    if self._clean_value(supported_metric_key) == self._clean_value(metric):
-                        # We support this metric, build an alarm
-                        metric_supported = True
-
-                        # Build the metric template for this single metric
-                        single_alarm_template = self._build_alarm(
-                            level=alert_level, metric=metric, supported_metric_key=supported_metric_key)
-
-                        # Add the metric to the coll
-                        self.all_resource_alarms_template.update(
-                            single_alarm_template)
-
-                # if not metric_supported:
-                #     LOGGER.info(f'Metric {metric} not supported for {self.service.name}')
+                # First question to check is if this metric is supported by the service, the keys
+                # are matched on the cleaned value to allow some variation in matching
+                for supported_metric_key in self._get_supported_metric_keys(self.service).get(self._clean_value(metric), []):
+                    LOGGER.info(f"🔧 >> Resolving {alert_level}:{metric}")
 
-        return self.all_resource_alarms_template
+                    # We support this metric, resolve its props
+                    resolved_alarms.append({
+                        'level': alert_level,
+                        'metric': metric,
+                        'props': self._get_dynamic_alarm_props(metric, supported_metric_key)
+                    })
+
+        return resolved_alarms
+
+    @staticmethod
+    def _get_supported_metric_keys(service: AWSService) -> Dict[str, List[str]]:
+        """Supported metric keys for the service indexed by their cleaned value, built once per service"""
+
+        if service.name not in SUPPORTED_METRIC_KEYS:
+            supported_metric_keys: Dict[str, List[str]] = {}
+
+            for supported_metric_key in service.supported_metrics.keys():
+                supported_metric_keys.setdefault(
+                    ResourceAlarmFactory._clean_value(supported_metric_key), []).append(supported_metric_key)
+
+            SUPPORTED_METRIC_KEYS[service.name] = supported_metric_keys
+
+        return SUPPORTED_METRIC_KEYS[service.name]
 
     @staticmethod
     def _hash_for_identifier(identifier):
@@ -81,17 +121,13 @@ class ResourceAlarmFactory():
 
     def _get_metrics_by_level(self) -> Dict[str, List[str]]:
         """Get metrics for each alert level"""
-        has_metrics, metrics_by_level = TagsApi.get_metrics_by_level_from_tags(
-            self.resource['tags'])
-
-        if has_metrics:
-            return metrics_by_level
+        if self.tag_profile.has_metrics:
+            return self.tag_profile.metrics_by_level
         else:
             # Metrics were not defined on the tags, fallback to default metrics for the service
             default_metrics = self.service.default_metrics
             # Grab the alert value from the tags
-            alert_level = TagsApi.get_alert_level_from_tags(
-                self.resource['tags'])
+            alert_level = self.tag_profile.level
 
             # Return defaults, keyed by the alert level
             return {
@@ -100,8 +136,6 @@ class ResourceAlarmFactory():
 
     def _get_resource_alarm_props(self, metric: str) -> Dict[str, str]:
         """Get any alarm prop overrides from the resource tags for the resource and for the given metric"""
-        resource_alarm_props = {}
-
         clean_metric_name = self._clean_value(metric)
 
         # Get props based on resource details
@@ -109,13 +143,12 @@ class ResourceAlarmFactory():
             self.resource)
 
         # Get props based on tag prop overrides
-        alarm_props_by_tag_root = TagsApi.get_tags_alarm_props(
-            self.resource['tags'])
+        alarm_props_by_tag_root = self.tag_profile.alarm_props
 
         # Get props based on tag metric prop overrides
         supported_metrics = self.service.supported_metrics.keys()
-        alarm_props_by_tag_metric = TagsApi.get_tags_metric_props(
-            self.resource['tags'], clean_metric_name, supported_metrics)
+        alarm_props_by_tag_metric = self.tag_profile.get_metric_alarm_props(
+            clean_metric_name, supported_metrics)
 
         return {
             **alarm_props_by_resource,
@@ -123,30 +156,12 @@ class ResourceAlarmFactory():
             **alarm_props_by_tag_metric
         }
 
-    def _build_alarm(self, level: str, metric: str, supported_metric_key: str):
-        """Build alarm template for metric"""
-        LOGGER.info(f"🔧 >> Building {level}:{metric}")
+    def _get_dynamic_alarm_props(self, metric: str, supported_metric_key: str) -> Dict[str, Any]:
+        """Layer the alarm props from the defaults up to the tag overrides, and validate them"""
 
-        # Make Unique resource name for the template resource
-        clean_metric_name = self._clean_value(metric)
-        clean_resource_id = self._clean_value(self.resource['uniqueId'])
-        unique_resource_name = f"{self._hash_for_identifier(self.resource['uniqueId'])}CloudWedge{clean_metric_name}"
-        # Get alarm level
-        alert_level = level
-        # Make alarm name, using unique name
-        alarm_name = f"cloudwedge-autogen-{self.service.name}-{self.resource['owner']}-{alert_level}-{clean_metric_name}-{clean_resource_id}"
-        # Make alarm description, Key=Value format is parsed when notifications are sent
-        # Space at end of each line is important
-        alarm_description = (
-            f"{AWSService.ALARM_DESCRIPTION_KEY_RESOURCE}={self.resource['name']} "
-            f"{AWSService.ALARM_DESCRIPTION_KEY_METRIC}={metric} "
-            f"{AWSService.ALARM_DESCRIPTION_KEY_LEVEL}={alert_level} "
-            f"{AWSService.ALARM_DESCRIPTION_KEY_TYPE}={self.service.cloudwatch_namespace} "
-            f"{AWSService.ALARM_DESCRIPTION_KEY_OWNER}={self.resource['owner']} "
-        )
-
-        # Set alarm notification destination
-        alarm_actions = [AWSService.ALARM_TARGET_SNS]
+        # Set alarm notification destination, state change events reach ingest without one
+        alarm_actions = [] if AWSService.ALARM_INGEST_MODE == AWSService.ALARM_INGEST_MODE_EVENTS \
+            else [AWSService.ALARM_TARGET_SNS]
 
         # Universal default alarm props (this gives all the props needed for a complete alarm)
         dynamic_alarm_props = {
@@ -177,6 +192,32 @@ class ResourceAlarmFactory():
             **self._get_resource_alarm_props(metric)
         }
 
+        # Validate properties
+        dynamic_alarm_props['Period'] = self.service.validate_prop_period(dynamic_alarm_props['Period'], self.resource)
+
+        return dynamic_alarm_props
+
+    def _build_alarm(self, level: str, metric: str, dynamic_alarm_props: Dict[str, Any]):
+        """Build alarm template for metric, stamping the resource on the resolved props"""
+
+        # Make Unique resource name for the template resource
+        clean_metric_name = self._clean_value(metric)
+        clean_resource_id = self._clean_value(self.resource['uniqueId'])
+        unique_resource_name = f"{self._hash_for_identifier(self.resource['uniqueId'])}CloudWedge{clean_metric_name}"
+        # Get alarm level
+        alert_level = level
+        # Make alarm name, using unique name
+        alarm_name = f"cloudwedge-autogen-{self.service.name}-{self.resource['owner']}-{alert_level}-{clean_metric_name}-{clean_resource_id}"
+        # Make alarm description, Key=Value format is parsed when notifications are sent
+        # Space at end of each line is important
+        alarm_description = (
+            f"{AWSService.ALARM_DESCRIPTION_KEY_RESOURCE}={self.resource['name']} "
+            f"{AWSService.ALARM_DESCRIPTION_KEY_METRIC}={metric} "
+            f"{AWSService.ALARM_DESCRIPTION_KEY_LEVEL}={alert_level} "
+            f"{AWSService.ALARM_DESCRIPTION_KEY_TYPE}={self.service.cloudwatch_namespace} "
+            f"{AWSService.ALARM_DESCRIPTION_KEY_OWNER}={self.resource['owner']} "
+        )
+
         # Build json cloudformation for alarm
         alarm_props = {
             'AlarmName': alarm_name,
@@ -189,20 +230,16 @@ class ResourceAlarmFactory():
                     'Value': self.resource['cloudwatchDimensionId']
                 }
             ],
-            # Values below here can be manipulated with tags and defaults
-            **dynamic_alarm_props
-        }
-
-        # Validate properties
-        validated_alarm_props = {
-            **alarm_props,
-            'Period': self.service.validate_prop_period(alarm_props['Period'], self.resource)
+            # Values below here can be manipulated with tags and defaults, copied so
+            # the resolved props shared with other resources are never changed
+            **dynamic_alarm_props,
+            'AlarmActions': list(dynamic_alarm_props['AlarmActions'])
         }
 
         metric_template = {
             unique_resource_name: {
                 "Type": "AWS::CloudWatch::Alarm",
-                "Properties": validated_alarm_props
+                "Properties": alarm_props
             }
         }
 
@@ -0,0 +1,121 @@
+"""
+StackFingerprint
+
+StackFingerprint digests what an owners stacks are built from, separately
+for each stack type. The fingerprint is stamped on the deployed stacks as a
+tag, so a stack type whose input hasnt changed isnt built again at all.
+
+Alarms are built from every detail of the resources, the tags most of all.
+Dashboards only show which resources there are, so a threshold or level
+tag change leaves the dashboard fingerprint as it was.
+
+Both also cover the config the templates are built with and
+TEMPLATE_SCHEMA_VERSION, bumped by hand when the template output changes,
+so only a deploy that changes the templates rebuilds every stack.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List
+
+from alarms_factory import (ALARM_STACK_MAX_BYTES, ALARM_STACK_MAX_RESOURCES, ALARM_STACK_MAX_SHARDS,
+                            ALARM_STACK_PARTITION)
+from dashboard_factory import (DASHBOARD_MAX_BYTES, DASHBOARD_MAX_SHARDS, DASHBOARD_MAX_WIDGETS, ENVIRONMENT,
+                               PUBLIC_ASSETS_BUCKET, REGION)
+
+from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.services import ServiceRegistry
+
+# Bump when a change to the builder or the services changes the templates built
+# from the same input, every stack is rebuilt once on the next run. Changes
+# that leave the templates as they were (logging, metrics, handlers) dont.
+TEMPLATE_SCHEMA_VERSION = 1
+
+# Config the alarm templates are built with
+ALARMS_CONFIG = {
+    'alarmTarget': AWSService.ALARM_TARGET_SNS,
+    'alarmIngestMode': AWSService.ALARM_INGEST_MODE,
+    'maxResources': ALARM_STACK_MAX_RESOURCES,
+    'maxBytes': ALARM_STACK_MAX_BYTES,
+    'maxShards': ALARM_STACK_MAX_SHARDS,
+    'partition': ALARM_STACK_PARTITION
+}
+
+# Config the dashboard templates are built with
+DASHBOARD_CONFIG = {
+    'region': REGION,
+    'environment': ENVIRONMENT,
+    'publicAssetsBucket': PUBLIC_ASSETS_BUCKET,
+    'userTarget': AWSService.USER_TARGET_SNS,
+    'maxWidgets': DASHBOARD_MAX_WIDGETS,
+    'maxBytes': DASHBOARD_MAX_BYTES,
+    'maxShards': DASHBOARD_MAX_SHARDS
+}
+
+
+class StackFingerprint():
+
+    @staticmethod
+    def get_alarms_fingerprint(owner_resources: Dict[str, List[AWSResource]]) -> str:
+        """Fingerprint of the alarm stacks input, every detail of every resource"""
+
+        canonical = {}
+
+        for service_name, resources in owner_resources.items():
+            if not resources:
+                continue
+
+            # Order of resources and tags doesnt matter
+            canonical[service_name] = sorted(
+                (
+                    {
+                        **resource,
+                        'tags': sorted(resource.get('tags') or [], key=lambda tag: (tag['Key'], tag['Value']))
+                    }
+                    for resource in resources
+                ),
+                key=lambda resource: (resource['uniqueId'], resource['cloudwatchDimensionId'])
+            )
+
+        return StackFingerprint._get_digest({'resources': canonical, 'config': ALARMS_CONFIG})
+
+    @staticmethod
+    def get_dashboard_fingerprint(owner_resources: Dict[str, List[AWSResource]]) -> str:
+        """
+        Fingerprint of the dashboard stacks input, which resources there are
+        and the metrics graphed for each service. Tags dont change dashboards.
+        """
+
+        canonical = {}
+
+        for service_name, resources in owner_resources.items():
+            if not resources:
+                continue
+
+            service = ServiceRegistry.get_service(service_name)
+
+            canonical[service_name] = {
+                'metrics': service.default_metrics,
+                # uniqueId picks the dashboard shard the resource is on
+                'resources': sorted(
+                    (
+                        [
+                            resource['uniqueId'],
+                            resource['name'],
+                            resource['cloudwatchDimensionId'],
+                            *(resource.get(key) for key in service.dashboard_resource_keys)
+                        ]
+                        for resource in resources
+                    ),
+                    # Names can be missing
+                    key=lambda item: json.dumps(item, default=str)
+                )
+            }
+
+        return StackFingerprint._get_digest({'resources': canonical, 'config': DASHBOARD_CONFIG})
+
+    @staticmethod
+    def _get_digest(content: Dict[str, Any]) -> str:
+        canonical = json.dumps({**content, 'schema': TEMPLATE_SCHEMA_VERSION}, sort_keys=True, separators=(',', ':'), default=str)
+
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
@@ -0,0 +1,97 @@
+"""
+TemplateStore
+
+TemplateStore keeps the stack templates in the private assets bucket keyed
+by a digest of their content. The digest is also stamped on the deployed
+stack as a tag, so a template that hasnt changed since the last deploy can
+be skipped before anything is written or deployed. The fingerprint of the
+input the template was built from is read off the same stacks.
+"""
+
+import hashlib
+import json
+from os import environ
+from typing import Dict, Optional
+
+from cloudwedge.models import AWSService
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.s3 import s3_save_object
+from cloudwedge.utils.stacks import STACK_NAME_PREFIX
+
+PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+
+LOGGER = get_logger('TemplateStore')
+
+# Only trust the digest tag on stacks that finished deploying it, a failed or
+# rolled back update can leave the stack on an older template
+DEPLOYED_STACK_STATUSES = [
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE'
+]
+
+
+class TemplateStore():
+
+    @staticmethod
+    def get_digest(template: Dict) -> str:
+        """Digest of the templates canonical json, key order doesnt matter"""
+
+        canonical = json.dumps(template, sort_keys=True, separators=(',', ':'))
+
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_key(stack_name: str, digest: str) -> str:
+        """S3 key for the template, the same content always lands on the same key"""
+
+        return f'templates/{stack_name}/{digest}/template.json'
+
+    @staticmethod
+    def save(session, stack_name: str, template: Dict, digest: Optional[str] = None) -> str:
+        """Save the template to s3 under its digest and return the key"""
+
+        digest = digest or TemplateStore.get_digest(template)
+
+        return s3_save_object(session=session, bucket=PRIVATE_ASSETS_BUCKET,
+                              key=TemplateStore.get_key(stack_name, digest),
+                              content=json.dumps(template))
+
+    @staticmethod
+    def get_deployed_stacks(client_formation) -> Dict[str, Dict[str, Optional[str]]]:
+        """
+        Get every deployed cloudwedge stack with its template digest and input fingerprint tags
+        in one sweep, both are None when the stack isnt known to be running them
+
+            Returns:
+                {
+                    "cloudwedge-autogen-owner-alarms-stack": {"digest": "digest", "inputFingerprint": "fingerprint"},
+                    "cloudwedge-autogen-owner-alarms-1-stack": {"digest": None, "inputFingerprint": None},
+                }
+        """
+
+        deployed_stacks = {}
+
+        try:
+            paginator = client_formation.get_paginator('describe_stacks')
+
+            for page in paginator.paginate():
+                for stack in page['Stacks']:
+                    if not stack['StackName'].startswith(STACK_NAME_PREFIX):
+                        continue
+
+                    tags = {}
+
+                    if stack['StackStatus'] in DEPLOYED_STACK_STATUSES:
+                        tags = {tag['Key']: tag['Value'] for tag in stack.get('Tags', [])}
+
+                    deployed_stacks[stack['StackName']] = {
+                        'digest': tags.get(AWSService.TAG_STACK_DIGEST_KEY),
+                        'inputFingerprint': tags.get(AWSService.TAG_STACK_INPUT_FINGERPRINT_KEY)
+                    }
+
+        except Exception as err:
+            # Without digests every stack is saved and deployed, same as before
+            LOGGER.info(f'Failed to get deployed stacks with error: {err}')
+            return {}
+
+        return deployed_stacks
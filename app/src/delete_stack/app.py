@@ -6,16 +6,11 @@ Deletes a cloudformation stack by its name
 
 from botocore.exceptions import WaiterError
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.sts import get_spoke_session
+from cloudwedge.utils.sts import get_spoke_client
 
 LOGGER = get_logger('DeleteStack')
 
 
-# Setup boto3 session
-SESSION = None
-CLIENT_FORMATION = None
-
-
 class DeleteStack():
     def __init__(self, target_account_id=None, event=None):
 
@@ -23,18 +18,13 @@ class DeleteStack():
         # Pull values off event
         self.stack_owner = event['stack']['stackOwner']
         self.stack_name = event['stack']['stackName']
+        self.client_formation = None
 
     def run(self):
         """Run"""
 
-        global SESSION
-        global CLIENT_FORMATION
-
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
-
-        if not CLIENT_FORMATION:
-            CLIENT_FORMATION = SESSION.client('cloudformation')
+        # Client for this spoke account, pooled across warm invocations
+        self.client_formation = get_spoke_client(self.target_account_id, 'cloudformation')
 
         # Delete the stack, catch response to know
         stack_deleted = self._delete_stack()
@@ -54,11 +44,11 @@ class DeleteStack():
 
         try:
             LOGGER.info(f'Attempting to delete stack: {self.stack_name}')
-            response = CLIENT_FORMATION.delete_stack(StackName=self.stack_name)
+            response = self.client_formation.delete_stack(StackName=self.stack_name)
 
             # Wait just a little, it could have been a speedy delivery
             try:
-                res = CLIENT_FORMATION.get_waiter('stack_delete_complete').wait(
+                res = self.client_formation.get_waiter('stack_delete_complete').wait(
                     StackName=self.stack_name,
                     WaiterConfig={
                         'Delay': 1,
@@ -3,6 +3,9 @@ DeployStack
 
 Deploys the stack using the template referenced by
 the s3 key input.
+
+The create or update call is timed as the updateStack phase, by owner and
+stack type, and emitted as EMF metrics.
 """
 
 import itertools
@@ -10,7 +13,8 @@ from os import environ
 from typing import Dict, List
 
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.sts import get_spoke_session
+from cloudwedge.utils.metrics import Metrics
+from cloudwedge.utils.sts import get_spoke_client
 
 from stack_shipper import StackShipper
 
@@ -18,9 +22,6 @@ PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
 
 LOGGER = get_logger('DeployStack')
 
-# Setup boto3 session
-SESSION = None
-
 
 class DeployStack():
     def __init__(self, target_account_id=None, event=None):
@@ -31,27 +32,35 @@ class DeployStack():
         self.s3_template_key = event['s3TemplateKey']
         self.stack_type = event['stackType']
         self.stack_owner = event['stackOwner']
+        self.template_digest = event.get('templateDigest')
+        self.input_fingerprint = event.get('inputFingerprint')
+        self.stack_service = event.get('stackService')
+        # Phase timings for the run
+        self.metrics = Metrics('DeployStack', account=target_account_id)
 
     def run(self):
         """Run"""
 
-        global SESSION
-
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
-
         output = {
             'inProgress': True,
             'stackName': self.stack_name,
             'waitAttempts': 0
         }
 
-        StackShipper(
-                     session=SESSION,
-                     s3_bucket=PRIVATE_ASSETS_BUCKET,
-                     s3_key=self.s3_template_key,
-                     stack_type=self.stack_type,
-                     stack_owner=self.stack_owner,
-                     stack_name=self.stack_name).ship()
+        try:
+            # Nothing to wait on when cloudformation had no updates to perform
+            with self.metrics.phase('updateStack', owner=self.stack_owner, stackType=self.stack_type):
+                output['inProgress'] = StackShipper(
+                             client_formation=get_spoke_client(self.target_account_id, 'cloudformation'),
+                             s3_bucket=PRIVATE_ASSETS_BUCKET,
+                             s3_key=self.s3_template_key,
+                             stack_type=self.stack_type,
+                             stack_owner=self.stack_owner,
+                             stack_name=self.stack_name,
+                             template_digest=self.template_digest,
+                             input_fingerprint=self.input_fingerprint,
+                             stack_service=self.stack_service).ship()
+        finally:
+            self.metrics.flush()
 
         return output
@@ -2,18 +2,24 @@
 Wrap lambda handler and call main app
 """
 
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+
 from app import DeployStack
 
 
 def run_app(evt=None, ctx=None):
     """Parse event and run main app"""
 
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
     # Get target account from event
     target_account_id = evt['targetAccountId']
 
     resources = DeployStack(target_account_id=target_account_id, event=evt).run()
 
-    return resources
+    # Run per stack in a Map, every output is kept in the state so only the count goes on it
+    return API_CALL_RECORDER.add_totals(resources, 'DeployStack', operations=False)
 
 def lambda_handler(event, context):
     """Lambda handler"""
@@ -5,33 +5,32 @@ StackShipper receives details about a templates location in s3
 and uses cloudformation api to deploy the stack
 """
 
+from typing import Optional
+
 from botocore.exceptions import ClientError
 from cloudwedge.models import AWSService
 from cloudwedge.utils.logger import get_logger
 
 LOGGER = get_logger('StackShipper')
 
-# Holder for boto3 client
-CLIENT_FORMATION = None
 
 class StackShipper():
-    def __init__(self, session, s3_bucket: str, s3_key: str, stack_name: str, stack_type: str,
-                 stack_owner: str):
+    def __init__(self, client_formation, s3_bucket: str, s3_key: str, stack_name: str, stack_type: str,
+                 stack_owner: str, template_digest: Optional[str] = None, input_fingerprint: Optional[str] = None,
+                 stack_service: Optional[str] = None):
         # Place the inputs on self
-        self.session = session
+        self.client_formation = client_formation
         self.bucket = s3_bucket
         self.template_key = s3_key
         self.stack_name = stack_name
         self.stack_type = stack_type
         self.stack_owner = stack_owner
+        self.template_digest = template_digest
+        self.input_fingerprint = input_fingerprint
+        self.stack_service = stack_service
 
-    def ship(self):
-        """Receive template and deploy"""
-
-        global CLIENT_FORMATION
-
-        if not CLIENT_FORMATION:
-            CLIENT_FORMATION = self.session.client('cloudformation')
+    def ship(self) -> bool:
+        """Receive template and deploy, return True if a stack change is in progress"""
 
         LOGGER.info(
             f"StackShipper: bucket={self.bucket} key={self.template_key} stack={self.stack_name}")
@@ -40,11 +39,13 @@ class StackShipper():
             # Try to run update stack first
             self._post_stack('update_stack')
             LOGGER.info(f'Updated Stack: {self.stack_name}')
+            return True
 
         except ClientError as err:
             # 1) No updates, we can be done
             if 'No updates are to be performed' in err.response['Error']['Message']:
                 LOGGER.info(f'No updates are to to be performed.')
+                return False
 
             # 2) Stack doesnt exit, run create
             elif 'does not exist' in err.response['Error']['Message']:
@@ -53,6 +54,7 @@ class StackShipper():
                 try:
                     self._post_stack('create_stack')
                     LOGGER.info(f'Created Stack: {self.stack_name}')
+                    return True
                 except ClientError as err:
                     LOGGER.error(f'Failed to create Stack: {err}')
                     raise err
@@ -63,6 +65,7 @@ class StackShipper():
                 # When an RDS tag is edited, it deletes the tag first which fires an event. Then it updates, another event :)
                 LOGGER.info(
                     f'Stack update is in progress, allowing that stack to proceed. Aborting error free.')
+                return True
 
             # 4) Something else, the sky is falling
             else:
@@ -78,28 +81,51 @@ class StackShipper():
 
         LOGGER.info(f"Running {api_name} for {self.stack_name}")
 
+        tags = [
+            {
+                'Key': AWSService.TAG_STACK_ID_KEY,
+                'Value': AWSService.TAG_STACK_ID_VALUE
+            },
+            {
+                'Key': AWSService.TAG_OWNER,
+                'Value': self.stack_owner
+            },
+            {
+                'Key': AWSService.TAG_STACK_TYPE_KEY,
+                'Value': self.stack_type
+            }
+        ]
+
+        if self.stack_service:
+            # Alarm stacks partitioned by service, triage orphans them with the owners service
+            tags.append({
+                'Key': AWSService.TAG_STACK_SERVICE_KEY,
+                'Value': self.stack_service
+            })
+
+        if self.template_digest:
+            # Lets the next build skip this stack when the template hasnt changed
+            tags.append({
+                'Key': AWSService.TAG_STACK_DIGEST_KEY,
+                'Value': self.template_digest
+            })
+
+        if self.input_fingerprint:
+            # Lets the next build skip building this stack type when its input hasnt changed
+            tags.append({
+                'Key': AWSService.TAG_STACK_INPUT_FINGERPRINT_KEY,
+                'Value': self.input_fingerprint
+            })
+
         try:
             # Get api method from cloudformation boto3 client and run it
-            getattr(CLIENT_FORMATION, api_name)(
+            getattr(self.client_formation, api_name)(
                 StackName=self.stack_name,
                 TemplateURL=f"https://s3.amazonaws.com/{self.bucket}/{self.template_key}",
                 Capabilities=[
                     "CAPABILITY_IAM",
                 ],
-                Tags=[
-                    {
-                        'Key': AWSService.TAG_STACK_ID_KEY,
-                        'Value': AWSService.TAG_STACK_ID_VALUE
-                    },
-                    {
-                        'Key': AWSService.TAG_OWNER,
-                        'Value': self.stack_owner
-                    },
-                    {
-                        'Key': AWSService.TAG_STACK_TYPE_KEY,
-                        'Value': self.stack_type
-                    }
-                ]
+                Tags=tags
             )
 
         except Exception as err:
@@ -2,47 +2,139 @@
 GetResources
 
 Get a list of resources for the supported services based on tags criteria
+
+A tag change event for a single resource is handled incrementally, only that
+resource is rediscovered and merged into the last known snapshot. Scheduled
+reconciles, and anything that cant be narrowed down, run a full sweep.
+
+When the output is too large for the step function state, ownerResources
+and the event are checked in to s3 and passed as pointers.
+
+Discovery, snapshot and check in are timed as phases, with the resources
+found per service and per owner, and emitted as EMF metrics.
 """
 
 import itertools
-from typing import Dict, List
+from os import environ
+from typing import Dict, List, Optional
 
 from cloudwedge.models import AWSResource
 from cloudwedge.services import ServiceRegistry
+from cloudwedge.utils.claim_check import check_in
 from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.metrics import UNIT_MILLISECONDS, Metrics
 from cloudwedge.utils.sts import get_spoke_session
 
+from discovery_engine import DiscoveryEngine
+from incremental_discovery import IncrementalDiscovery
+from resource_snapshot import ResourceSnapshot
+
 LOGGER = get_logger('GetResources')
 
-SESSION = None
+# Allow tag change events to rebuild incrementally
+INCREMENTAL_DISCOVERY = environ.get('INCREMENTAL_DISCOVERY', 'true').lower() == 'true'
+
+DISCOVERY_MODE_FULL = 'full'
+DISCOVERY_MODE_INCREMENTAL = 'incremental'
+
 
 class GetResources():
     def __init__(self, target_account_id):
         self.is_empty = True
         self.target_account_id = target_account_id
+        self.session = None
+        # Phase timings and counts for the run
+        self.metrics = Metrics('GetResources', account=target_account_id)
 
     def run(self, event=None):
         """Run"""
 
-        global SESSION
-
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
-
-        # Get all resources for all services
-        resources = self._get_resources()
+        try:
+            return self._run(event)
+        finally:
+            self.metrics.flush()
+
+    def _run(self, event=None):
+        # Session for this spoke account, pooled across warm invocations
+        self.session = get_spoke_session(self.target_account_id)
+
+        discovery_mode = self._get_discovery_mode(event)
+        snapshot = None
+        # Owners to rebuild, None means every owner
+        changed_owners = None
+
+        if discovery_mode == DISCOVERY_MODE_INCREMENTAL:
+            with self.metrics.phase('snapshotLoad'):
+                snapshot = ResourceSnapshot.load(self.session, self.target_account_id)
+
+            if snapshot is None:
+                LOGGER.info('No resource snapshot for the account, falling back to a full sweep')
+                discovery_mode = DISCOVERY_MODE_FULL
+
+        with self.metrics.phase('discovery', mode=discovery_mode):
+            if discovery_mode == DISCOVERY_MODE_INCREMENTAL:
+                # Rediscover just the resources on the event
+                resources = self._get_resources_incremental(snapshot, event['resources'])
+            else:
+                # Get all resources for all services
+                resources = self._get_resources()
 
         # Organize resources by owner
         resources_by_owner = self._organize_by_owner(resources)
 
+        for service_name, service_resources in resources.items():
+            self.metrics.count('Resources', len(service_resources), phase='discovery', service=service_name)
+
+        for owner, owner_resources in resources_by_owner.items():
+            self.metrics.count('OwnerResources', sum(len(service_resources) for service_resources in
+                                                     owner_resources.values()), phase='discovery', owner=owner)
+
+        if discovery_mode == DISCOVERY_MODE_INCREMENTAL:
+            changed_owners = ResourceSnapshot.get_changed_owners(
+                self._organize_by_owner(snapshot), resources_by_owner)
+            LOGGER.info(f'Owners changed by the event: {changed_owners}')
+
+        # Keep the latest view of the account for the next incremental run
+        with self.metrics.phase('snapshotSave'):
+            ResourceSnapshot.save(self.session, self.target_account_id, resources)
+
         output = {
             "event": event,
             "targetAccountId": self.target_account_id,
             "ownerResources": resources_by_owner,
-            "isEmpty": self.is_empty
+            "isEmpty": self.is_empty,
+            "discoveryMode": discovery_mode,
+            "changedOwners": changed_owners
         }
 
-        return output
+        # Large accounts go over the step function state limit, pass the big fields by reference
+        with self.metrics.phase('checkIn'):
+            return check_in(self.session, self.target_account_id, output, fields=['ownerResources', 'event'])
+
+    @staticmethod
+    def _get_discovery_mode(event: Optional[Dict]) -> str:
+        """Incremental for tag change events that name resources, full for anything else"""
+
+        event = event or {}
+
+        if not INCREMENTAL_DISCOVERY or event.get('mode') == DISCOVERY_MODE_FULL:
+            return DISCOVERY_MODE_FULL
+
+        # Scheduled reconciles and cloudtrail events (autoscaling tags) dont name a resource arn
+        if event.get('detail-type') == 'Tag Change on Resource' and event.get('resources'):
+            return DISCOVERY_MODE_INCREMENTAL
+
+        return DISCOVERY_MODE_FULL
+
+    def _get_resources_incremental(self, snapshot: Dict[str, List[AWSResource]], arns: List[str]):
+        # Merge the rediscovered resources into the snapshot
+        resources = IncrementalDiscovery(
+            session=self.session, services=ServiceRegistry.supported, snapshot=snapshot).run(arns)
+
+        # If we get any resources for any service, toggle is_empty
+        self.is_empty = not any(resources.values())
+
+        return resources
 
     def _get_resources(self):
         # Read the resources for each service and collect together
@@ -51,15 +143,17 @@ class GetResources():
         # Get list of supported services
         supported_services = ServiceRegistry.supported
 
-        # Get resources for each supported service
-        for service in supported_services:  # [EC2Service, RDSService, etc..]
-
-            # Get the services name
-            service_name: str = service.name
+        # Get resources for each supported service, the engine runs the services
+        # concurrently and returns them keyed by service name in registry order
+        engine = DiscoveryEngine(session=self.session, services=supported_services)
+        discovered = engine.run()
 
-            # Get the resources
-            service_resources = service.get_resources(session=SESSION)
+        # Each service (and the shared tagging query) timed on its own, they run side by side
+        for service_name, duration in engine.durations.items():
+            self.metrics.put('PhaseLatency', duration * 1000, UNIT_MILLISECONDS,
+                             phase='discoverService', service=service_name)
 
+        for service_name, service_resources in discovered.items():
 
             # If we get any resources for any service, toggle is_empty
             if self.is_empty and len(service_resources) > 0:
@@ -0,0 +1,214 @@
+"""
+DiscoveryEngine
+
+DiscoveryEngine runs each supported service's get_resources against the
+spoke session. Services are discovered concurrently on a bounded worker
+pool, each with its own deadline, so a full sweep costs roughly the
+slowest service instead of the sum of all of them.
+
+Services that list tagging_resource_types are handed the resources that
+opted in to cloudwedge from one shared tagging api query, instead of each
+service listing every resource and checking its tags one at a time.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from os import environ
+from typing import Dict, List, Optional
+
+import boto3
+
+from cloudwedge.models import AWSResource, AWSService, AWSTaggedResource
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.sts import attach_spoke_session_hooks
+from cloudwedge.utils.tags import TagsApi
+
+LOGGER = get_logger('DiscoveryEngine')
+
+# Max number of services discovered at the same time
+DISCOVERY_MAX_WORKERS = int(environ.get('DISCOVERY_MAX_WORKERS', '8'))
+# Seconds a single service is allowed to run before the sweep is failed
+DISCOVERY_SERVICE_TIMEOUT = float(environ.get('DISCOVERY_SERVICE_TIMEOUT', '25'))
+# Run services one after the other, handy when debugging a single service
+DISCOVERY_SERIAL = environ.get('DISCOVERY_SERIAL', 'false').lower() == 'true'
+
+# How often the engine wakes up to check deadlines while waiting on services
+POLL_INTERVAL_SECONDS = 0.25
+
+
+class DiscoveryTimeoutError(Exception):
+    def __init__(self, service_names: List[str], timeout: float):
+        self.service_names = service_names
+        self.timeout = timeout
+
+    def __str__(self):
+        return f'services {self.service_names} did not finish discovery within {self.timeout}s'
+
+
+class DiscoveryEngine():
+    def __init__(self, session: boto3.session.Session, services: List[AWSService],
+                 max_workers: Optional[int] = None, service_timeout: Optional[float] = None,
+                 serial: Optional[bool] = None):
+
+        # Session for the spoke account
+        self.session = session
+        # Services to discover, order is kept in the output
+        self.services = services
+        # Engine settings, fallback to environment
+        self.max_workers = max(1, max_workers or DISCOVERY_MAX_WORKERS)
+        self.service_timeout = service_timeout or DISCOVERY_SERVICE_TIMEOUT
+        self.serial = DISCOVERY_SERIAL if serial is None else serial
+
+        # Track when each service started running, used for deadlines
+        self._started_at: Dict[str, float] = {}
+        # Track how long each service took, for logging
+        self.durations: Dict[str, float] = {}
+        # Opted in resources from the shared tagging api query, keyed by resource type
+        self.tagged_resources: Dict[str, List[AWSTaggedResource]] = {}
+
+    def run(self) -> Dict[str, List[AWSResource]]:
+        """
+        Discover resources for every service
+
+            Returns:
+                {
+                    "ec2": [Resources],
+                    "rds": [Resources],
+                }
+        """
+
+        started_at = time.monotonic()
+
+        # Shared stage, one tagging api query for all the services that use it
+        self.tagged_resources = self._get_tagged_resources()
+
+        if self.serial or self.max_workers == 1:
+            results = self._run_serial()
+        else:
+            results = self._run_parallel()
+
+        LOGGER.info(
+            f'Discovered {sum(len(r) for r in results.values())} resources in '
+            f'{round(time.monotonic() - started_at, 2)}s (serial={self.serial}) durations={self.durations}')
+
+        # Keep the service order stable no matter what order they finished in
+        return {
+            service.name: results[service.name] for service in self.services
+        }
+
+    def _run_serial(self) -> Dict[str, List[AWSResource]]:
+        """Discover services one at a time, no deadline is enforced"""
+
+        results = {}
+
+        for service in self.services:
+            results[service.name] = self._get_service_resources(service, self.session)
+
+        return results
+
+    def _run_parallel(self) -> Dict[str, List[AWSResource]]:
+        """Discover services on the worker pool"""
+
+        results = {}
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.services) or 1))
+
+        try:
+            futures = {
+                executor.submit(self._get_service_resources, service, self._clone_session()): service
+                for service in self.services
+            }
+
+            pending = set(futures.keys())
+
+            while pending:
+                done, pending = wait(pending, timeout=POLL_INTERVAL_SECONDS, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    service = futures[future]
+                    # Raises the services error, failing the sweep just like serial discovery
+                    results[service.name] = future.result()
+
+                # Check no running service has gone past its deadline
+                self._check_deadlines([futures[future] for future in pending])
+
+            return results
+
+        finally:
+            # Dont hold the invocation open for a service that blew its deadline
+            executor.shutdown(wait=False)
+
+    def _get_service_resources(self, service: AWSService, session: boto3.session.Session) -> List[AWSResource]:
+        """Get resources for a single service, tracking how long it took"""
+
+        self._started_at[service.name] = time.monotonic()
+
+        if service.tagging_resource_types:
+            # Hand over just the resources for this service
+            service_resources = service.get_resources(
+                session=session,
+                tagged_resources=TagsApi.get_service_tagged_resources(session, service, self.tagged_resources)
+            )
+        else:
+            service_resources = service.get_resources(session=session)
+
+        self.durations[service.name] = round(time.monotonic() - self._started_at[service.name], 3)
+
+        return service_resources
+
+    def _get_tagged_resources(self) -> Dict[str, List[AWSTaggedResource]]:
+        """Query the tagging api once for every service that finds resources with it"""
+
+        resource_types = [
+            resource_type for service in self.services for resource_type in service.tagging_resource_types
+        ]
+
+        if not resource_types:
+            return {}
+
+        started_at = time.monotonic()
+
+        tagged_resources = TagsApi.get_tagged_resources(self.session, resource_types)
+
+        self.durations['tagging'] = round(time.monotonic() - started_at, 3)
+
+        return tagged_resources
+
+    def _check_deadlines(self, running_services: List[AWSService]):
+        """Raise if any service has been running longer than allowed"""
+
+        now = time.monotonic()
+
+        expired = [
+            service.name for service in running_services
+            if service.name in self._started_at and now - self._started_at[service.name] > self.service_timeout
+        ]
+
+        if expired:
+            # A partial sweep would look like owners disappeared and get their stacks
+            # triaged for deletion, so fail the whole sweep instead
+            LOGGER.error(f'Discovery deadline exceeded for: {expired}')
+            raise DiscoveryTimeoutError(expired, self.service_timeout)
+
+    def _clone_session(self) -> boto3.session.Session:
+        """
+        boto3 sessions are not thread safe, give each worker its own session
+        built from the same credentials
+        """
+
+        credentials = self.session.get_credentials()
+
+        if not credentials:
+            clone = boto3.session.Session(region_name=self.session.region_name)
+        else:
+            frozen = credentials.get_frozen_credentials()
+
+            clone = boto3.session.Session(
+                aws_access_key_id=frozen.access_key,
+                aws_secret_access_key=frozen.secret_key,
+                aws_session_token=frozen.token,
+                region_name=self.session.region_name
+            )
+
+        # Event hooks live on the session, the workers get the same ones
+        return attach_spoke_session_hooks(clone)
@@ -0,0 +1,105 @@
+"""
+IncrementalDiscovery
+
+IncrementalDiscovery rediscovers only the resources named by a tag change
+event and merges them into the last known snapshot for the account. Services
+that cant look up a single resource rediscover just their own resources,
+the rest of the snapshot is kept as is.
+"""
+
+from typing import Dict, List
+
+import boto3
+
+from cloudwedge.models import AWSResource, AWSService
+from cloudwedge.utils.arnparse import MalformedArnError, arn_resource_type, arnparse
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.tags import TagsApi
+
+LOGGER = get_logger('IncrementalDiscovery')
+
+
+class IncrementalDiscovery():
+    def __init__(self, session: boto3.session.Session, services: List[AWSService],
+                 snapshot: Dict[str, List[AWSResource]]):
+
+        # Session for the spoke account
+        self.session = session
+        # Services that could own the event arns
+        self.services = services
+        # Last known resources keyed by service name
+        self.snapshot = snapshot
+
+    def run(self, arns: List[str]) -> Dict[str, List[AWSResource]]:
+        """
+        Merge the rediscovered resources for the arns into the snapshot
+
+            Returns:
+                {
+                    "ec2": [Resources],
+                    "rds": [Resources],
+                }
+        """
+
+        # Start from the snapshot, every service in registry order
+        resources: Dict[str, List[AWSResource]] = {
+            service.name: list(self.snapshot.get(service.name, [])) for service in self.services
+        }
+
+        for service, service_arns in self._get_arns_by_service(arns).items():
+            LOGGER.info(f'Rediscovering {service.name} for {service_arns}')
+
+            resources[service.name] = self._merge_service(service, service_arns, resources[service.name])
+
+        return resources
+
+    def _get_arns_by_service(self, arns: List[str]) -> Dict[AWSService, List[str]]:
+        """Match the event arns to the services that own them"""
+
+        arns_by_service = {}
+
+        for arn in arns:
+            try:
+                resource_type = arn_resource_type(arnparse(arn))
+            except MalformedArnError:
+                LOGGER.info(f'Skipping malformed arn: {arn}')
+                continue
+
+            service = next((
+                service for service in self.services
+                if resource_type in service.tagging_resource_types or resource_type in service.event_resource_types
+            ), None)
+
+            if not service:
+                # e.g. a lambda function, cloudwedge doesnt monitor it so nothing can change
+                LOGGER.info(f'No supported service for arn: {arn}')
+                continue
+
+            arns_by_service.setdefault(service, []).append(arn)
+
+        return arns_by_service
+
+    def _merge_service(self, service: AWSService, arns: List[str],
+                       snapshot_resources: List[AWSResource]) -> List[AWSResource]:
+        """Rediscover the arns for the service and merge them into its snapshot resources"""
+
+        if service.tagging_resource_types:
+            # Tags for just these arns, then the service fills in its details
+            tagged_resources = TagsApi.get_tagged_resources_by_arns(self.session, arns)
+            rediscovered = service.get_resources(session=self.session, tagged_resources=tagged_resources)
+        else:
+            rediscovered = service.get_resources_by_arns(self.session, arns)
+
+        if rediscovered is None:
+            # Service cant look up single resources, replace all of its resources
+            return service.get_resources(session=self.session)
+
+        # Drop the old copies of the resources, they are either replaced or no longer opted in
+        dimension_ids = {service.get_dimension_id_from_arn(arn) for arn in arns}
+
+        kept = [
+            resource for resource in snapshot_resources
+            if resource['cloudwatchDimensionId'] not in dimension_ids
+        ]
+
+        return kept + rediscovered
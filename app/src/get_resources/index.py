@@ -2,18 +2,23 @@
 Wrap lambda handler and call main app
 """
 
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+
 from app import GetResources
 
 
 def run_app(evt=None, ctx=None):
     """Parse event and run main app"""
 
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
     # Get target account from event
     target_account_id = evt['account']
 
     resources = GetResources(target_account_id).run(event=evt)
 
-    return resources
+    return API_CALL_RECORDER.add_totals(resources, 'GetResources')
 
 def lambda_handler(event, context):
     """Lambda handler"""
@@ -0,0 +1,99 @@
+"""
+ResourceSnapshot
+
+ResourceSnapshot keeps the last known resources for a spoke account in the
+private assets bucket. Incremental rebuilds merge a single rediscovered
+resource into it, and compare owners against it to find the ones that
+actually changed.
+"""
+
+import json
+from os import environ
+from typing import Dict, List, Optional, Set
+
+from cloudwedge.models import AWSResource
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.s3 import s3_get_object, s3_save_object
+
+PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+REGION = environ.get('REGION')
+
+LOGGER = get_logger('ResourceSnapshot')
+
+
+class ResourceSnapshot():
+
+    @staticmethod
+    def get_key(target_account_id: str) -> str:
+        """S3 key of the snapshot for the account"""
+
+        return f'snapshots/{target_account_id}/{REGION}/resources.json'
+
+    @staticmethod
+    def load(session, target_account_id: str) -> Optional[Dict[str, List[AWSResource]]]:
+        """Load the last known resources, None when there isnt a usable snapshot"""
+
+        try:
+            content = s3_get_object(session=session, bucket=PRIVATE_ASSETS_BUCKET,
+                                    key=ResourceSnapshot.get_key(target_account_id))
+
+            return json.loads(content) if content else None
+
+        except Exception as err:
+            # Snapshot is only an optimization, a full sweep will replace it
+            LOGGER.info(f'Failed to load resource snapshot with error: {err}')
+            return None
+
+    @staticmethod
+    def save(session, target_account_id: str, resources: Dict[str, List[AWSResource]]):
+        """Save the resources as the last known snapshot"""
+
+        try:
+            s3_save_object(session=session, bucket=PRIVATE_ASSETS_BUCKET,
+                           key=ResourceSnapshot.get_key(target_account_id),
+                           content=json.dumps(resources))
+
+        except Exception as err:
+            # Next incremental run will fall back to a full sweep
+            LOGGER.info(f'Failed to save resource snapshot with error: {err}')
+
+    @staticmethod
+    def get_changed_owners(previous_owner_resources: Dict[str, Dict[str, List[AWSResource]]],
+                           owner_resources: Dict[str, Dict[str, List[AWSResource]]]) -> List[str]:
+        """
+        Compare owners resources and return the owners whose membership
+        or resource details (tags, monitoring, etc) changed
+        """
+
+        owners: Set[str] = set(previous_owner_resources.keys()) | set(owner_resources.keys())
+
+        changed_owners = [
+            owner for owner in sorted(owners)
+            if ResourceSnapshot._fingerprint(previous_owner_resources.get(owner, {})) !=
+            ResourceSnapshot._fingerprint(owner_resources.get(owner, {}))
+        ]
+
+        return changed_owners
+
+    @staticmethod
+    def _fingerprint(services_resources: Dict[str, List[AWSResource]]) -> str:
+        """Canonical string for an owners resources, order of resources and tags doesnt matter"""
+
+        canonical = {}
+
+        for service_name, resources in services_resources.items():
+            if not resources:
+                continue
+
+            canonical[service_name] = sorted(
+                (
+                    {
+                        **resource,
+                        'tags': sorted(resource.get('tags') or [], key=lambda tag: (tag['Key'], tag['Value']))
+                    }
+                    for resource in resources
+                ),
+                key=lambda resource: (resource['uniqueId'], resource['cloudwatchDimensionId'])
+            )
+
+        return json.dumps(canonical, sort_keys=True, default=str)
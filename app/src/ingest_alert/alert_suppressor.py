@@ -0,0 +1,278 @@
+"""
+AlertSuppressor
+
+Sits in front of the alerter so an incident doesnt page everyone once per
+alarm. Alerts are counted in fixed windows of ALERT_SUPPRESSION_WINDOW_SECONDS.
+
+Within a window:
+    - An alert for the same (owner, resource, metric, state) as one already
+      sent is a duplicate and is dropped.
+    - The first ALERT_BURST_THRESHOLD alerts for an (owner, state) are sent
+      as they are. Past that the owner is in a storm, the rest are folded
+      into one aggregated notification for the owner, further alerts in the
+      window are folded into the counts only.
+
+Every dropped and folded alert is counted in the store, and the counts from
+the previous window go out with the next aggregated notification, so
+nothing disappears without a trace.
+
+The store is pluggable. DynamoSuppressionStore shares the counts across
+invocations, LocalSuppressionStore keeps them in memory for tests.
+"""
+
+import threading
+import time
+from os import environ
+from typing import Dict, List, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+from cloudwedge.utils.logger import get_logger
+
+LOGGER = get_logger('AlertSuppressor')
+
+ALERT_SUPPRESSION_TABLE = environ.get('ALERT_SUPPRESSION_TABLE')
+
+# Seconds alerts are deduplicated and counted over, 0 sends everything
+ALERT_SUPPRESSION_WINDOW_SECONDS = int(environ.get('ALERT_SUPPRESSION_WINDOW_SECONDS', '300'))
+# Alerts sent for an owner in a window before the rest are folded
+ALERT_BURST_THRESHOLD = int(environ.get('ALERT_BURST_THRESHOLD', '5'))
+
+# Most urgent level wins when alerts are folded together
+ALERT_LEVELS = ['low', 'medium', 'high', 'critical']
+
+# Kept for each alert folded into a storm, the raw events would blow up the input
+STORM_ALERT_KEYS = ['level', 'owner', 'metric', 'state', 'resourceName', 'snsSubject']
+
+
+class DynamoSuppressionStore():
+    '''Counts in a dynamodb table, expired by its ttl'''
+
+    def __init__(self, table: str = ALERT_SUPPRESSION_TABLE):
+        self.table = table
+        self.client_dynamodb = boto3.client('dynamodb')
+
+    def add_if_absent(self, key: str, ttl_seconds: int) -> bool:
+        '''Add the key, False if it was already there'''
+
+        now = int(time.time())
+
+        try:
+            self.client_dynamodb.put_item(
+                TableName=self.table,
+                Item={
+                    'suppressionKey': {'S': key},
+                    'expiresAt': {'N': str(now + ttl_seconds)}
+                },
+                # Ttl deletes lag behind, an expired item counts as gone
+                ConditionExpression='attribute_not_exists(suppressionKey) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}})
+
+            return True
+
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise err
+
+            return False
+
+    def increment(self, key: str, ttl_seconds: int, amount: int = 1) -> int:
+        '''Add to the count on the key and return the new count'''
+
+        response = self.client_dynamodb.update_item(
+            TableName=self.table,
+            Key={'suppressionKey': {'S': key}},
+            UpdateExpression='ADD alertCount :amount SET expiresAt = if_not_exists(expiresAt, :expires)',
+            ExpressionAttributeValues={
+                ':amount': {'N': str(amount)},
+                ':expires': {'N': str(int(time.time()) + ttl_seconds)}
+            },
+            ReturnValues='UPDATED_NEW')
+
+        return int(response['Attributes']['alertCount']['N'])
+
+    def get_count(self, key: str) -> int:
+        '''Count on the key, 0 if it isnt there'''
+
+        response = self.client_dynamodb.get_item(TableName=self.table, Key={'suppressionKey': {'S': key}})
+
+        return int(response.get('Item', {}).get('alertCount', {}).get('N', '0'))
+
+    def remove(self, key: str):
+        '''Remove the key'''
+
+        self.client_dynamodb.delete_item(TableName=self.table, Key={'suppressionKey': {'S': key}})
+
+
+class LocalSuppressionStore():
+    '''Counts in memory, stand in for tests'''
+
+    def __init__(self):
+        self.items: Dict[str, Tuple[int, float]] = {}
+        self.lock = threading.Lock()
+
+    def add_if_absent(self, key: str, ttl_seconds: int) -> bool:
+        with self.lock:
+            if self._is_live(key):
+                return False
+
+            self.items[key] = (0, time.time() + ttl_seconds)
+
+            return True
+
+    def increment(self, key: str, ttl_seconds: int, amount: int = 1) -> int:
+        with self.lock:
+            count, expires_at = self.items[key] if self._is_live(key) else (0, time.time() + ttl_seconds)
+            self.items[key] = (count + amount, expires_at)
+
+            return count + amount
+
+    def get_count(self, key: str) -> int:
+        with self.lock:
+            return self.items[key][0] if self._is_live(key) else 0
+
+    def remove(self, key: str):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def _is_live(self, key: str) -> bool:
+        return key in self.items and self.items[key][1] > time.time()
+
+
+class AlertSuppressor():
+    def __init__(self, store=None, window_seconds: int = ALERT_SUPPRESSION_WINDOW_SECONDS,
+                 burst_threshold: int = ALERT_BURST_THRESHOLD):
+
+        # DynamoSuppressionStore or LocalSuppressionStore
+        self.store = store
+        self.window_seconds = window_seconds
+        self.burst_threshold = burst_threshold
+
+    def suppress(self, step_inputs: List[Tuple[str, Dict]],
+                 now: Optional[float] = None) -> List[Tuple[List[str], Dict]]:
+        """Drop duplicates and fold storms, returns the alerts to send with the record ids each covers"""
+
+        if not self.window_seconds or not self.store:
+            return [([record_id], step_input) for record_id, step_input in step_inputs]
+
+        window = int((now or time.time()) // self.window_seconds)
+        # Counts have to outlive their window, the next window reports them
+        ttl_seconds = self.window_seconds * 2
+
+        to_send: List[Tuple[List[str], Dict]] = []
+        # Alerts past the burst threshold, by (owner, state)
+        folded: Dict[Tuple[str, str], List[Tuple[str, Dict]]] = {}
+
+        for record_id, step_input in step_inputs:
+            owner = step_input['owner']
+            state = step_input['state']
+
+            if not self.store.add_if_absent(self._get_alert_key(step_input, window), ttl_seconds):
+                self.store.increment(self._get_count_key('duplicates', owner, state, window), ttl_seconds)
+                LOGGER.info(f"Dropped duplicate alert for {owner}: {step_input['snsSubject']}")
+                continue
+
+            burst_count = self.store.increment(self._get_count_key('burst', owner, state, window), ttl_seconds)
+
+            if burst_count <= self.burst_threshold:
+                to_send.append(([record_id], step_input))
+            else:
+                folded.setdefault((owner, state), []).append((record_id, step_input))
+
+        for (owner, state), alerts in folded.items():
+            self.store.increment(self._get_count_key('folded', owner, state, window), ttl_seconds,
+                                 amount=len(alerts))
+
+            # One aggregated notification per owner per window, the rest only count
+            if not self.store.add_if_absent(self._get_count_key('storm', owner, state, window), ttl_seconds):
+                LOGGER.info(f'Folded {len(alerts)} alerts for {owner} into the storm already notified')
+                continue
+
+            LOGGER.info(f'Alert storm for {owner}, folded {len(alerts)} alerts into one notification')
+
+            to_send.append((
+                [record_id for record_id, _ in alerts],
+                self._make_storm_input(owner, state, [step_input for _, step_input in alerts], {
+                    'duplicates': self.store.get_count(self._get_count_key('duplicates', owner, state, window - 1)),
+                    'folded': self.store.get_count(self._get_count_key('folded', owner, state, window - 1))
+                })
+            ))
+
+        return to_send
+
+    def release(self, step_input: Dict, now: Optional[float] = None):
+        """Forget the alerts in a notification that failed to send, so a retry isnt taken for a duplicate"""
+
+        if not self.window_seconds or not self.store:
+            return
+
+        window = int((now or time.time()) // self.window_seconds)
+        ttl_seconds = self.window_seconds * 2
+
+        alerts = step_input.get('alerts', [step_input])
+        owner = step_input['owner']
+        state = step_input['state']
+
+        for alert in alerts:
+            self.store.remove(self._get_alert_key(alert, window))
+
+        # The retry counts the alerts towards the burst again
+        self.store.increment(self._get_count_key('burst', owner, state, window), ttl_seconds, amount=-len(alerts))
+
+        if step_input.get('type') == 'storm':
+            # The retry folds them again, and has to be let through as the storms notification
+            self.store.increment(self._get_count_key('folded', owner, state, window), ttl_seconds,
+                                 amount=-len(alerts))
+            self.store.remove(self._get_count_key('storm', owner, state, window))
+
+    def _make_storm_input(self, owner: str, state: str, alerts: List[Dict], previous_counts: Dict) -> Dict:
+        """One alerter input for the folded alerts"""
+
+        level = max((alert['level'] for alert in alerts),
+                    key=lambda level: ALERT_LEVELS.index(level) if level in ALERT_LEVELS else -1)
+
+        resources = sorted({alert['resourceName'] for alert in alerts})
+
+        sns_subject = f'{level.capitalize()} {state} storm for {owner}, {len(alerts)} alarms on {len(resources)} resources'
+
+        lines = [alert['snsSubject'] for alert in alerts]
+        lines.append(f'Further {state} alarms for {owner} are folded for up to {self.window_seconds} seconds')
+
+        if previous_counts['duplicates'] or previous_counts['folded']:
+            lines.append(f"Previous window: {previous_counts['folded']} alarms folded, "
+                         f"{previous_counts['duplicates']} duplicates dropped")
+
+        return {
+            "level": level,
+            "type": "storm",
+            "owner": owner,
+            "metric": ','.join(sorted({alert['metric'] for alert in alerts})),
+            "state": state,
+            "resourceName": ','.join(resources),
+            "snsSubject": sns_subject[:98],
+            "snsMessage": {"default": sns_subject[:98], "sms": sns_subject[:98], "email": '\n'.join(lines)},
+            "suppressedCounts": previous_counts,
+            "alerts": [{key: alert[key] for key in STORM_ALERT_KEYS} for alert in alerts]
+        }
+
+    @staticmethod
+    def _get_alert_key(step_input: Dict, window: int) -> str:
+        return (f"alert#{step_input['owner']}#{step_input['resourceName']}#{step_input['metric']}"
+                f"#{step_input['state']}#{window}")
+
+    @staticmethod
+    def _get_count_key(kind: str, owner: str, state: str, window: int) -> str:
+        return f'{kind}#{owner}#{state}#{window}'
+
+
+def get_suppression_store():
+    '''Dynamo store when the table is configured, else one in memory for the container'''
+
+    if ALERT_SUPPRESSION_TABLE:
+        return DynamoSuppressionStore()
+
+    return LOCAL_SUPPRESSION_STORE
+
+
+LOCAL_SUPPRESSION_STORE = LocalSuppressionStore()
@@ -3,17 +3,41 @@ IngestAlert
 
 Ingest alert from an cloudwedge cloudwatch alarm, standardize the event
 and send to alerting step function
+
+Every record in the batch is ingested, and the step function executions are
+started concurrently. A start that fails is retried with jittered
+exponential backoff. Records that still fail are reported back by message id
+in the partial batch response, so only they are retried. SNS doesnt take a
+partial response (it delivers one record per invoke), so there a failure is
+raised and the invoke is retried.
+
+Before anything is started, duplicates are dropped and storms for an owner
+are folded into one notification by the AlertSuppressor.
+
+Parsing, suppression and starting the alerts are timed as phases, with the
+records, alerts per owner and failures, emitted as EMF metrics.
+
+Alarms reach ingest either through their sns action, or (AlarmIngestMode
+events) as eventbridge alarm state change events. The events carry the alarm
+configuration as json, so nothing has to be pulled out of the description
+with regexes, and the alarms dont need an action at all.
 """
 import os
 import json
+import random
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 import boto3
 from botocore.exceptions import ClientError
 
 from cloudwedge.models import AWSService
 from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.metrics import Metrics
+
+from alert_suppressor import AlertSuppressor, get_suppression_store
 
 LOGGER = get_logger('IngestAlert')
 
@@ -25,84 +49,186 @@ STEP_CLIENT = SESSION.client('stepfunctions')
 # ARN of step function that will receive notification
 STEPFUNCTION_ARN = os.environ.get('STEPFUNCTION_ARN')
 
+# Executions started at once during an alarm storm
+INGEST_MAX_WORKERS = int(os.environ.get('INGEST_MAX_WORKERS', '8'))
+# Attempts at starting an execution before the record is reported as failed
+INGEST_START_MAX_ATTEMPTS = int(os.environ.get('INGEST_START_MAX_ATTEMPTS', '5'))
+# Backoff before the second attempt, doubles each attempt up to the cap
+INGEST_START_BACKOFF_BASE_SECONDS = float(os.environ.get('INGEST_START_BACKOFF_BASE_SECONDS', '0.2'))
+INGEST_START_BACKOFF_CAP_SECONDS = float(os.environ.get('INGEST_START_BACKOFF_CAP_SECONDS', '5'))
+
+# Alarm state changes delivered by eventbridge instead of the alarms sns action
+ALARM_STATE_CHANGE_DETAIL_TYPE = 'CloudWatch Alarm State Change'
+
+# Values from the alarm description, compiled once per container
+ALARM_DESCRIPTION_PATTERNS = {
+    'level': re.compile(f'(?<={AWSService.ALARM_DESCRIPTION_KEY_LEVEL}=)(\\w+)'),
+    'owner': re.compile(f'(?<={AWSService.ALARM_DESCRIPTION_KEY_OWNER}=)(\\w+)'),
+    'type': re.compile(f'(?<={AWSService.ALARM_DESCRIPTION_KEY_TYPE}=)([\\w,\\-,\\/]+)'),
+    'metric': re.compile(f'(?<={AWSService.ALARM_DESCRIPTION_KEY_METRIC}=)([\\w,\\-]+)'),
+    'resource': re.compile(f'(?<={AWSService.ALARM_DESCRIPTION_KEY_RESOURCE}=)([\\w,\\-]+)')
+}
+
+
+class IngestAlertError(Exception):
+    def __init__(self, record_ids: Optional[List[str]] = None):
+        self.record_ids = record_ids or []
+
+    def __str__(self):
+        return f'failed to ingest alarm records: {self.record_ids}'
+
 
 class IngestAlert():
-    def __init__(self, event=None):
+    def __init__(self, event=None, suppressor=None):
         # Set up event
         self.event = event
+        # Drops duplicates and folds storms before the alerter sees them
+        self.suppressor = suppressor or AlertSuppressor(store=get_suppression_store())
+        # Phase timings and counts for the run, alarms come from every spoke account
+        self.metrics = Metrics('IngestAlert')
 
     def run(self):
-        """Run"""
+        """
+        Run
+
+            Returns:
+                {
+                    "batchItemFailures": [
+                        {
+                            "itemIdentifier": "message id"
+                        }
+                    ]
+                }
+        """
+
+        try:
+            return self._run()
+        finally:
+            self.metrics.flush()
+
+    def _run(self):
+        # An eventbridge alarm event is a batch of its own
+        is_alarm_event = self.event.get('detail-type') == ALARM_STATE_CHANGE_DETAIL_TYPE
+        records = [self.event] if is_alarm_event else self.event.get('Records', [])
+        step_inputs: List[Tuple[str, Dict]] = []
+        failed_ids: List[str] = []
+
+        with self.metrics.phase('parse'):
+            for record in records:
+                # Set before parsing, so a record that fails to parse is logged with its own id
+                record_id = record.get('messageId') or record.get('id') or record.get('Sns', {}).get('MessageId')
+
+                try:
+                    if is_alarm_event:
+                        record_id = record['id']
+                        step_inputs.append((record_id, self.make_step_input_from_alarm_event(record)))
+                    else:
+                        record_id, raw_message = self._get_record_message(record)
+                        step_inputs.append((record_id, self.make_step_input(record, raw_message)))
+                except Exception as err:
+                    # Wont parse any better on a retry, drop it instead of retrying it forever
+                    LOGGER.error(f'Failed to parse alarm from record {record_id}, dropping it: {err}')
+
+        self.metrics.count('Records', len(records), phase='parse')
+        self.metrics.count('DroppedRecords', len(records) - len(step_inputs), phase='parse')
+
+        # Each alert to send, with the records it covers
+        with self.metrics.phase('suppress'):
+            alerts = self.suppressor.suppress(step_inputs)
+
+        for _, step_input in alerts:
+            self.metrics.count('Alerts', 1, phase='suppress', owner=step_input['owner'])
+
+        if alerts:
+            with self.metrics.phase('startExecutions'), \
+                    ThreadPoolExecutor(max_workers=min(INGEST_MAX_WORKERS, len(alerts))) as executor:
+                started = list(executor.map(lambda alert: self._start_execution(alert[0][0], alert[1]), alerts))
+
+            for (record_ids, step_input), ok in zip(alerts, started):
+                if not ok:
+                    # Retried records shouldnt be dropped as duplicates of themselves
+                    self.suppressor.release(step_input)
+                    failed_ids.extend(record_ids)
+
+        LOGGER.info(f'Sent {len(alerts)} alerts for {len(records)} alarm records, {len(failed_ids)} records failed')
+
+        self.metrics.count('FailedRecords', len(failed_ids), phase='startExecutions')
+
+        # Neither sns nor eventbridge take a partial response, fail the invoke so its retried
+        if failed_ids and (is_alarm_event or self._is_sns_event(records)):
+            raise IngestAlertError(failed_ids)
+
+        return {
+            'batchItemFailures': [{'itemIdentifier': record_id} for record_id in failed_ids]
+        }
+
+    def make_step_input(self, record: Dict, raw_sns_message: str) -> Dict:
+        """Standardize the alarm into the alerter step function input"""
 
-        # Pull message from Sns event
-        raw_sns_message = self.event['Records'][0]['Sns']['Message']
         alarm_details = json.loads(raw_sns_message)
 
         # Alarm description will have info we can use to identify more about the alert
         alarm_description = alarm_details['AlarmDescription']
-        alarm_metric_name = alarm_details['Trigger']['MetricName']
         alarm_metric_threshold = alarm_details['Trigger']['Threshold']
         alert_state = alarm_details['NewStateValue']
 
         # Get values from alarm description
-        re_alert_level = re.search(
-            f'(?<={AWSService.ALARM_DESCRIPTION_KEY_LEVEL}=)(\w+)', alarm_description)
-        re_alert_owner = re.search(
-            f'(?<={AWSService.ALARM_DESCRIPTION_KEY_OWNER}=)(\w+)', alarm_description)
-        re_alert_type = re.search(
-            f'(?<={AWSService.ALARM_DESCRIPTION_KEY_TYPE}=)([\w,\-,\/]+)', alarm_description)
-        re_alert_metric = re.search(
-            f'(?<={AWSService.ALARM_DESCRIPTION_KEY_METRIC}=)([\w,\-]+)', alarm_description)
-        re_resource_name = re.search(
-            f'(?<={AWSService.ALARM_DESCRIPTION_KEY_RESOURCE}=)([\w,\-]+)', alarm_description)
-
-        alert_level = re_alert_level.groups()[0]
-        alert_owner = re_alert_owner.groups()[0]
-        alert_type = re_alert_type.groups()[0]
-        alert_metric = re_alert_metric.groups()[0]
-        resource_name = re_resource_name.groups()[0]
+        values = {
+            key: pattern.search(alarm_description).groups()[0]
+            for key, pattern in ALARM_DESCRIPTION_PATTERNS.items()
+        }
 
         # Get sns subject ready
-        sns_subject = self.make_sns_subject(state=alert_state, level=alert_level,
-                                            namespace=alert_type, resource=resource_name,
-                                            metric=alert_metric, threshold=alarm_metric_threshold)
+        sns_subject = self.make_sns_subject(state=alert_state, level=values['level'],
+                                            namespace=values['type'], resource=values['resource'],
+                                            metric=values['metric'], threshold=alarm_metric_threshold)
 
         # Build object to send to step function
-        step_input = {
-            "level": alert_level.lower(),
-            "type": alert_type.lower(),
-            "owner": alert_owner.lower(),
-            "metric": alert_metric,
+        return {
+            "level": values['level'].lower(),
+            "type": values['type'].lower(),
+            "owner": values['owner'].lower(),
+            "metric": values['metric'],
             "state": alert_state,
-            "resourceName": resource_name,
+            "resourceName": values['resource'],
             "snsSubject": sns_subject,
             "snsMessage": self.make_sns_message(raw_sns_message, sns_subject),
-            "event": self.event
+            "event": {'Records': [record]}
         }
 
-        LOGGER.info(
-            f"Starting step function {STEPFUNCTION_ARN} : {step_input['snsSubject']}")
+    def make_step_input_from_alarm_event(self, event: Dict) -> Dict:
+        """Standardize the alarm state change event into the alerter step function input"""
 
-        try:
-            response = STEP_CLIENT.start_execution(
-                stateMachineArn=STEPFUNCTION_ARN,
-                input=json.dumps(step_input)
-            )
-        except Exception as err:
-            LOGGER.error(f"Failed to start step function with error: {err}")
+        detail = event['detail']
+        alert_state = detail['state']['value']
 
-            LOGGER.info("Waiting 10 seconds and will try again")
-            time.sleep(10)
+        # Level, owner and resource name are only on the description, its Key=Value pairs split apart
+        values = dict(
+            pair.split('=', 1) for pair in detail['configuration']['description'].split() if '=' in pair
+        )
 
-            try:
-                response = STEP_CLIENT.start_execution(
-                    stateMachineArn=STEPFUNCTION_ARN,
-                    input=json.dumps(step_input)
-                )
-            except Exception as err:
-                LOGGER.error(
-                    f"We are in trouble... Again Failed to start step function with error: {err}")
-                raise err
+        # Namespace and metric come with the alarm configuration
+        metric = detail['configuration']['metrics'][0]['metricStat']['metric']
+
+        # Threshold alarms report what they compared against
+        reason_data = json.loads(detail['state'].get('reasonData') or '{}')
+
+        sns_subject = self.make_sns_subject(state=alert_state, level=values[AWSService.ALARM_DESCRIPTION_KEY_LEVEL],
+                                            namespace=metric['namespace'],
+                                            resource=values[AWSService.ALARM_DESCRIPTION_KEY_RESOURCE],
+                                            metric=metric['name'], threshold=reason_data.get('threshold'))
+
+        return {
+            "level": values[AWSService.ALARM_DESCRIPTION_KEY_LEVEL].lower(),
+            "type": metric['namespace'].lower(),
+            "owner": values[AWSService.ALARM_DESCRIPTION_KEY_OWNER].lower(),
+            "metric": metric['name'],
+            "state": alert_state,
+            "resourceName": values[AWSService.ALARM_DESCRIPTION_KEY_RESOURCE],
+            "snsSubject": sns_subject,
+            "snsMessage": self.make_sns_message(json.dumps(detail), sns_subject),
+            "event": event
+        }
 
     def make_sns_subject(self, state=None, level=None, namespace=None, resource=None, metric=None, threshold=None):
         '''SNS subject can only be 100 chars'''
@@ -132,3 +258,64 @@ class IngestAlert():
                     "sms": sns_subject, "email": raw_sns_message}
 
         return sns_message
+
+    def _start_execution(self, record_id: str, step_input: Dict) -> bool:
+        """Start the alerter for the record, backing off on failures, False if it never started"""
+
+        LOGGER.info(f"Starting step function {STEPFUNCTION_ARN} : {step_input['snsSubject']}")
+
+        for attempt in range(INGEST_START_MAX_ATTEMPTS):
+            try:
+                STEP_CLIENT.start_execution(
+                    stateMachineArn=STEPFUNCTION_ARN,
+                    # Named by the record, so a retried record doesnt alert twice
+                    name=self._get_execution_name(record_id),
+                    input=json.dumps(step_input)
+                )
+
+                return True
+
+            except ClientError as err:
+                if err.response['Error']['Code'] == 'ExecutionAlreadyExists':
+                    LOGGER.info(f'Alert for record {record_id} already started')
+                    return True
+
+                LOGGER.warning(f'Failed to start step function for record {record_id} '
+                               f'(attempt {attempt + 1}): {err}')
+
+            except Exception as err:
+                LOGGER.warning(f'Failed to start step function for record {record_id} '
+                               f'(attempt {attempt + 1}): {err}')
+
+            if attempt + 1 < INGEST_START_MAX_ATTEMPTS:
+                time.sleep(self._get_backoff_seconds(attempt))
+
+        LOGGER.error(f'Gave up starting step function for record {record_id}')
+
+        return False
+
+    @staticmethod
+    def _get_backoff_seconds(attempt: int) -> float:
+        """Full jitter, so throttled starts dont all come back at once"""
+
+        return random.uniform(0, min(INGEST_START_BACKOFF_CAP_SECONDS,
+                                     INGEST_START_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+    @staticmethod
+    def _get_record_message(record: Dict) -> Tuple[str, str]:
+        """Message id and raw alarm message of an sns or sqs record"""
+
+        if 'Sns' in record:
+            return record['Sns']['MessageId'], record['Sns']['Message']
+
+        return record['messageId'], record['body']
+
+    @staticmethod
+    def _get_execution_name(record_id: str) -> str:
+        # Execution names are limited to 80 characters of letters, numbers, - and _
+        return re.sub(r'[^\w\-]', '-', record_id)[:80]
+
+    @staticmethod
+    def _is_sns_event(records: List[Dict]) -> bool:
+        return any('Sns' in record for record in records)
+
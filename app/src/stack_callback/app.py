@@ -0,0 +1,153 @@
+"""
+StackCallback
+
+Resumes the builder the moment a stack it deployed or deleted settles,
+instead of polling the stack on a fixed wait.
+
+The builder waits on a task token. StackCallback registers the token for
+the stack, then cloudformation stack status change events (forwarded from
+the spokes to the hub bus) complete it once the stack reaches a terminal
+state. The stack is checked once right after the token is registered, so
+an event that arrived before the token was saved isnt missed.
+
+Task tokens are kept in the hub private bucket under the hubs own
+credentials. The spoke role is only used to read and delete the stack.
+
+The output has the same shape as CheckStatus, and uses the same status
+buckets, so a stack that errors fails the wait the same way.
+"""
+
+import json
+from datetime import datetime, timezone
+from os import environ
+from typing import Dict, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from cloudwedge.utils.logger import get_logger
+from cloudwedge.utils.s3 import s3_delete_object, s3_get_object, s3_save_object
+from cloudwedge.utils.stack_status import get_stack_status_output, stack_status_is_delete, stack_status_is_inprogress
+from cloudwedge.utils.stacks import STACK_NAME_PREFIX
+from cloudwedge.utils.sts import get_spoke_client
+
+PRIVATE_ASSETS_BUCKET = environ.get('PRIVATE_ASSETS_BUCKET')
+REGION = environ.get('REGION')
+
+LOGGER = get_logger('StackCallback')
+
+CLIENT_STATES = boto3.client('stepfunctions')
+# Hub session for the task tokens, they never leave the hub account
+SESSION = boto3.session.Session()
+
+# Error the wait fails with when the stack settled in an error status
+STACK_FAILED_ERROR = 'CloudWedge.StackFailed'
+
+
+class StackCallback():
+    def __init__(self, target_account_id=None):
+        self.target_account_id = target_account_id
+
+    def register(self, stack_status: Dict, task_token: str):
+        """Save the task token for the stack, and complete it if the stack already settled"""
+
+        stack_name = stack_status['stackName']
+
+        s3_save_object(session=SESSION, bucket=PRIVATE_ASSETS_BUCKET,
+                       key=self._get_key(stack_name),
+                       content=json.dumps({
+                           'taskToken': task_token,
+                           'registeredAt': datetime.now(timezone.utc).isoformat()
+                       }))
+
+        LOGGER.info(f'Registered task token for {stack_name}')
+
+        # The stack may have settled before the token was saved, its event is already gone
+        status = self._get_stack_status(stack_name)
+
+        if not stack_status_is_inprogress(status):
+            self._complete(stack_name, status, task_token)
+
+    def on_stack_event(self, event: Dict):
+        """Complete the task token for the stack on the event, if it settled and something is waiting"""
+
+        stack_name = self._get_stack_name(event['detail']['stack-id'])
+        status = event['detail']['status-details']['status']
+
+        if not stack_name.startswith(STACK_NAME_PREFIX) or stack_status_is_inprogress(status):
+            return
+
+        task_token = self._get_task_token(stack_name)
+
+        if not task_token:
+            LOGGER.info(f'Nothing waiting on {stack_name} ({status})')
+            return
+
+        self._complete(stack_name, status, task_token)
+
+    def _complete(self, stack_name: str, status: str, task_token: str):
+        """Send the stack status to the waiting task"""
+
+        LOGGER.info(f'Stack {stack_name} settled in {status}')
+
+        output = get_stack_status_output(stack_name, status)
+
+        if stack_status_is_delete(status):
+            # Stack cant be recovered from this status, must delete
+            try:
+                get_spoke_client(self.target_account_id, 'cloudformation').delete_stack(StackName=stack_name)
+            except Exception as err:
+                # Not going to raise here, but it will be published later
+                output['stackErrors'][0]['DeleteError'] = str(err)
+
+        try:
+            if output['hasError']:
+                CLIENT_STATES.send_task_failure(taskToken=task_token, error=STACK_FAILED_ERROR,
+                                                cause=json.dumps(output))
+            else:
+                CLIENT_STATES.send_task_success(taskToken=task_token, output=json.dumps(output))
+
+        except ClientError as err:
+            # The event and the check after registering can both complete the token,
+            # or the wait already timed out and fell back to polling
+            if err.response['Error']['Code'] not in ['TaskTimedOut', 'InvalidToken', 'TaskDoesNotExist']:
+                raise err
+
+            LOGGER.info(f'Task token for {stack_name} already completed: {err}')
+
+        s3_delete_object(session=SESSION, bucket=PRIVATE_ASSETS_BUCKET,
+                         key=self._get_key(stack_name))
+
+    def _get_task_token(self, stack_name: str) -> Optional[str]:
+        """Get the task token waiting on the stack"""
+
+        content = s3_get_object(session=SESSION, bucket=PRIVATE_ASSETS_BUCKET,
+                                key=self._get_key(stack_name))
+
+        return json.loads(content)['taskToken'] if content else None
+
+    def _get_stack_status(self, stack_name: str) -> str:
+        """Get the status of the stack"""
+
+        try:
+            response = get_spoke_client(self.target_account_id, 'cloudformation').describe_stacks(
+                StackName=stack_name)
+
+            return response['Stacks'][0]['StackStatus']
+
+        except ClientError as err:
+            if 'does not exist' in err.response['Error']['Message']:
+                return 'DELETE_COMPLETE'
+
+            raise err
+
+    def _get_key(self, stack_name: str) -> str:
+        """S3 key of the task token for the stack"""
+
+        return f'task-tokens/{self.target_account_id}/{REGION}/{stack_name}.json'
+
+    @staticmethod
+    def _get_stack_name(stack_id: str) -> str:
+        """Stack name from the stack id, arn:aws:cloudformation:region:account:stack/name/guid"""
+
+        return stack_id.split(':stack/', 1)[-1].split('/')[0]
@@ -0,0 +1,39 @@
+"""
+Wrap lambda handler and call main app
+"""
+
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+
+from app import StackCallback
+
+
+def run_app(evt=None, ctx=None):
+    """Parse event and run main app"""
+
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
+    if evt.get('detail-type') == 'CloudFormation Stack Status Change':
+        # Stack status event forwarded from the spoke, account is on the event
+        StackCallback(target_account_id=evt['account']).on_stack_event(evt)
+        # Nothing is returned to the spoke event bus, totals are only logged
+        API_CALL_RECORDER.add_totals(None, 'StackCallback')
+        return None
+
+    # Builder is waiting on the stack, get target account from event
+    target_account_id = evt['targetAccountId']
+
+    StackCallback(target_account_id=target_account_id).register(
+        stack_status=evt['stackStatus'], task_token=evt['taskToken'])
+
+    API_CALL_RECORDER.add_totals(None, 'StackCallback')
+
+    return None
+
+
+def lambda_handler(event, context):
+    """Lambda handler"""
+    try:
+        return run_app(event, context)
+    except Exception as err:
+        raise err
@@ -5,6 +5,17 @@ Identify stacks that have been orphaned. A stack is orphaned when
 the owner for a stack no longer exists on any resource. We will
 delete the stack because it will never have any more updates.
 
+Alarm and dashboard shards are tagged with the owner like any other stack, so every
+shard of an orphaned owner is deleted with it. Shards an owner still has
+but no longer needs are left to CreateStacks, which knows the shard count.
+
+Alarm stacks partitioned by service are orphaned at (owner, service)
+granularity, an owner that no longer has resources of the service loses
+that services stacks and keeps the rest.
+
+The stack listing is timed as the listStacks phase, with the stacks found
+and orphaned, emitted as EMF metrics.
+
 Output:
 List of objects containing orphaned stacks details
 """
@@ -12,36 +23,35 @@ List of objects containing orphaned stacks details
 import boto3
 from cloudwedge.models import AWSService
 from cloudwedge.utils.logger import get_logger
-from cloudwedge.utils.sts import get_spoke_session
+from cloudwedge.utils.metrics import Metrics
+from cloudwedge.utils.stacks import parse_stack_name
+from cloudwedge.utils.sts import get_spoke_client
 
 LOGGER = get_logger('TriageStacks')
 
 
-# Setup boto3 session
-SESSION = None
-CLIENT_FORMATION = None
-
-
 class TriageStacks():
     def __init__(self, target_account_id=None, event=None):
         # Set up event
         self.target_account_id = target_account_id
         self.owner_resources = event['ownerResources']
         self.has_orphaned_stacks = False
+        self.client_formation = None
+        # Phase timings and counts for the run
+        self.metrics = Metrics('TriageStacks', account=target_account_id)
 
 
     def run(self):
         """Run"""
 
-        global SESSION
-        global CLIENT_FORMATION
-
-        if not SESSION:
-            SESSION = get_spoke_session(self.target_account_id)
-
+        try:
+            return self._run()
+        finally:
+            self.metrics.flush()
 
-        if not CLIENT_FORMATION:
-            CLIENT_FORMATION = SESSION.client('cloudformation')
+    def _run(self):
+        # Client for this spoke account, pooled across warm invocations
+        self.client_formation = get_spoke_client(self.target_account_id, 'cloudformation')
 
         output = {
             "orphanedStacks": [],
@@ -50,7 +60,8 @@ class TriageStacks():
         }
 
         # Get list of stacks grouped by owner
-        stacks_grouped_by_owner = self._get_stacks_by_owner()
+        with self.metrics.phase('listStacks'):
+            stacks_grouped_by_owner = self._get_stacks_by_owner()
         stack_owners = list(stacks_grouped_by_owner.keys())
 
         # Check for no stacks condition
@@ -70,6 +81,10 @@ class TriageStacks():
             "hasOrphanedStacks": bool(orphaned_stacks)
         }
 
+        self.metrics.count('Stacks', sum(len(stacks) for stacks in stacks_grouped_by_owner.values()),
+                           phase='listStacks')
+        self.metrics.count('OrphanedStacks', len(orphaned_stacks), phase='listStacks')
+
         LOGGER.info(f'Returning output: {output}')
         return output
 
@@ -80,7 +95,7 @@ class TriageStacks():
         stacks = {}
 
         try:
-            paginator = CLIENT_FORMATION.get_paginator(
+            paginator = self.client_formation.get_paginator(
                 'describe_stacks').paginate()
 
             for page_instances in paginator:
@@ -96,10 +111,16 @@ class TriageStacks():
                         owner_tag = next(
                             (tag for tag in stack['Tags'] if tag['Key'] == AWSService.TAG_OWNER), {})
 
+                        # Fallback to the owner in the stack name, shards included
+                        parsed_stack_name = parse_stack_name(stack['StackName'])
+
                         if owner_tag:
                             # Has an owner, put stack on owner key for tracking
                             stacks.setdefault(
                                 owner_tag['Value'].lower(), []).append(stack)
+                        elif parsed_stack_name:
+                            stacks.setdefault(
+                                parsed_stack_name['owner'].lower(), []).append(stack)
                         else:
                             stacks.setdefault(AWSService.DEFAULT_OWNER, []).append(stack)
 
@@ -112,7 +133,8 @@ class TriageStacks():
         """
         Get orphaned stacks by comparing the current stack owners to the
         owners of the current resources. Any stack that doesnt have the same
-        owner on a resource is orphaned.
+        owner on a resource is orphaned, as is a service partitioned stack
+        whose owner has no resources of that service.
         """
         orphaned_stacks = []
 
@@ -140,7 +162,36 @@ class TriageStacks():
 
                     orphaned_stacks.append(orphaned_stack_details)
 
-        else:
+        # Service partitions of the owners that are left
+        for owner in stack_owners:
+            if owner in orphaned_stack_owners:
+                continue
+
+            for owner_stack in stacks[owner]:
+                service_name = self._get_stack_service(owner_stack)
+
+                if service_name and not self.owner_resources[owner].get(service_name):
+                    LOGGER.info(f"Stack {owner_stack['StackName']} orphaned, {owner} has no {service_name} resources")
+                    orphaned_stacks.append({
+                        'stackOwner': owner,
+                        'stackName': owner_stack['StackName']
+                    })
+
+        if not orphaned_stacks:
             LOGGER.info(f'No stacks need to be deleted.')
 
         return orphaned_stacks
+
+    @staticmethod
+    def _get_stack_service(stack):
+        """Service the stack is partitioned by, from its tag or else its name, None for owner stacks"""
+
+        service_tag = next(
+            (tag for tag in stack['Tags'] if tag['Key'] == AWSService.TAG_STACK_SERVICE_KEY), {})
+
+        if service_tag:
+            return service_tag['Value']
+
+        parsed_stack_name = parse_stack_name(stack['StackName'])
+
+        return parsed_stack_name['service'] if parsed_stack_name else None
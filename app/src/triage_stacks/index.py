@@ -2,18 +2,28 @@
 Wrap lambda handler and call main app
 """
 
+from cloudwedge.utils.api_calls import API_CALL_RECORDER
+from cloudwedge.utils.claim_check import check_out
+from cloudwedge.utils.sts import get_spoke_session
+
 from app import TriageStacks
 
 
 def run_app(evt=None, ctx=None):
     """Parse event and run main app"""
 
+    # Count only this runs api calls, a warm container has served others
+    API_CALL_RECORDER.reset()
+
     # Get target account from event
     target_account_id = evt['targetAccountId']
 
+    # Resolve any fields passed by reference
+    evt = check_out(get_spoke_session(target_account_id), evt)
+
     resources = TriageStacks(target_account_id=target_account_id, event=evt).run()
 
-    return resources
+    return API_CALL_RECORDER.add_totals(resources, 'TriageStacks')
 
 
 def lambda_handler(event, context):
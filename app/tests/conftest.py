@@ -0,0 +1,61 @@
+"""
+Shared setup for the handler tests
+
+Handlers are packaged as a directory each, importing their siblings and the
+cloudwedge layer by bare name. Both are put on the path here the same way
+the lambda runtime does. Every handler has an app.py, load_handler_app
+imports one under a name of its own so handlers dont shadow each other.
+"""
+
+import importlib.util
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'src')
+
+# Handler config read at import, nothing here reaches aws
+TEST_ENVIRONMENT = {
+    'REGION': 'us-west-2',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+    'ENVIRONMENT': 'test',
+    'PRIVATE_ASSETS_BUCKET': 'cloudwedge-test-private',
+    'PUBLIC_ASSETS_BUCKET': 'cloudwedge-test-public',
+    'ALARM_ACTION_TARGET_TOPIC_ARN': 'arn:aws:sns:us-west-2:123456789012:cloudwedge-test',
+    'METRICS_MODE': 'off'
+}
+
+for key, value in TEST_ENVIRONMENT.items():
+    os.environ.setdefault(key, value)
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def add_handler_path(handler: str):
+    """Let the handlers siblings be imported by bare name"""
+
+    handler_dir = os.path.join(SRC_DIR, handler)
+
+    if handler_dir not in sys.path:
+        sys.path.insert(1, handler_dir)
+
+
+def load_handler_app(handler: str):
+    """Import the handlers app.py as <handler>_app"""
+
+    module_name = f'{handler}_app'
+
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    add_handler_path(handler)
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(SRC_DIR, handler, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
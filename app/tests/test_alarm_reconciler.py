@@ -0,0 +1,150 @@
+import threading
+import time
+
+from conftest import add_handler_path
+
+add_handler_path('create_stacks')
+
+from alarm_reconciler import AlarmReconciler  # noqa: E402
+
+
+class FakeCloudwatch():
+    """Cloudwatch client keeping the alarms in memory"""
+
+    def __init__(self, alarms=None, put_seconds=0.0):
+        self.alarms = {alarm['AlarmName']: alarm for alarm in alarms or []}
+        self.put_seconds = put_seconds
+        self.puts = []
+        self.deletes = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get_paginator(self, operation):
+        assert operation == 'describe_alarms'
+
+        return self
+
+    def paginate(self, **kwargs):
+        yield {'MetricAlarms': list(self.alarms.values())}
+
+    def put_metric_alarm(self, **request):
+        with self._lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+
+        time.sleep(self.put_seconds)
+
+        with self._lock:
+            self.in_flight -= 1
+            self.puts.append(request['AlarmName'])
+            self.alarms[request['AlarmName']] = request
+
+    def delete_alarms(self, AlarmNames):
+        self.deletes.extend(AlarmNames)
+
+        for alarm_name in AlarmNames:
+            self.alarms.pop(alarm_name, None)
+
+
+def make_alarm(name, owner='team', threshold=1):
+    return {
+        'AlarmName': f'cloudwedge-autogen-{name}',
+        'AlarmDescription': f'Owner={owner} Service=sqs',
+        'AlarmActions': ['arn:aws:sns:us-west-2:123456789012:cloudwedge-test'],
+        'Namespace': 'AWS/SQS',
+        'MetricName': 'ApproximateAgeOfOldestMessage',
+        'Dimensions': [{'Name': 'QueueName', 'Value': name}],
+        'Statistic': 'Maximum',
+        'Period': '60',
+        'EvaluationPeriods': '1',
+        'Threshold': str(threshold),
+        'ComparisonOperator': 'GreaterThanThreshold',
+        'TreatMissingData': 'notBreaching'
+    }
+
+
+def existing_alarm(name, owner='team', threshold=1):
+    return AlarmReconciler._get_alarm_request(make_alarm(name, owner, threshold))
+
+
+def test_only_the_difference_is_applied():
+    cloudwatch = FakeCloudwatch([existing_alarm('same'), existing_alarm('drifted', threshold=5),
+                                 existing_alarm('unwanted')])
+
+    result = AlarmReconciler(cloudwatch, rate=0).run(
+        [make_alarm('same'), make_alarm('drifted'), make_alarm('new')], owners=['team'])
+
+    assert sorted(cloudwatch.puts) == ['cloudwedge-autogen-drifted', 'cloudwedge-autogen-new']
+    assert cloudwatch.deletes == ['cloudwedge-autogen-unwanted']
+    assert result == {'put': 2, 'deleted': 1, 'unchanged': 1, 'pendingPut': 0, 'pendingDelete': 0}
+
+
+def test_other_and_skipped_owners_are_left_alone():
+    cloudwatch = FakeCloudwatch([existing_alarm('other', owner='other'), existing_alarm('stacked', owner='stacked')])
+
+    result = AlarmReconciler(cloudwatch, rate=0).run(
+        [make_alarm('stacked-new', owner='stacked')], owners=['team', 'stacked'], skip_owners=['stacked'])
+
+    assert cloudwatch.puts == []
+    assert cloudwatch.deletes == []
+    assert result['put'] == 0
+
+
+def test_owners_are_matched_whatever_the_tag_case():
+    cloudwatch = FakeCloudwatch([existing_alarm('stacked', owner='TeamA'), existing_alarm('removed', owner='TeamB')])
+
+    # Full reconcile, TeamA is still on its alarm stack
+    full = AlarmReconciler(cloudwatch, rate=0).run([], skip_owners=['teama'])
+
+    assert cloudwatch.deletes == ['cloudwedge-autogen-removed']
+    assert full['deleted'] == 1
+
+    # Incremental run for the owner, its removed alarm is deleted
+    cloudwatch = FakeCloudwatch([existing_alarm('removed', owner='TeamA'), existing_alarm('other', owner='TeamB')])
+
+    AlarmReconciler(cloudwatch, rate=0).run([], owners=['teama'])
+
+    assert cloudwatch.deletes == ['cloudwedge-autogen-removed']
+
+
+def test_puts_overlap_on_the_pool():
+    cloudwatch = FakeCloudwatch(put_seconds=0.05)
+
+    result = AlarmReconciler(cloudwatch, rate=0, max_workers=4).run([make_alarm(f'queue-{i}') for i in range(8)])
+
+    assert result['put'] == 8
+    assert 1 < cloudwatch.most_in_flight <= 4
+
+
+def test_puts_share_the_rate():
+    cloudwatch = FakeCloudwatch()
+
+    started = time.monotonic()
+    AlarmReconciler(cloudwatch, rate=50, max_workers=4).run([make_alarm(f'queue-{i}') for i in range(10)])
+
+    # The first put goes straight away, the other nine wait a slot each
+    assert time.monotonic() - started >= 9 / 50 * 0.9
+
+
+def test_deadline_leaves_the_rest_pending():
+    cloudwatch = FakeCloudwatch([existing_alarm('unwanted')])
+
+    result = AlarmReconciler(cloudwatch, rate=20, max_workers=2).run(
+        [make_alarm(f'queue-{i}') for i in range(20)], deadline=time.monotonic() + 0.2)
+
+    assert 0 < result['put'] < 20
+    assert result['put'] + result['pendingPut'] == 20
+    assert result['pendingDelete'] == 1
+    assert len(cloudwatch.puts) == result['put']
+
+
+def test_next_run_picks_up_the_pending_work():
+    cloudwatch = FakeCloudwatch()
+    desired = [make_alarm(f'queue-{i}') for i in range(6)]
+
+    first = AlarmReconciler(cloudwatch, rate=0).run(desired, deadline=time.monotonic())
+    second = AlarmReconciler(cloudwatch, rate=0).run(desired)
+
+    assert first['pendingPut'] == 6
+    assert second == {'put': 6, 'deleted': 0, 'unchanged': 0, 'pendingPut': 0, 'pendingDelete': 0}
@@ -0,0 +1,167 @@
+import pytest
+
+from conftest import add_handler_path, load_handler_app
+
+add_handler_path('create_stacks')
+
+import alarms_factory  # noqa: E402
+from alarms_factory import AlarmsFactory  # noqa: E402
+from template_store import TemplateStore  # noqa: E402
+
+from cloudwedge.utils.stacks import get_alarms_stack_name, get_shard_index  # noqa: E402
+
+
+def make_template(unique_id, alarms=1):
+    return {
+        f'{unique_id}Alarm{index}': {
+            'Type': 'AWS::CloudWatch::Alarm',
+            'Properties': {'AlarmName': f'cloudwedge-autogen-sqs-team-high-Metric{index}-{unique_id}'}
+        }
+        for index in range(alarms)
+    }
+
+
+def make_factory(resource_templates, deployed_digests=None):
+    """Factory building the given (service, uniqueId, template) alarms"""
+
+    factory = AlarmsFactory(None, 'team', {}, deployed_digests=deployed_digests)
+    factory._build_resource_templates = lambda: resource_templates
+
+    return factory
+
+
+@pytest.fixture(autouse=True)
+def saved_templates(monkeypatch):
+    saved = []
+    monkeypatch.setattr(TemplateStore, 'save', lambda **kwargs: saved.append(kwargs) or f"key/{kwargs['stack_name']}")
+
+    return saved
+
+
+@pytest.mark.parametrize('resources, max_resources, expected_shards', [
+    (10, 500, 1),
+    (10, 10, 1),
+    (11, 10, 2),
+    (35, 10, 8),
+])
+def test_shard_count_doubles_until_it_fits(monkeypatch, resources, max_resources, expected_shards):
+    monkeypatch.setattr(alarms_factory, 'ALARM_STACK_MAX_RESOURCES', max_resources)
+
+    resource_templates = [(f'resource-{index}', make_template(f'resource-{index}')) for index in range(resources)]
+    unique_ids = {id(resource_template): unique_id for unique_id, resource_template in resource_templates}
+
+    shards = make_factory([])._get_shards(resource_templates)
+
+    assert len(shards) == expected_shards
+    assert all(len(shard) <= max_resources for shard in shards)
+    assert sum(len(shard) for shard in shards) == resources
+
+    for shard, shard_templates in enumerate(shards):
+        for resource_template in shard_templates:
+            assert get_shard_index(unique_ids[id(resource_template)], len(shards)) == shard
+
+
+def test_shard_count_stops_at_max_shards(monkeypatch):
+    monkeypatch.setattr(alarms_factory, 'ALARM_STACK_MAX_RESOURCES', 1)
+    monkeypatch.setattr(alarms_factory, 'ALARM_STACK_MAX_SHARDS', 4)
+
+    resource_templates = [(f'resource-{index}', make_template(f'resource-{index}')) for index in range(20)]
+
+    assert len(make_factory([])._get_shards(resource_templates)) == 4
+
+
+def test_shard_zero_is_built_without_alarms():
+    factory = make_factory([])
+    factory.build()
+
+    assert [stack['stackName'] for stack in factory.stacks] == [get_alarms_stack_name('team')]
+    assert factory.stacks[0]['template']['Resources'] == {}
+
+
+def test_empty_shards_are_not_built(monkeypatch):
+    monkeypatch.setattr(alarms_factory, 'ALARM_STACK_MAX_RESOURCES', 2)
+
+    # Two resources in shard 0 of 4 and one in shard 2, shards 1 and 3 are left empty
+    unique_ids = [f'resource-{index}' for index in range(100)]
+    unique_ids = ([unique_id for unique_id in unique_ids if get_shard_index(unique_id, 4) == 0][:2] +
+                  [unique_id for unique_id in unique_ids if get_shard_index(unique_id, 4) == 2][:1])
+
+    factory = make_factory([('sqs', unique_id, make_template(unique_id)) for unique_id in unique_ids])
+    factory.build()
+
+    assert [stack['stackName'] for stack in factory.stacks] == [
+        get_alarms_stack_name('team'), get_alarms_stack_name('team', 2)
+    ]
+
+
+def test_alarm_names_outside_shard_zero_get_the_shard():
+    resource_template = make_template('queue')
+
+    assert AlarmsFactory._get_shard_alarms('', resource_template) == resource_template
+    assert next(iter(AlarmsFactory._get_shard_alarms('-3', resource_template).values()))['Properties'][
+        'AlarmName'] == 'cloudwedge-autogen-sqs-team-high-Metric0-queue-3'
+
+
+def test_partition_by_service(monkeypatch):
+    monkeypatch.setattr(alarms_factory, 'ALARM_STACK_PARTITION', alarms_factory.ALARM_STACK_PARTITION_SERVICE)
+
+    factory = make_factory([
+        ('sqs', 'queue-1', make_template('queue-1')),
+        ('ec2', 'instance-1', make_template('instance-1')),
+        ('sqs', 'queue-2', make_template('queue-2')),
+    ])
+    factory.build()
+
+    details = factory.get_stacks_details()
+
+    assert [(stack['stackName'], stack['stackService']) for stack in details] == [
+        (get_alarms_stack_name('team', 0, 'sqs'), 'sqs'),
+        (get_alarms_stack_name('team', 0, 'ec2'), 'ec2'),
+    ]
+
+    sqs_alarm_names = sorted(alarm['Properties']['AlarmName']
+                             for alarm in factory.stacks[0]['template']['Resources'].values())
+
+    assert sqs_alarm_names == ['cloudwedge-autogen-sqs-team-high-Metric0-queue-1-sqs',
+                               'cloudwedge-autogen-sqs-team-high-Metric0-queue-2-sqs']
+
+
+def test_unchanged_template_is_not_saved(saved_templates):
+    first = make_factory([('sqs', 'queue', make_template('queue'))])
+    first.build()
+
+    assert len(saved_templates) == 1
+    assert first.stacks[0]['unchanged'] is False
+
+    deployed_digests = {first.stacks[0]['stackName']: first.stacks[0]['templateDigest']}
+    second = make_factory([('sqs', 'queue', make_template('queue'))], deployed_digests=deployed_digests)
+    second.build()
+
+    assert len(saved_templates) == 1
+    assert second.stacks[0]['unchanged'] is True
+    assert second.stacks[0]['s3TemplateKey'] is None
+
+
+@pytest.mark.parametrize('deployed, built, expected_stale', [
+    # Nothing deployed
+    ([], ['cloudwedge-autogen-team-alarms-stack'], []),
+    # Shards the owner no longer needs
+    (['cloudwedge-autogen-team-alarms-stack', 'cloudwedge-autogen-team-alarms-1-stack',
+      'cloudwedge-autogen-team-dashboard-2-stack'],
+     ['cloudwedge-autogen-team-alarms-stack', 'cloudwedge-autogen-team-dashboard-stack'],
+     ['cloudwedge-autogen-team-alarms-1-stack', 'cloudwedge-autogen-team-dashboard-2-stack']),
+    # Other owners, owners that start with the same name and stacks that arent ours are left alone
+    (['cloudwedge-autogen-other-alarms-1-stack', 'cloudwedge-autogen-team-b-alarms-1-stack', 'team-alarms-1-stack'],
+     ['cloudwedge-autogen-team-alarms-stack'], []),
+    # Moving to service partitions retires the owner stack
+    (['cloudwedge-autogen-team-alarms-stack'],
+     ['cloudwedge-autogen-team-alarms-sqs-stack'], ['cloudwedge-autogen-team-alarms-stack']),
+])
+def test_stale_stacks(deployed, built, expected_stale):
+    create_stacks = load_handler_app('create_stacks').CreateStacks('123456789012')
+    create_stacks.deployed_stacks = {stack_name: 'digest' for stack_name in deployed}
+
+    stale_stacks = create_stacks._get_stale_stacks('team', [{'stackName': stack_name} for stack_name in built])
+
+    assert [stack['stackName'] for stack in stale_stacks] == expected_stale
+    assert all(stack['stackOwner'] == 'team' for stack in stale_stacks)
@@ -0,0 +1,151 @@
+import pytest
+
+from conftest import add_handler_path
+
+add_handler_path('ingest_alert')
+
+from alert_suppressor import AlertSuppressor, LocalSuppressionStore  # noqa: E402
+
+WINDOW_SECONDS = 300
+# Start of a window, far from its end
+NOW = WINDOW_SECONDS * 1000.0
+
+
+def make_alert(resource, owner='team', state='ALARM', level='high', metric='CPUUtilization'):
+    return {
+        'level': level,
+        'owner': owner,
+        'metric': metric,
+        'state': state,
+        'resourceName': resource,
+        'snsSubject': f'{level} {metric} {state} on {resource}'
+    }
+
+
+def make_batch(resources, **kwargs):
+    return [(f'record-{resource}', make_alert(resource, **kwargs)) for resource in resources]
+
+
+@pytest.fixture
+def suppressor():
+    return AlertSuppressor(LocalSuppressionStore(), window_seconds=WINDOW_SECONDS, burst_threshold=3)
+
+
+def get_count(suppressor, kind, window_offset=0, owner='team', state='ALARM'):
+    window = int(NOW // WINDOW_SECONDS) + window_offset
+
+    return suppressor.store.get_count(suppressor._get_count_key(kind, owner, state, window))
+
+
+def test_duplicates_are_dropped(suppressor):
+    sent = suppressor.suppress(make_batch(['web-1', 'web-1', 'web-2']), now=NOW)
+    sent_again = suppressor.suppress(make_batch(['web-2']), now=NOW)
+
+    assert [record_ids for record_ids, _ in sent] == [['record-web-1'], ['record-web-2']]
+    assert sent_again == []
+    assert get_count(suppressor, 'duplicates') == 2
+
+
+def test_same_alert_in_the_next_window_is_sent(suppressor):
+    suppressor.suppress(make_batch(['web-1']), now=NOW)
+
+    assert len(suppressor.suppress(make_batch(['web-1']), now=NOW + WINDOW_SECONDS)) == 1
+
+
+def test_alerts_past_the_burst_threshold_are_folded(suppressor):
+    sent = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3', 'web-4', 'web-5']), now=NOW)
+
+    assert [record_ids for record_ids, _ in sent] == [
+        ['record-web-1'], ['record-web-2'], ['record-web-3'], ['record-web-4', 'record-web-5']
+    ]
+
+    storm = sent[-1][1]
+
+    assert storm['type'] == 'storm'
+    assert storm['resourceName'] == 'web-4,web-5'
+    assert [alert['resourceName'] for alert in storm['alerts']] == ['web-4', 'web-5']
+    assert get_count(suppressor, 'folded') == 2
+
+
+def test_burst_is_counted_per_owner_and_state(suppressor):
+    sent = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3']) +
+                               make_batch(['db-1'], owner='data') +
+                               make_batch(['web-1'], state='OK'), now=NOW)
+
+    assert all('type' not in step_input for _, step_input in sent)
+    assert len(sent) == 5
+
+
+def test_storm_level_is_the_most_urgent(suppressor):
+    suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3']), now=NOW)
+
+    sent = suppressor.suppress(make_batch(['web-4'], level='low') + make_batch(['web-5'], level='critical'), now=NOW)
+
+    assert sent[0][1]['level'] == 'critical'
+
+
+def test_storm_is_notified_once_per_window(suppressor):
+    first = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3', 'web-4']), now=NOW)
+    second = suppressor.suppress(make_batch(['web-5', 'web-6']), now=NOW)
+    third = suppressor.suppress(make_batch(['web-7']), now=NOW)
+
+    assert first[-1][1]['type'] == 'storm'
+    # Folded into the storm already notified, only counted
+    assert second == []
+    assert third == []
+    assert get_count(suppressor, 'burst') == 7
+    assert get_count(suppressor, 'folded') == 4
+
+
+def test_storm_reports_the_previous_window(suppressor):
+    suppressor.suppress(make_batch(['web-1', 'web-1', 'web-2', 'web-3', 'web-4', 'web-5']), now=NOW)
+
+    sent = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3', 'web-4']), now=NOW + WINDOW_SECONDS)
+    storm = sent[-1][1]
+
+    assert storm['suppressedCounts'] == {'duplicates': 1, 'folded': 2}
+    assert 'Previous window: 2 alarms folded, 1 duplicates dropped' in storm['snsMessage']['email']
+
+
+def test_first_storm_has_no_previous_window(suppressor):
+    storm = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3', 'web-4']), now=NOW)[-1][1]
+
+    assert storm['suppressedCounts'] == {'duplicates': 0, 'folded': 0}
+    assert 'Previous window' not in storm['snsMessage']['email']
+
+
+def test_released_alert_is_sent_on_retry(suppressor):
+    batch = make_batch(['web-1'])
+
+    [(_, step_input)] = suppressor.suppress(batch, now=NOW)
+    suppressor.release(step_input, now=NOW)
+
+    assert [record_ids for record_ids, _ in suppressor.suppress(batch, now=NOW)] == [['record-web-1']]
+    assert get_count(suppressor, 'burst') == 1
+    assert get_count(suppressor, 'duplicates') == 0
+
+
+def test_released_storm_is_sent_on_retry(suppressor):
+    sent = suppressor.suppress(make_batch(['web-1', 'web-2', 'web-3', 'web-4', 'web-5']), now=NOW)
+    storm_record_ids, storm = sent[-1]
+
+    suppressor.release(storm, now=NOW)
+
+    assert get_count(suppressor, 'burst') == 3
+    assert get_count(suppressor, 'folded') == 0
+
+    # Only the records of the failed storm come back
+    retried = suppressor.suppress(make_batch(['web-4', 'web-5']), now=NOW)
+
+    assert [record_ids for record_ids, _ in retried] == [storm_record_ids]
+    assert retried[0][1]['type'] == 'storm'
+    assert get_count(suppressor, 'burst') == 5
+    assert get_count(suppressor, 'folded') == 2
+    assert get_count(suppressor, 'duplicates') == 0
+
+
+def test_nothing_is_suppressed_without_a_window():
+    suppressor = AlertSuppressor(LocalSuppressionStore(), window_seconds=0, burst_threshold=1)
+    batch = make_batch(['web-1', 'web-1', 'web-2'])
+
+    assert suppressor.suppress(batch, now=NOW) == [([record_id], step_input) for record_id, step_input in batch]
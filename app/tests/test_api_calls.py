@@ -0,0 +1,105 @@
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
+
+from cloudwedge.utils.api_calls import ApiCallRecorder
+
+TABLE = 'cloudwedge-test'
+KEY = {'accountId': {'S': '123456789012'}}
+
+
+@pytest.fixture
+def recorder():
+    return ApiCallRecorder()
+
+
+@pytest.fixture
+def client(recorder):
+    session = boto3.session.Session()
+    recorder.attach(session)
+
+    return session.client('dynamodb')
+
+
+def get_item(client):
+    return client.get_item(TableName=TABLE, Key=KEY)
+
+
+def test_calls_are_counted_per_operation(recorder, client):
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {})
+        stubber.add_response('get_item', {})
+        stubber.add_response('delete_item', {})
+
+        get_item(client)
+        get_item(client)
+        client.delete_item(TableName=TABLE, Key=KEY)
+
+    totals = recorder.get_totals()
+
+    assert totals['calls'] == 3
+    assert list(totals['operations']) == ['dynamodb.DeleteItem', 'dynamodb.GetItem']
+    assert totals['operations']['dynamodb.GetItem']['calls'] == 2
+    assert totals['operations']['dynamodb.GetItem']['latencyMs'] >= 0
+
+
+def test_retries_and_errors_are_counted(recorder, client):
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {'ResponseMetadata': {'RetryAttempts': 2}})
+        stubber.add_client_error('get_item', service_error_code='ResourceNotFoundException',
+                                 response_meta={'RetryAttempts': 1})
+
+        get_item(client)
+
+        with pytest.raises(client.exceptions.ResourceNotFoundException):
+            get_item(client)
+
+    totals = recorder.get_totals()
+
+    assert (totals['calls'], totals['retries'], totals['errors']) == (2, 3, 1)
+
+
+def test_throttled_attempts_are_counted(recorder, client):
+    operation = client.meta.service_model.operation_model('GetItem')
+
+    # The endpoint emits this after every attempt, the stubber answers before any attempt is made
+    for code in ['ProvisionedThroughputExceededException', 'ValidationException']:
+        http_response = AWSResponse('https://dynamodb', 400, {}, None)
+
+        client.meta.events.emit('needs-retry.dynamodb.GetItem', operation=operation, attempts=1, caught_exception=None,
+                                request_dict={'context': {}}, response=(http_response, {'Error': {'Code': code}}))
+
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {'ResponseMetadata': {'RetryAttempts': 1}})
+        get_item(client)
+
+    stats = recorder.get_totals()['operations']['dynamodb.GetItem']
+
+    assert (stats['calls'], stats['retries'], stats['throttles'], stats['errors']) == (1, 1, 1, 0)
+
+
+def test_reset_starts_a_new_run(recorder, client):
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {})
+        get_item(client)
+
+    recorder.reset()
+
+    assert recorder.get_totals() == {
+        'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0, 'latencyMs': 0, 'operations': {}
+    }
+
+
+def test_add_totals(recorder, client):
+    with Stubber(client) as stubber:
+        stubber.add_response('get_item', {})
+        get_item(client)
+
+    assert recorder.add_totals({'stackName': 'stack'}, 'CreateStacks')['apiCalls']['operations'][
+        'dynamodb.GetItem']['calls'] == 1
+    # Map iterations only carry the count
+    assert recorder.add_totals({'stackName': 'stack'}, 'DeployStack', operations=False) == {
+        'stackName': 'stack', 'apiCalls': 1
+    }
+    assert recorder.add_totals(None, 'StackCallback') is None
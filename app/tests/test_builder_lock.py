@@ -0,0 +1,230 @@
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+
+from conftest import load_handler_app
+
+builder_lock_app = load_handler_app('builder_lock')
+BuilderLock = builder_lock_app.BuilderLock
+
+ACCOUNT = '123456789012'
+TABLE = 'cloudwedge-test-builder-lock'
+NOW = 1700000000
+LEASE_SECONDS = builder_lock_app.BUILDER_LOCK_LEASE_SECONDS
+KEY = {'accountId': {'S': ACCOUNT}}
+
+
+def make_event(arns=None, mode=None):
+    event = {'account': ACCOUNT, 'detail-type': 'Tag Change on Resource', 'resources': arns or []}
+
+    if mode:
+        event['mode'] = mode
+
+    return event
+
+
+@pytest.fixture
+def stubber(monkeypatch):
+    client = boto3.client('dynamodb')
+    monkeypatch.setattr(builder_lock_app, 'CLIENT_DYNAMODB', client)
+    monkeypatch.setattr(builder_lock_app.time, 'time', lambda: NOW)
+
+    with Stubber(client) as stubber:
+        yield stubber
+
+    stubber.assert_no_pending_responses()
+
+
+def make_lock(execution_id='run-1'):
+    return BuilderLock(ACCOUNT, execution_id, table=TABLE)
+
+
+def add_acquire(stubber, old_attributes=None, execution_id='run-1'):
+    stubber.add_response('update_item', {'Attributes': old_attributes or {}}, {
+        'TableName': TABLE,
+        'Key': KEY,
+        'UpdateExpression': 'SET holder = :holder, leaseExpiresAt = :expires '
+                            'REMOVE dirty, pendingResources, pendingFull',
+        'ConditionExpression': 'attribute_not_exists(holder) OR leaseExpiresAt < :now OR holder = :holder',
+        'ExpressionAttributeValues': {
+            ':holder': {'S': execution_id},
+            ':expires': {'N': str(NOW + LEASE_SECONDS)},
+            ':now': {'N': str(NOW)}
+        },
+        'ReturnValues': 'ALL_OLD'
+    })
+
+
+def add_condition_failed(stubber, operation):
+    stubber.add_client_error(operation, service_error_code='ConditionalCheckFailedException')
+
+
+def add_mark_dirty(stubber, update_expression, values):
+    stubber.add_response('update_item', {}, {
+        'TableName': TABLE,
+        'Key': KEY,
+        'UpdateExpression': update_expression,
+        'ConditionExpression': 'attribute_exists(holder) AND leaseExpiresAt >= :now',
+        'ExpressionAttributeValues': {':dirty': {'BOOL': True}, ':now': {'N': str(NOW)}, **values}
+    })
+
+
+def test_free_lock_is_acquired(stubber):
+    add_acquire(stubber)
+
+    assert make_lock().acquire(make_event(['arn:1'])) == {**make_event(['arn:1']), 'builderLock': {'acquired': True}}
+
+
+def test_held_lock_is_marked_dirty_with_the_arns(stubber):
+    add_condition_failed(stubber, 'update_item')
+    add_mark_dirty(stubber, 'SET dirty = :dirty ADD pendingResources :arns', {':arns': {'SS': ['arn:1', 'arn:2']}})
+
+    result = make_lock('run-2').acquire(make_event(['arn:1', 'arn:2']))
+
+    assert result['builderLock'] == {'acquired': False}
+
+
+def test_held_lock_is_marked_for_a_full_sweep(stubber):
+    add_condition_failed(stubber, 'update_item')
+    add_mark_dirty(stubber, 'SET dirty = :dirty, pendingFull = :dirty', {})
+
+    assert make_lock('run-2').acquire(make_event(mode='full'))['builderLock'] == {'acquired': False}
+
+
+def test_lock_let_go_while_marking_is_taken_again(stubber):
+    add_condition_failed(stubber, 'update_item')
+    # Expired or deleted before the mark landed
+    add_condition_failed(stubber, 'update_item')
+    add_acquire(stubber, execution_id='run-2')
+
+    assert make_lock('run-2').acquire(make_event(['arn:1']))['builderLock'] == {'acquired': True}
+
+
+def test_lock_that_keeps_changing_hands_gives_up(stubber):
+    for _ in range(builder_lock_app.MAX_LOCK_ATTEMPTS):
+        add_condition_failed(stubber, 'update_item')
+        add_condition_failed(stubber, 'update_item')
+
+    with pytest.raises(builder_lock_app.BuilderLockContentionError):
+        make_lock('run-2').acquire(make_event(['arn:1']))
+
+
+def test_expired_lease_is_taken_with_the_changes_it_left(stubber):
+    # The dead run held it, was marked dirty and never released
+    add_acquire(stubber, old_attributes={
+        'accountId': {'S': ACCOUNT},
+        'holder': {'S': 'run-dead'},
+        'leaseExpiresAt': {'N': str(NOW - 1)},
+        'dirty': {'BOOL': True},
+        'pendingResources': {'SS': ['arn:2', 'arn:3']}
+    }, execution_id='run-2')
+
+    result = make_lock('run-2').acquire(make_event(['arn:1', 'arn:2']))
+
+    assert result['resources'] == ['arn:1', 'arn:2', 'arn:3']
+    assert result['builderLock'] == {'acquired': True}
+
+
+def test_expired_lease_left_for_a_full_sweep(stubber):
+    add_acquire(stubber, old_attributes={
+        'holder': {'S': 'run-dead'},
+        'dirty': {'BOOL': True},
+        'pendingFull': {'BOOL': True}
+    }, execution_id='run-2')
+
+    assert make_lock('run-2').acquire(make_event(['arn:1']))['mode'] == 'full'
+
+
+def add_release_dirty(stubber, old_attributes):
+    stubber.add_response('update_item', {'Attributes': old_attributes}, {
+        'TableName': TABLE,
+        'Key': KEY,
+        'UpdateExpression': 'SET leaseExpiresAt = :expires REMOVE dirty, pendingResources, pendingFull',
+        'ConditionExpression': 'holder = :holder AND attribute_exists(dirty)',
+        'ExpressionAttributeValues': {':holder': {'S': 'run-1'}, ':expires': {'N': str(NOW + LEASE_SECONDS)}},
+        'ReturnValues': 'ALL_OLD'
+    })
+
+
+def test_release_with_pending_arns_keeps_the_lease_for_a_follow_up(stubber):
+    add_release_dirty(stubber, {
+        'holder': {'S': 'run-1'},
+        'dirty': {'BOOL': True},
+        'pendingResources': {'SS': ['arn:3', 'arn:2']}
+    })
+
+    assert make_lock().release() == {
+        'followUp': True,
+        'event': {
+            'account': ACCOUNT,
+            'detail-type': 'Tag Change on Resource',
+            'resources': ['arn:2', 'arn:3'],
+            'followUp': True
+        }
+    }
+
+
+def test_release_with_a_pending_full_sweep(stubber):
+    add_release_dirty(stubber, {
+        'holder': {'S': 'run-1'},
+        'dirty': {'BOOL': True},
+        'pendingResources': {'SS': ['arn:1']},
+        'pendingFull': {'BOOL': True}
+    })
+
+    assert make_lock().release()['event'] == {'account': ACCOUNT, 'mode': 'full', 'followUp': True}
+
+
+def test_release_without_pending_work_lets_go(stubber):
+    add_condition_failed(stubber, 'update_item')
+    stubber.add_response('delete_item', {}, {
+        'TableName': TABLE,
+        'Key': KEY,
+        'ConditionExpression': 'holder = :holder AND attribute_not_exists(dirty)',
+        'ExpressionAttributeValues': {':holder': {'S': 'run-1'}}
+    })
+
+    assert make_lock().release() == {'followUp': False}
+
+
+def test_release_marked_dirty_between_calls_takes_the_follow_up(stubber):
+    add_condition_failed(stubber, 'update_item')
+    add_condition_failed(stubber, 'delete_item')
+    stubber.add_response('get_item', {'Item': {'holder': {'S': 'run-1'}}}, {
+        'TableName': TABLE, 'Key': KEY, 'ConsistentRead': True
+    })
+    add_release_dirty(stubber, {'holder': {'S': 'run-1'}, 'dirty': {'BOOL': True}, 'pendingFull': {'BOOL': True}})
+
+    assert make_lock().release()['followUp'] is True
+
+
+def test_release_after_the_lease_expired_leaves_the_new_holder_alone(stubber):
+    add_condition_failed(stubber, 'update_item')
+    add_condition_failed(stubber, 'delete_item')
+    stubber.add_response('get_item', {'Item': {'holder': {'S': 'run-2'}}}, {
+        'TableName': TABLE, 'Key': KEY, 'ConsistentRead': True
+    })
+
+    assert make_lock().release() == {'followUp': False}
+
+
+def test_abandon_leaves_the_pending_work(stubber):
+    stubber.add_response('update_item', {}, {
+        'TableName': TABLE,
+        'Key': KEY,
+        'UpdateExpression': 'REMOVE holder, leaseExpiresAt',
+        'ConditionExpression': 'holder = :holder',
+        'ExpressionAttributeValues': {':holder': {'S': 'run-1'}}
+    })
+
+    make_lock().abandon()
+
+
+def test_other_errors_are_raised(stubber):
+    stubber.add_client_error('update_item', service_error_code='ProvisionedThroughputExceededException',
+                             expected_params={'TableName': TABLE, 'Key': KEY, 'UpdateExpression': ANY,
+                                              'ConditionExpression': ANY, 'ExpressionAttributeValues': ANY,
+                                              'ReturnValues': 'ALL_OLD'})
+
+    with pytest.raises(builder_lock_app.ClientError):
+        make_lock().acquire(make_event(['arn:1']))
@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import json
+
+import pytest
+
+from cloudwedge.utils import claim_check
+from cloudwedge.utils.claim_check import (CLAIM_CHECK_KEY, CLAIM_CHECK_THRESHOLD_BYTES, MissingClaimCheckError,
+                                          check_in, check_out, is_claim_check)
+
+ACCOUNT = '123456789012'
+SESSION = object()
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """Objects saved by key, in place of the private assets bucket"""
+
+    objects = {}
+
+    def save_object(session, bucket, key, content=None):
+        assert session is SESSION
+        objects[key] = content
+        return key
+
+    def get_object(session, bucket, key):
+        assert session is SESSION
+        return objects.get(key)
+
+    monkeypatch.setattr(claim_check, 's3_save_object', save_object)
+    monkeypatch.setattr(claim_check, 's3_get_object', get_object)
+
+    return objects
+
+
+def make_payload(size_bytes):
+    owner_resources = {'team': [{'uniqueId': f'queue-{index}', 'service': 'sqs'} for index in range(size_bytes // 40)]}
+
+    return {'targetAccountId': ACCOUNT, 'ownerResources': owner_resources, 'changedOwners': ['team']}
+
+
+def test_small_payload_stays_inline(bucket):
+    payload = make_payload(1024)
+
+    assert len(json.dumps(payload)) < CLAIM_CHECK_THRESHOLD_BYTES
+    assert check_in(SESSION, ACCOUNT, payload, fields=['ownerResources']) is payload
+    assert bucket == {}
+
+
+def test_large_payload_round_trips(bucket):
+    payload = make_payload(CLAIM_CHECK_THRESHOLD_BYTES * 2)
+
+    checked_in = check_in(SESSION, ACCOUNT, payload, fields=['ownerResources', 'missing'])
+
+    assert is_claim_check(checked_in['ownerResources'])
+    # Other fields and fields not on the payload are left as they are
+    assert checked_in['changedOwners'] == ['team']
+    assert 'missing' not in checked_in
+    assert len(json.dumps(checked_in)) < 1024
+
+    assert check_out(SESSION, checked_in) == payload
+
+
+def test_key_is_the_sha256_of_the_content_and_the_object_is_gzipped(bucket):
+    payload = make_payload(CLAIM_CHECK_THRESHOLD_BYTES * 2)
+
+    pointer = check_in(SESSION, ACCOUNT, payload, fields=['ownerResources'])['ownerResources'][CLAIM_CHECK_KEY]
+    content = json.dumps(payload['ownerResources'], separators=(',', ':')).encode('utf-8')
+
+    assert pointer['key'] == f'claim-checks/{ACCOUNT}/{hashlib.sha256(content).hexdigest()}.json.gz'
+    assert pointer['bucket'] == claim_check.PRIVATE_ASSETS_BUCKET
+    assert gzip.decompress(bucket[pointer['key']]) == content
+
+
+def test_same_content_lands_on_the_same_key(bucket):
+    first = check_in(SESSION, ACCOUNT, make_payload(CLAIM_CHECK_THRESHOLD_BYTES * 2), fields=['ownerResources'])
+    second = check_in(SESSION, ACCOUNT, make_payload(CLAIM_CHECK_THRESHOLD_BYTES * 2), fields=['ownerResources'])
+
+    assert first == second
+    assert len(bucket) == 1
+
+
+def test_threshold_is_inclusive(bucket, monkeypatch):
+    payload = make_payload(1024)
+    monkeypatch.setattr(claim_check, 'CLAIM_CHECK_THRESHOLD_BYTES', len(json.dumps(payload)))
+
+    assert check_in(SESSION, ACCOUNT, payload, fields=['ownerResources']) is payload
+
+    monkeypatch.setattr(claim_check, 'CLAIM_CHECK_THRESHOLD_BYTES', len(json.dumps(payload)) - 1)
+
+    assert is_claim_check(check_in(SESSION, ACCOUNT, payload, fields=['ownerResources'])['ownerResources'])
+
+
+@pytest.mark.parametrize('payload', [
+    {'ownerResources': {'team': []}},
+    {'ownerResources': {CLAIM_CHECK_KEY: {'bucket': 'b', 'key': 'k'}, 'team': []}},
+    None,
+    ['not', 'a', 'dict'],
+])
+def test_check_out_leaves_inline_payloads_alone(bucket, payload):
+    assert check_out(SESSION, payload) is payload
+
+
+def test_check_out_of_a_missing_object_fails(bucket):
+    checked_in = check_in(SESSION, ACCOUNT, make_payload(CLAIM_CHECK_THRESHOLD_BYTES * 2), fields=['ownerResources'])
+    bucket.clear()
+
+    with pytest.raises(MissingClaimCheckError, match='claim check for ownerResources is missing'):
+        check_out(SESSION, checked_in)
@@ -0,0 +1,153 @@
+import re
+
+import pytest
+
+from conftest import add_handler_path, load_handler_app
+
+add_handler_path('coalesce_events')
+
+from event_buffer import LocalEventBuffer, LocalFlushQueue  # noqa: E402
+
+coalesce_events_app = load_handler_app('coalesce_events')
+CoalesceEvents = coalesce_events_app.CoalesceEvents
+
+MICROSECONDS = coalesce_events_app.MICROSECONDS
+QUIET_WINDOW_SECONDS = 60
+MAX_WAIT_SECONDS = 600
+# Some time well after the epoch, in microseconds like the buffer
+START = 1700000000 * MICROSECONDS
+
+# Step functions execution names, at most 80 letters, numbers, - and _
+RE_EXECUTION_NAME = re.compile(r'^[\w\-]{1,80}$')
+
+
+def make_event(arns=None, account='123456789012', region='us-west-2', detail_type='Tag Change on Resource'):
+    return {
+        'account': account,
+        'region': region,
+        'detail-type': detail_type,
+        'resources': arns or []
+    }
+
+
+class Builder():
+    """Records the builder executions instead of starting them"""
+
+    def __init__(self):
+        self.executions = {}
+
+    def __call__(self, name, builder_input):
+        # A name already used is the same execution, like step functions
+        self.executions.setdefault(name, builder_input)
+
+
+@pytest.fixture
+def builder():
+    return Builder()
+
+
+@pytest.fixture
+def coalescer(builder):
+    return CoalesceEvents(LocalEventBuffer(), LocalFlushQueue(), start_builder=builder,
+                          quiet_window_seconds=QUIET_WINDOW_SECONDS, max_wait_seconds=MAX_WAIT_SECONDS)
+
+
+def seconds(count):
+    return int(count * MICROSECONDS)
+
+
+def test_every_event_schedules_a_flush_after_the_quiet_window(coalescer):
+    entry_id = coalescer.add_event(make_event(['arn:1']), received_at=START)
+
+    [(deliver_at, message)] = coalescer.flush_queue.messages
+
+    assert message == {'account': '123456789012', 'region': 'us-west-2', 'entryId': entry_id}
+    assert coalescer.flush_queue.pop_due(deliver_at - 1) == []
+    assert coalescer.flush_queue.pop_due(deliver_at) == [message]
+
+
+def test_quiet_account_is_flushed_once(coalescer, builder):
+    coalescer.add_event(make_event(['arn:1']), received_at=START)
+    coalescer.add_event(make_event(['arn:2', 'arn:1']), received_at=START + seconds(5))
+
+    first, second = [message for _, message in coalescer.flush_queue.messages]
+
+    # A newer event arrived, its own flush takes everything
+    assert coalescer.flush(first, now=START + seconds(60)) is None
+    assert coalescer.flush(second, now=START + seconds(65)) == {
+        **make_event(['arn:1', 'arn:2']), 'coalescedEvents': 2
+    }
+    assert len(builder.executions) == 1
+
+    # Delivered twice, nothing is left to flush
+    assert coalescer.flush(second, now=START + seconds(66)) is None
+    assert len(builder.executions) == 1
+
+
+def test_busy_account_is_flushed_after_the_max_wait(coalescer, builder):
+    coalescer.add_event(make_event(['arn:1']), received_at=START)
+    first = coalescer.flush_queue.messages[0][1]
+    coalescer.add_event(make_event(['arn:2']), received_at=START + seconds(MAX_WAIT_SECONDS - 1))
+
+    assert coalescer.flush(first, now=START + seconds(MAX_WAIT_SECONDS - 1)) is None
+    assert coalescer.flush(first, now=START + seconds(MAX_WAIT_SECONDS))['resources'] == ['arn:1', 'arn:2']
+    assert len(builder.executions) == 1
+
+
+def test_accounts_are_buffered_apart(coalescer, builder):
+    coalescer.add_event(make_event(['arn:1'], account='111111111111'), received_at=START)
+    coalescer.add_event(make_event(['arn:2'], account='222222222222'), received_at=START + 1)
+
+    for _, message in coalescer.flush_queue.messages:
+        coalescer.flush(message, now=START + seconds(60))
+
+    assert sorted(builder_input['resources'] for builder_input in builder.executions.values()) == [
+        ['arn:1'], ['arn:2']
+    ]
+
+
+def test_event_without_resources_sweeps_everything(coalescer):
+    coalescer.add_event(make_event(['arn:1']), received_at=START)
+    coalescer.add_event(make_event(detail_type='AWS API Call via CloudTrail'), received_at=START + 1)
+
+    builder_input = coalescer.flush(coalescer.flush_queue.messages[-1][1], now=START + seconds(60))
+
+    assert builder_input['mode'] == 'full'
+    assert builder_input['coalescedEvents'] == 2
+
+
+def test_event_added_during_a_flush_is_kept(coalescer, builder):
+    coalescer.add_event(make_event(['arn:1']), received_at=START)
+    message = coalescer.flush_queue.messages[0][1]
+
+    def start_builder(name, builder_input):
+        # Lands after the buffer was read, before the read entries are deleted
+        coalescer.add_event(make_event(['arn:2']), received_at=START + seconds(61))
+        builder(name, builder_input)
+
+    coalescer.start_builder = start_builder
+
+    assert coalescer.flush(message, now=START + seconds(60))['resources'] == ['arn:1']
+
+    [(entry_id, event)] = coalescer.event_buffer.list('123456789012', 'us-west-2')
+
+    assert event['resources'] == ['arn:2']
+
+    # Its own flush starts a second builder with just that event
+    coalescer.start_builder = builder
+    late_message = coalescer.flush_queue.messages[-1][1]
+
+    assert late_message['entryId'] == entry_id
+    assert coalescer.flush(late_message, now=START + seconds(121))['resources'] == ['arn:2']
+    assert len(builder.executions) == 2
+
+
+@pytest.mark.parametrize('region', ['us-west-2', 'ap-southeast-2', 'ap-northeast-3', 'us-gov-west-1'])
+def test_execution_name_is_valid(coalescer, builder, region):
+    coalescer.add_event(make_event(['arn:1'], region=region), received_at=START)
+    coalescer.flush(coalescer.flush_queue.messages[0][1], now=START + seconds(60))
+
+    [name] = builder.executions
+
+    assert RE_EXECUTION_NAME.match(name)
+    assert name.startswith(f'coalesced-123456789012-{region}-')
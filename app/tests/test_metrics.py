@@ -0,0 +1,141 @@
+import json
+
+import pytest
+
+from cloudwedge.utils import metrics as metrics_module
+from cloudwedge.utils.metrics import EmfSink, LocalMetricsCollector, Metrics
+
+
+@pytest.fixture
+def collector():
+    return LocalMetricsCollector()
+
+
+@pytest.fixture(autouse=True)
+def fixed_timestamp(monkeypatch):
+    monkeypatch.setattr(metrics_module.time, 'time', lambda: 1700000000.5)
+
+
+def test_emf_line_shape(collector):
+    metrics = Metrics('CreateStacks', account='123456789012', sink=collector, namespace='CloudWedgeTest')
+    metrics.count('Alarms', 3, phase='alarmsBuild', owner='team')
+    metrics.count('Alarms', 4, phase='alarmsBuild', owner='team')
+    metrics.count('TemplateBytes', 2048, unit='Bytes', phase='alarmsBuild', owner='team')
+    metrics.flush()
+
+    assert collector.documents == [{
+        '_aws': {
+            'Timestamp': 1700000000500,
+            'CloudWatchMetrics': [{
+                'Namespace': 'CloudWedgeTest',
+                'Dimensions': [['Account', 'Handler', 'Owner', 'Phase'], ['Handler', 'Phase']],
+                'Metrics': [{'Name': 'Alarms', 'Unit': 'Count'}, {'Name': 'TemplateBytes', 'Unit': 'Bytes'}]
+            }]
+        },
+        'Account': '123456789012',
+        'Handler': 'CreateStacks',
+        'Owner': 'team',
+        'Phase': 'alarmsBuild',
+        'Alarms': [3, 4],
+        'TemplateBytes': [2048]
+    }]
+
+
+def test_each_set_of_dimensions_is_its_own_line(collector):
+    metrics = Metrics('GetResources', sink=collector)
+    metrics.count('Resources', 5, phase='discovery', service='ec2')
+    metrics.count('Resources', 2, phase='discovery', service='sqs')
+    # None dimensions are left off
+    metrics.count('Resources', 7, phase='discovery', service=None)
+    metrics.flush()
+
+    assert [document.get('Service') for document in collector.documents] == ['ec2', 'sqs', None]
+    assert collector.get_values('Resources', phase='discovery') == [5, 2, 7]
+    assert collector.get_values('Resources', service='sqs') == [2]
+
+
+def test_handler_only_line_has_no_rollup(collector):
+    metrics = Metrics('IngestAlert', sink=collector)
+    metrics.count('Records', 1, handler='IngestAlert')
+    metrics.count('Records', 1, phase='parse')
+    metrics.flush()
+
+    assert [document['_aws']['CloudWatchMetrics'][0]['Dimensions'] for document in collector.documents] == [
+        [['Handler']], [['Handler', 'Phase']]
+    ]
+
+
+def test_lines_are_split_to_the_emf_limits(collector):
+    metrics = Metrics('CreateStacks', sink=collector)
+
+    for index in range(250):
+        metrics.count('Alarms', index)
+
+    for index in range(150):
+        metrics.count(f'Metric{index}', 1)
+
+    metrics.flush()
+
+    for document in collector.documents:
+        names = [metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']]
+
+        assert len(names) <= 100
+        assert all(len(document[name]) <= 100 for name in names)
+
+    assert collector.get_values('Alarms') == list(range(250))
+    assert len(collector.documents) == 4
+
+
+def test_phase_is_timed_when_the_block_raises(collector):
+    metrics = Metrics('DeployStack', sink=collector)
+
+    with pytest.raises(ValueError):
+        with metrics.phase('deploy', stackType='alarms'):
+            raise ValueError('failed')
+
+    metrics.flush()
+
+    [latency] = collector.get_values('PhaseLatency', phase='deploy', stackType='alarms')
+
+    assert latency >= 0
+    assert collector.documents[0]['_aws']['CloudWatchMetrics'][0]['Metrics'] == [
+        {'Name': 'PhaseLatency', 'Unit': 'Milliseconds'}
+    ]
+
+
+def test_flush_empties_the_run(collector):
+    metrics = Metrics('CreateStacks', sink=collector)
+    metrics.count('Alarms', 1)
+    metrics.flush()
+    metrics.flush()
+
+    assert len(collector.documents) == 1
+
+
+def test_disabled_metrics_record_nothing(collector):
+    metrics = Metrics('CreateStacks', sink=collector, enabled=False)
+    metrics.count('Alarms', 1)
+    metrics.flush()
+
+    assert collector.documents == []
+
+
+def test_failing_sink_doesnt_fail_the_run():
+    class BrokenSink():
+        def emit(self, document):
+            raise OSError('closed')
+
+    metrics = Metrics('CreateStacks', sink=BrokenSink())
+    metrics.count('Alarms', 1)
+    metrics.flush()
+
+
+def test_emf_sink_prints_one_compact_line(capsys):
+    metrics = Metrics('CreateStacks', sink=EmfSink())
+    metrics.count('Alarms', 2, phase='alarmsBuild')
+    metrics.flush()
+
+    [line] = capsys.readouterr().out.splitlines()
+
+    assert ' ' not in line
+    assert json.loads(line)['Alarms'] == [2]
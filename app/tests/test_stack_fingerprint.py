@@ -0,0 +1,56 @@
+from conftest import add_handler_path
+
+add_handler_path('create_stacks')
+
+import stack_fingerprint  # noqa: E402
+from stack_fingerprint import StackFingerprint  # noqa: E402
+
+
+def make_resource(unique_id, tags=None):
+    return {
+        'uniqueId': unique_id,
+        'name': unique_id,
+        'cloudwatchDimensionId': unique_id,
+        'owner': 'team',
+        'tags': tags or [{'Key': 'cloudwedge:active', 'Value': 'true'}]
+    }
+
+
+def make_owner_resources(*resources):
+    return {'sqs': list(resources)}
+
+
+def test_order_doesnt_change_the_fingerprints():
+    tags = [{'Key': 'cloudwedge:active', 'Value': 'true'}, {'Key': 'cloudwedge:level', 'Value': 'high'}]
+    first = make_owner_resources(make_resource('queue-1', tags), make_resource('queue-2'))
+    second = make_owner_resources(make_resource('queue-2'), make_resource('queue-1', tags[::-1]))
+
+    assert StackFingerprint.get_alarms_fingerprint(first) == StackFingerprint.get_alarms_fingerprint(second)
+    assert StackFingerprint.get_dashboard_fingerprint(first) == StackFingerprint.get_dashboard_fingerprint(second)
+
+
+def test_tag_change_only_changes_the_alarms_fingerprint():
+    before = make_owner_resources(make_resource('queue-1'))
+    after = make_owner_resources(make_resource('queue-1', [{'Key': 'cloudwedge:level', 'Value': 'critical'}]))
+
+    assert StackFingerprint.get_alarms_fingerprint(before) != StackFingerprint.get_alarms_fingerprint(after)
+    assert StackFingerprint.get_dashboard_fingerprint(before) == StackFingerprint.get_dashboard_fingerprint(after)
+
+
+def test_new_resource_changes_both_fingerprints():
+    before = make_owner_resources(make_resource('queue-1'))
+    after = make_owner_resources(make_resource('queue-1'), make_resource('queue-2'))
+
+    assert StackFingerprint.get_alarms_fingerprint(before) != StackFingerprint.get_alarms_fingerprint(after)
+    assert StackFingerprint.get_dashboard_fingerprint(before) != StackFingerprint.get_dashboard_fingerprint(after)
+
+
+def test_schema_version_bump_changes_both_fingerprints(monkeypatch):
+    owner_resources = make_owner_resources(make_resource('queue-1'))
+    alarms = StackFingerprint.get_alarms_fingerprint(owner_resources)
+    dashboard = StackFingerprint.get_dashboard_fingerprint(owner_resources)
+
+    monkeypatch.setattr(stack_fingerprint, 'TEMPLATE_SCHEMA_VERSION', stack_fingerprint.TEMPLATE_SCHEMA_VERSION + 1)
+
+    assert StackFingerprint.get_alarms_fingerprint(owner_resources) != alarms
+    assert StackFingerprint.get_dashboard_fingerprint(owner_resources) != dashboard
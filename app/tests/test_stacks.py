@@ -0,0 +1,83 @@
+import pytest
+
+from cloudwedge.utils.stacks import (STACK_TYPE_ALARMS, STACK_TYPE_DASHBOARD, get_alarms_stack_name,
+                                     get_dashboard_stack_name, get_shard_index, parse_stack_name)
+
+
+@pytest.mark.parametrize('stack_name, expected', [
+    ('cloudwedge-autogen-team-alarms-stack', ('team', STACK_TYPE_ALARMS, None, 0)),
+    ('cloudwedge-autogen-team-alarms-3-stack', ('team', STACK_TYPE_ALARMS, None, 3)),
+    ('cloudwedge-autogen-team-dashboard-stack', ('team', STACK_TYPE_DASHBOARD, None, 0)),
+    ('cloudwedge-autogen-team-dashboard-12-stack', ('team', STACK_TYPE_DASHBOARD, None, 12)),
+    ('cloudwedge-autogen-team-alarms-sqs-stack', ('team', STACK_TYPE_ALARMS, 'sqs', 0)),
+    ('cloudwedge-autogen-team-alarms-ec2-2-stack', ('team', STACK_TYPE_ALARMS, 'ec2', 2)),
+    # Owners with dashes, and with the stack types in them
+    ('cloudwedge-autogen-web-team-alarms-stack', ('web-team', STACK_TYPE_ALARMS, None, 0)),
+    ('cloudwedge-autogen-web-team-7-alarms-stack', ('web-team-7', STACK_TYPE_ALARMS, None, 0)),
+    ('cloudwedge-autogen-ops-alarms-alarms-stack', ('ops-alarms', STACK_TYPE_ALARMS, None, 0)),
+    ('cloudwedge-autogen-ops-alarms-dashboard-1-stack', ('ops-alarms', STACK_TYPE_DASHBOARD, None, 1)),
+    ('cloudwedge-autogen-ops-dashboard-alarms-rds-4-stack', ('ops-dashboard', STACK_TYPE_ALARMS, 'rds', 4)),
+])
+def test_parse_stack_name(stack_name, expected):
+    stack = parse_stack_name(stack_name)
+
+    assert (stack['owner'], stack['type'], stack['service'], stack['shard']) == expected
+
+
+@pytest.mark.parametrize('stack_name', [
+    'cloudwedge-autogen-team-stack',
+    'cloudwedge-autogen-team-alarms',
+    'cloudwedge-team-alarms-stack',
+    'cloudwedge-autogen-team-alarms-SQS-stack',
+    'my-own-alarms-stack',
+])
+def test_parse_stack_name_not_ours(stack_name):
+    assert parse_stack_name(stack_name) is None
+
+
+@pytest.mark.parametrize('owner', ['team', 'web-team', 'web-team-7', 'ops-alarms', 'ops-dashboard', 'a-1-b'])
+@pytest.mark.parametrize('shard', [0, 1, 15])
+@pytest.mark.parametrize('service', [None, 'sqs', 'autoscalinggroup'])
+def test_stack_names_round_trip(owner, shard, service):
+    assert parse_stack_name(get_alarms_stack_name(owner, shard, service)) == {
+        'owner': owner, 'type': STACK_TYPE_ALARMS, 'service': service, 'shard': shard
+    }
+
+    assert parse_stack_name(get_dashboard_stack_name(owner, shard)) == {
+        'owner': owner, 'type': STACK_TYPE_DASHBOARD, 'service': None, 'shard': shard
+    }
+
+
+def test_shard_zero_keeps_the_unsharded_name():
+    assert get_alarms_stack_name('team') == 'cloudwedge-autogen-team-alarms-stack'
+    assert get_alarms_stack_name('team', 0) == get_alarms_stack_name('team')
+    assert get_dashboard_stack_name('team', 0) == 'cloudwedge-autogen-team-dashboard-stack'
+
+
+@pytest.mark.parametrize('unique_id, shard_count, expected', [
+    # md5 of the uniqueId modulo the shard count, fixed so a change to it is caught
+    ('i-0123456789abcdef0', 1, 0),
+    ('i-0123456789abcdef0', 2, 1),
+    ('i-0123456789abcdef0', 8, 7),
+    ('my-queue', 4, 3),
+    ('my-queue', 64, 39),
+])
+def test_shard_index_is_stable(unique_id, shard_count, expected):
+    assert get_shard_index(unique_id, shard_count) == expected
+
+
+def test_doubling_the_shards_splits_each_shard_in_two():
+    unique_ids = [f'resource-{index}' for index in range(500)]
+
+    for unique_id in unique_ids:
+        # A resource in shard n of 2n lands in n or n + count, never anywhere else
+        assert get_shard_index(unique_id, 8) % 4 == get_shard_index(unique_id, 4)
+
+
+def test_shard_index_spreads_resources():
+    counts = [0] * 4
+
+    for index in range(1000):
+        counts[get_shard_index(f'resource-{index}', 4)] += 1
+
+    assert all(150 < count < 350 for count in counts)